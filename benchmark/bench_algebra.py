@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+@file: bench_algebra.py
+@time: 2021/3/1 2:30 下午
+@desc: Building2Sub operator chains and joins on synthetic campuses, bitmap operators against the old dict / list ones
+       run from the project root: python -m benchmark.bench_algebra
+
+"""
+
+import os
+import tempfile
+import time
+
+import numpy as np
+from rdflib import Graph
+
+from config import SUB_FLAG
+from hvacbrick.building2 import Building2, load_building_index
+from hvacbrick.namespace import HK, BF, BRICK, RDF
+
+SCALES = [25, 100, 400]  # AHUs, 20 VAVs per AHU and 6 points per VAV
+REPEAT = 5
+
+POINT_TYPES = ['Temperature_Sensor', 'Flow_Sensor', 'Setpoint_Sensor']
+
+
+def campus_graph(n_ahu, vavs_per_ahu=20):
+    """ chillers feed AHUs feed VAVs, every VAV has a room and two points of each type """
+    g = Graph()
+    for a in range(n_ahu):
+        ahu = HK['AHU_%d' % a]
+        g.add((HK['Chiller_%d' % (a % 10)], BF['feeds'], ahu))
+        g.add((ahu, RDF['type'], BRICK['AHU']))
+        for v in range(vavs_per_ahu):
+            vav = HK['VAV_%d_%d' % (a, v)]
+            g.add((ahu, BF['feeds'], vav))
+            g.add((vav, RDF['type'], BRICK['VAV']))
+            g.add((vav, BF['hasLocation'], HK['Room_%d_%d' % (a, v)]))
+            for k in range(2 * len(POINT_TYPES)):
+                point = HK['Pt_%d_%d_%d' % (a, v, k)]
+                g.add((vav, BF['hasPoint'], point))
+                g.add((point, RDF['type'], BRICK[POINT_TYPES[k % len(POINT_TYPES)]]))
+    return g
+
+
+def chains(b):
+    """ COP / ECP / FDD like queries, 5 - 8 operators each """
+    s, f = b.extract_sub_system, b.extract_sub_functionality
+    return [
+        ((s('CHILLER') % s('AHU')) % s('VAV')) * (f('TEMPERATURE') + f('FLOW_RATE') + f('SETPOINT')) - f('SETPOINT'),
+        (s('AHU') + s('VAV') - (s('CHILLER') % s('AHU'))) * (f('TEMPERATURE') + f('FLOW_RATE')),
+        (s('VAV') * (f('TEMPERATURE') + f('SETPOINT')) + (s('AHU') % s('VAV')) * f('FLOW_RATE')) - f('SETPOINT'),
+    ]
+
+
+def legacy_leaf(ind, sub):
+    """ the old representation: dict of storage tables, or a list of sensor ids """
+    if sub.sys_func_flag == SUB_FLAG['system']:
+        return 's', {i: ind.make_segment(i) for i in sub.ids.tolist()}
+    return 'f', sub.ids.tolist()
+
+
+def legacy_op(op, x, y):
+    """ the old operators: dict updates, a set per segment for s*f, set(feeds) for % """
+    (kx, a), (ky, b) = x, y
+    if op == '+':
+        if kx == 's':
+            d = {}
+            d.update(a)
+            d.update(b)
+            return 's', d
+        return 'f', sorted(set(a + b))
+    if op == '%':
+        fed = set()
+        for table in a.values():
+            fed.update(table['inter']['feeds'].tolist())
+        return 's', {k: v for k, v in b.items() if k in fed}
+    if op == '-' and kx == ky:
+        if kx == 's':
+            return 's', {k: v for k, v in a.items() if k not in b}
+        return 'f', sorted(set(a) - set(b))
+    if kx == 'f':
+        (kx, a), (ky, b) = y, x
+    keep = set(b)
+    d = {}
+    for k, table in a.items():
+        intra = dict(table['intra'])
+        points = table['intra']['hasPoint'].tolist()
+        intra['hasPoint'] = np.array([p for p in points if (p in keep) == (op == '*')], dtype=np.int32)
+        d[k] = {'intra': intra, 'inter': table['inter']}
+    return 's', d
+
+
+def legacy_chains(ind, b):
+    s = lambda name: legacy_leaf(ind, b.extract_sub_system(name))
+    f = lambda name: legacy_leaf(ind, b.extract_sub_functionality(name))
+    op = legacy_op
+    return [
+        op('-', op('*', op('%', op('%', s('CHILLER'), s('AHU')), s('VAV')),
+                   op('+', op('+', f('TEMPERATURE'), f('FLOW_RATE')), f('SETPOINT'))), f('SETPOINT')),
+        op('*', op('-', op('+', s('AHU'), s('VAV')), op('%', s('CHILLER'), s('AHU'))),
+           op('+', f('TEMPERATURE'), f('FLOW_RATE'))),
+        op('-', op('+', op('*', s('VAV'), op('+', f('TEMPERATURE'), f('SETPOINT'))),
+                   op('*', op('%', s('AHU'), s('VAV')), f('FLOW_RATE'))), f('SETPOINT')),
+    ]
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        result = func(*args)
+    return result, (time.perf_counter() - start) / REPEAT
+
+
+def normalized(result):
+    kind, value = result
+    if kind == 'f':
+        return sorted(value)
+    return {k: sorted(v['intra']['hasPoint'].tolist()) for k, v in value.items()}
+
+
+def legacy_join(ind, b):
+    """ AHU % VAV the old way: a python set of every fed entity, tested per VAV """
+    return legacy_op('%', legacy_leaf(ind, b.extract_sub_system('AHU')), legacy_leaf(ind, b.extract_sub_system('VAV')))
+
+
+def joins(b):
+    ahu, vav, chiller = b.extract_sub_system('AHU'), b.extract_sub_system('VAV'), b.extract_sub_system('CHILLER')
+    return ahu % vav, chiller.join(vav, max_hops=2)
+
+
+def main():
+    print("%6s %8s %14s %14s %16s %14s %14s" % ('AHUs', 'points', 'legacy(s)', 'bitmap(s)', 'bitmap+dict(s)',
+                                                'legacy %(s)', 'joins(s)'))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n in SCALES:
+            ttl_path = os.path.join(tmp_dir, 'campus_%d.ttl' % n)
+            campus_graph(n).serialize(destination=ttl_path, format='turtle')
+            b = Building2('campus_%d' % n, ttl_path=ttl_path)
+            ind = load_building_index(ttl_path)
+
+            legacy, legacy_time = timed(legacy_chains, ind, b)
+            bitmap, bitmap_time = timed(chains, b)
+            _, dict_time = timed(lambda: [sub.sub_index for sub in chains(b)])
+            for old, new in zip(legacy, bitmap):
+                kind = 's' if new.sys_func_flag == SUB_FLAG['system'] else 'f'
+                assert normalized(old) == normalized((kind, new.sub_index))
+
+            legacy_joined, legacy_join_time = timed(legacy_join, ind, b)
+            (joined, bounded), join_time = timed(joins, b)
+            assert sorted(legacy_joined[1]) == joined.ids.tolist() == bounded.ids.tolist()
+
+            print("%6d %8d %14.6f %14.6f %16.6f %14.6f %14.6f" % (n, len(ind.index_func['TEMPERATURE']) * 3,
+                                                                  legacy_time, bitmap_time, dict_time,
+                                                                  legacy_join_time, join_time))
+
+
+if __name__ == '__main__':
+    main()
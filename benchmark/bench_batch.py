@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+@file: bench_batch.py
+@time: 2021/3/6 4:40 下午
+@desc: queries per second of a 1,000 query FDD batch (20 queries per building, 50 buildings):
+       one energon() call per query against energon_batch(), from a cold start and warm
+       run from the project root: python -m benchmark.bench_batch
+
+"""
+
+import contextlib
+import io
+import itertools
+import os
+import tempfile
+import time
+
+from benchmark.bench_planner import application_graph
+from benchmark.bench_portfolio import reset
+from config import SUBEXPRESSION_CACHE
+from engine.engineQL import energon, energon_batch
+
+BUILDINGS = 50
+AHUS = 5  # per building
+PROCESSES = [1, None]  # energon_batch index pool: in this process, one worker per cpu
+REPEAT = 5
+
+POINTS = ['Temperature', 'Setpoint', 'Pressure', 'Signal', 'Flow_Rate']
+# 20 FDD rules per building: an equipment family and two or three of its points
+SELECTS = ["%s(B) * (%s)" % (equipment, ' + '.join('%s(B)' % point for point in points))
+           for equipment in ['AHU', 'VAV']
+           for points in list(itertools.combinations(POINTS, 2))]
+SELECTS = SELECTS[:20]
+
+
+def batch():
+    return [("SELECT %s FROM Building B WHERE B.BuildingID = :building" % select, {'building': 'site_%d' % b})
+            for b in range(BUILDINGS) for select in SELECTS]
+
+
+def timed(func, repeat=1, fresh_results=False):
+    """ mean seconds of a run; fresh_results: indexes stay, the sub-expression cache is emptied before each run """
+    total = 0
+    with contextlib.redirect_stdout(io.StringIO()):  # energon reports its own timings
+        for _ in range(repeat):
+            if fresh_results:
+                SUBEXPRESSION_CACHE.clear()
+            start = time.perf_counter()
+            result = func()
+            total += time.perf_counter() - start
+    return result, total / repeat
+
+
+def report(name, n, cold, indexed, warm):
+    print("%22s %10.3f %12.3f %10.0f %10.3f %10.0f" % (name, cold, indexed, n / indexed, warm, n / warm))
+
+
+def main():
+    queries = batch()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.makedirs(os.path.join(tmp_dir, 'ontology'))
+        for b in range(BUILDINGS):
+            application_graph(AHUS).serialize(destination=os.path.join(tmp_dir, 'ontology', 'site_%d.ttl' % b),
+                                              format='turtle')
+        cwd = os.getcwd()
+        os.chdir(tmp_dir)  # getBuilding() reads ./ontology/<BuildingID>.ttl
+        try:
+            print("%d queries, %d buildings" % (len(queries), BUILDINGS))
+            # cold: nothing indexed; indexed: indexes in memory, no cached results; warm: both in memory
+            print("%22s %10s %12s %10s %10s %10s" % ('', 'cold(s)', 'indexed(s)', 'qps', 'warm(s)', 'qps'))
+            runs = [('energon per query', lambda: [energon(q, **params) for q, params in queries])]
+            runs += [('energon_batch(%s)' % processes, lambda processes=processes: energon_batch(queries, processes))
+                     for processes in PROCESSES]
+            expected = None
+            for name, run in runs:
+                reset('ontology')
+                results, cold = timed(run)
+                _, indexed = timed(run, repeat=REPEAT, fresh_results=True)
+                _, warm = timed(run, repeat=REPEAT)
+                expected = expected or [r.ids.tolist() for r in results]
+                assert [r.ids.tolist() for r in results] == expected
+                report(name, len(queries), cold, indexed, warm)
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == '__main__':
+    main()
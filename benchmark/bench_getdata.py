@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+@file: bench_getdata.py
+@time: 2021/3/11 5:20 下午
+@desc: data stage of FDD queries on a building with one data column per point (thousands of columns):
+       the whole csv parsed then projected, against getData resolving its columns first
+       run from the project root: python -m benchmark.bench_getdata
+
+"""
+
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmark.bench_planner import application_graph
+from engine.columns import point_column
+from engine.engineQL import getData, prepare
+
+AHUS = 50
+ROWS = 2000  # three weeks of 15 minute samples
+REPEAT = 5
+
+QUERIES = ["SELECT AHU(B) * (Temperature(B) + Setpoint(B)) FROM Building B WHERE B.BuildingID = 'site' LABEL 'cop'",
+           "SELECT Chiller(B) % AHU(B) FROM Building B WHERE B.BuildingID = 'site' LABEL 'cop'",
+           "SELECT VAV(B) * Flow_Rate(B) FROM Building B WHERE B.BuildingID = 'site' LABEL 'cop'"]
+
+
+def write_data(graph, path):
+    """ a time column, one column per point of the graph, a label column """
+    points = sorted({point_column(o) for _, p, o in graph if str(p).endswith('hasPoint')})
+    data = pd.DataFrame(np.random.rand(ROWS, len(points)).round(4), columns=points)
+    data.insert(0, 'time', pd.date_range('2019-08-01', periods=ROWS, freq='15min').strftime('%Y-%m-%d %H:%M:%S'))
+    data['cop'] = np.random.rand(ROWS).round(3)
+    data.to_csv(path, index=False)
+    return len(points)
+
+
+def full_read(features, labels):
+    """ the data stage before: parse every column, keep the ones of the sub-ontology """
+    data = pd.read_csv('./data/site.csv')
+    return data[features], data[labels]
+
+
+def timed(func):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        result = func()
+    return result, (time.perf_counter() - start) / REPEAT
+
+
+def main():
+    graph = application_graph(AHUS)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.makedirs(os.path.join(tmp_dir, 'ontology'))
+        os.makedirs(os.path.join(tmp_dir, 'data'))
+        graph.serialize(destination=os.path.join(tmp_dir, 'ontology', 'site.ttl'), format='turtle')
+        n_points = write_data(graph, os.path.join(tmp_dir, 'data', 'site.csv'))
+        cwd = os.getcwd()
+        os.chdir(tmp_dir)  # ./ontology/<BuildingID>.ttl, ./data/<BuildingID>.csv
+        try:
+            print("%d points, %d rows, %.1f MB" % (n_points, ROWS, os.path.getsize('data/site.csv') / 1024 ** 2))
+            print("%-48s %8s %10s %14s %10s %12s" % ('select', 'columns', 'full(ms)', 'projected(ms)', 'read(MB)',
+                                                    'needed(MB)'))
+            for q in QUERIES:
+                prepared = prepare(q)
+                sub, labels = prepared.execute(), prepared.bind()['labels']
+                report = {}
+                (features, label_data), projected_time = timed(lambda: getData(sub, labels, report=report))
+                (full, _), full_time = timed(lambda: full_read(list(features.columns), list(label_data.columns)))
+                assert features.equals(full), q
+                print("%-48s %8d %10.1f %14.1f %10.2f %12.2f" % (
+                    q[len('SELECT '):q.index(' FROM')], report['columns'], full_time * 1000, projected_time * 1000,
+                    report['bytes read'] / 1024 ** 2, report['bytes needed'] / 1024 ** 2))
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == '__main__':
+    main()
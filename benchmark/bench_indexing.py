@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+@file: bench_indexing.py
+@time: 2021/2/20 4:10 下午
+@desc: scaling benchmark of Indexing.build_system_index on synthetic chiller plants,
+       and of the first system partition of a lazy Indexing
+       run from the project root: python -m benchmark.bench_indexing
+
+"""
+
+import os
+import re
+import tempfile
+import time
+
+from config import system_name_list
+from engine.indexing import Indexing, classify_subject
+from hvacbrick.buildingGraph import buildingGraph
+
+SCALES = [25, 250, 2500]
+
+
+def legacy_classify(g):
+    """ the old layer 2: rescan every subject (once per triple) for every system """
+    index_system = {system_name: dict() for system_name in system_name_list}
+    for key, d in index_system.items():
+        system_name = key.lower()
+        for sub_name in g.subjects():
+            if re.compile('(%s_)[0-9]' % system_name).search(sub_name.lower()) or \
+                    re.compile('(%s)[0-9]' % system_name).search(sub_name.lower()):
+                d.update({sub_name: {}})
+    return index_system
+
+
+def onepass_classify(g):
+    """ the new layer 2: one walk over the distinct subjects """
+    index_system = {system_name: dict() for system_name in system_name_list}
+    for sub_name in dict.fromkeys(g.subjects()):
+        for system_name in classify_subject(sub_name):
+            index_system[system_name].update({sub_name: {}})
+    return index_system
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    print("%8s %8s %14s %14s %14s %14s %14s" % ('chillers', 'triples', 'legacy(s)', 'one-pass(s)',
+                                                'build_sys(s)', 'us/chiller', 'lazy CHILLER(s)'))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n in SCALES:
+            building = 'bench_%d' % n
+            ttl_path = os.path.join(tmp_dir, building + '.ttl')
+            g = buildingGraph(building, n)
+            g.serialize(destination=ttl_path, format='turtle')
+
+            legacy, legacy_time = timed(legacy_classify, g)
+            onepass, onepass_time = timed(onepass_classify, g)
+            assert {k: set(v) for k, v in legacy.items()} == {k: set(v) for k, v in onepass.items()}
+
+            ind = Indexing(ttl_file_path=ttl_path)
+            ind.index_system = dict()
+            _, build_time = timed(ind.build_system_index)
+            assert len(ind.index_system['CHILLER']) == n
+
+            lazy_ind = Indexing(ttl_file_path=ttl_path, lazy=True)
+            chillers, lazy_time = timed(lazy_ind.index_system.__getitem__, 'CHILLER')
+            assert len(chillers) == n
+
+            print("%8d %8d %14.6f %14.6f %14.6f %14.2f %14.6f" % (n, len(g), legacy_time, onepass_time,
+                                                                  build_time, build_time / n * 1e6, lazy_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+@file: bench_parser.py
+@time: 2021/3/5 4:30 下午
+@desc: parse only, no execution: the queries of example.py through the pyparsing grammar and the hand-written parser
+       run from the project root: python -m benchmark.bench_parser
+
+"""
+
+import ast
+import time
+
+from benchmark.fuzz_parser import comparable
+from engine.engineQL import query_syntax
+from engine.parser import parse_query
+
+REPEAT = 50
+
+
+def example_queries(path='example.py'):
+    """ the query strings assigned in example.py, the last assignment of a name wins as it does there """
+    queries = {}
+    for node in ast.parse(open(path, encoding='utf-8').read()).body:
+        if isinstance(node, ast.Assign) and isinstance(node.value, ast.Constant) and \
+                isinstance(node.value.value, str) and 'SELECT' in node.value.value:
+            queries[node.targets[0].id] = node.value.value
+    return queries
+
+
+def timed(func, q):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        result = func(q)
+    return result, (time.perf_counter() - start) / REPEAT
+
+
+def main():
+    print("%18s %14s %16s %8s" % ('query', 'pyparsing(s)', 'hand-written(s)', 'speedup'))
+    for name, q in example_queries().items():
+        expected, pyparsing_time = timed(lambda text: query_syntax.parseString(text, parseAll=True)[0], q)
+        got, parser_time = timed(parse_query, q)
+        assert comparable(expected) == comparable(got)
+        print("%18s %14.6f %16.6f %8.1f" % (name, pyparsing_time, parser_time, pyparsing_time / parser_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+@file: bench_planner.py
+@time: 2021/3/3 7:20 下午
+@desc: the example.py application queries, evalAlgebra (literal tree walk) against the optimized plan DAG,
+       and the plan DAG served from a warm sub-expression cache (a dashboard repeating its queries);
+       a query is planned once when it is prepared (PreparedQuery, PLAN_CACHE), `plan(s)` is that one-off cost.
+       Times are the best of ROUNDS rounds of REPEAT runs, the compared functions take turns (a single cpu drifts)
+       run from the project root: python -m benchmark.bench_planner
+
+"""
+
+import os
+import tempfile
+import time
+
+from rdflib import Graph
+
+from config import SUB_FLAG
+from engine.engineQL import algebra, evalAlgebra
+from engine.planner import logical_plan, optimize, execute, plan_nodes, Leaf
+from hvacbrick.building2 import Building2
+from hvacbrick.namespace import HK, BF, BRICK, RDF
+from tools.cache import IndexCache
+
+SCALES = [25, 100, 400]  # AHUs
+REPEAT = 20
+ROUNDS = 25
+
+# SELECT clauses of fdd_for_ahu_query, cop_query and ecp_query in example.py
+QUERIES = {
+    'fdd': "AHU(B) * ((Temperature(B) + Setpoint(B)) + (Pressure(B) + Signal(B)))",
+    'cop': "(Chiller(B) * ((Temperature(B) + Flow_Rate(B)) + Power(B))) + (Temperature(B) * Weather(B))",
+    'ecp': "((Zone(B) * Temperature(B) )  + (Weather(B) * Temperature(B))) + "
+           "((AHU(B) % VAV(B)) * (Temperature(B) + Flow_Rate(B)))",
+}
+
+AHU_POINTS = ['Temperature_Sensor', 'Setpoint_Sensor', 'Pressure_Sensor', 'Signal_Sensor']
+VAV_POINTS = ['Temperature_Sensor', 'Flow_Sensor']
+CHILLER_POINTS = ['Temperature_Sensor', 'Flow_Sensor', 'Power_Sensor']
+
+
+def add_points(g, equipment, name, point_types):
+    for k, point_type in enumerate(point_types):
+        point = HK['%s_pt%d' % (name, k)]
+        g.add((equipment, BF['hasPoint'], point))
+        g.add((point, RDF['type'], BRICK[point_type]))
+
+
+def application_graph(n_ahu, vavs_per_ahu=10):
+    """ chillers, AHUs, VAVs, zones and weather stations with the points the application queries read """
+    g = Graph()
+    for c in range(max(n_ahu // 10, 1)):
+        add_points(g, HK['Chiller_%d' % c], 'Chiller_%d' % c, CHILLER_POINTS)
+        add_points(g, HK['Weather_%d' % c], 'Weather_%d' % c, ['Temperature_Sensor'])
+    for a in range(n_ahu):
+        ahu = HK['AHU_%d' % a]
+        g.add((HK['Chiller_%d' % (a // 10)], BF['feeds'], ahu))
+        add_points(g, ahu, 'AHU_%d' % a, AHU_POINTS)
+        for v in range(vavs_per_ahu):
+            vav = HK['VAV_%d_%d' % (a, v)]
+            g.add((ahu, BF['feeds'], vav))
+            add_points(g, vav, 'VAV_%d_%d' % (a, v), VAV_POINTS)
+            g.add((vav, BF['feeds'], HK['Zone_%d_%d' % (a, v)]))
+            add_points(g, HK['Zone_%d_%d' % (a, v)], 'Zone_%d_%d' % (a, v), ['Temperature_Sensor'])
+    return g
+
+
+def leaves(tree):
+    if len(tree) == 2:
+        return 1
+    return sum(leaves(tree[i]) for i in range(0, len(tree), 2))
+
+
+def timed(*funcs):
+    """ best mean seconds of each function """
+    best = [float('inf')] * len(funcs)
+    for _ in range(ROUNDS):
+        for k, func in enumerate(funcs):
+            start = time.perf_counter()
+            for _ in range(REPEAT):
+                func()
+            best[k] = min(best[k], (time.perf_counter() - start) / REPEAT)
+    return best
+
+
+def normalized(sub):
+    if sub.sys_func_flag == SUB_FLAG['functionality']:
+        return sub.ids.tolist()
+    return {k: sorted(v['intra']['hasPoint'].tolist()) for k, v in sub.sub_index.items()}
+
+
+def main():
+    print("%6s %6s %8s %8s %14s %14s %8s %10s %14s" % ('AHUs', 'query', 'leaves', 'dag', 'evalAlgebra(s)',
+                                                       'planned(s)', 'speedup', 'plan(s)', 'cached(s)'))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n in SCALES:
+            ttl_path = os.path.join(tmp_dir, 'app_%d.ttl' % n)
+            application_graph(n).serialize(destination=ttl_path, format='turtle')
+            buildings = {'B': Building2('app_%d' % n, ttl_path=ttl_path)}
+
+            for name, q in QUERIES.items():
+                tree = algebra.parseString(q)[0]
+                plan = optimize(logical_plan(tree))
+                planned = execute(plan, buildings)
+                assert normalized(evalAlgebra(tree, buildings)) == normalized(planned)
+                cache = IndexCache(budget=64 * 1024 ** 2)
+                execute(plan, buildings, cache=cache)
+                assert normalized(execute(plan, buildings, cache=cache)) == normalized(planned)
+
+                literal_time, planned_time, plan_time, cached_time = timed(
+                    lambda: evalAlgebra(tree, buildings), lambda: execute(plan, buildings),
+                    lambda: optimize(logical_plan(tree)), lambda: execute(plan, buildings, cache=cache))
+
+                dag = plan_nodes(plan)
+                print("%6d %6s %8d %8d %14.6f %14.6f %8.2f %10.6f %14.6f" % (
+                    n, name, leaves(tree), sum(isinstance(node, Leaf) for node in dag),
+                    literal_time, planned_time, literal_time / planned_time, plan_time, cached_time))
+
+
+if __name__ == '__main__':
+    main()
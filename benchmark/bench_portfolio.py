@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+@file: bench_portfolio.py
+@time: 2021/3/6 11:15 上午
+@desc: portfolio FDD over many sites: one energon call per building against one multi-building query,
+       cold (indexes built on the way) and warm
+       run from the project root: python -m benchmark.bench_portfolio
+
+"""
+
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from benchmark.bench_planner import application_graph
+from config import BUILDING_INDEX, SUBEXPRESSION_CACHE, INDEX_SNAPSHOT_SUFFIX
+from engine.engineQL import energon
+
+SITES = [10, 50]
+AHUS = 5  # per site
+
+FDD = "AHU(B) * ((Temperature(B) + Setpoint(B)) + (Pressure(B) + Signal(B)))"
+SINGLE = "SELECT %s FROM Building B WHERE B.BuildingID = :building AND B.Source = 'LOCAL'" % FDD
+PORTFOLIO = "SELECT %s FROM Building B WHERE B.BuildingID = :buildings AND B.Source = 'LOCAL'" % FDD
+
+
+def reset(ontology_dir):
+    """ cold start: no index in memory, no snapshot on disk """
+    BUILDING_INDEX.clear()
+    SUBEXPRESSION_CACHE.clear()
+    for name in os.listdir(ontology_dir):
+        if name.endswith(INDEX_SNAPSHOT_SUFFIX):
+            os.remove(os.path.join(ontology_dir, name))
+
+
+def timed(func):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # energon reports its own timings
+        result = func()
+    return result, time.perf_counter() - start
+
+
+def main():
+    print("%6s %16s %16s %16s %16s" % ('sites', 'sequential(s)', 'portfolio(s)', 'warm seq(s)', 'warm portf.(s)'))
+    for n in SITES:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.makedirs(os.path.join(tmp_dir, 'ontology'))
+            buildings = ['site_%d' % i for i in range(n)]
+            for building in buildings:
+                application_graph(AHUS).serialize(destination=os.path.join(tmp_dir, 'ontology', building + '.ttl'),
+                                                  format='turtle')
+            cwd = os.getcwd()
+            os.chdir(tmp_dir)  # getBuilding() reads ./ontology/<BuildingID>.ttl
+            try:
+                sequential = lambda: [energon(SINGLE, building=building) for building in buildings]
+                portfolio = lambda: energon(PORTFOLIO, buildings=buildings)
+                reset('ontology')
+                subs, sequential_time = timed(sequential)
+                _, warm_sequential_time = timed(sequential)
+                reset('ontology')
+                merged, portfolio_time = timed(portfolio)
+                _, warm_portfolio_time = timed(portfolio)
+                assert list(merged) == buildings
+                assert all(merged[b].ids.tolist() == sub.ids.tolist() for b, sub in zip(buildings, subs))
+            finally:
+                os.chdir(cwd)
+        print("%6d %16.6f %16.6f %16.6f %16.6f" % (n, sequential_time, portfolio_time,
+                                                   warm_sequential_time, warm_portfolio_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+@file: bench_prepare.py
+@time: 2021/3/4 3:10 下午
+@desc: DASQL parse per call against prepare(): the example.py queries with the building, the FILTER timestamp
+       and the label as bind parameters, rotating over the buildings of a campus
+       run from the project root: python -m benchmark.bench_prepare
+
+"""
+
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from benchmark.bench_planner import application_graph
+from config import PLAN_CACHE
+from engine.engineQL import prepare, PreparedQuery
+from engine.parser import parse_query
+
+BUILDINGS = 8
+REPEAT = 200
+
+# fdd_for_ahu_query, cop_query and ecp_query of example.py
+SELECTS = {
+    'fdd': "AHU(B) * ((Temperature(B) + Setpoint(B)) + (Pressure(B) + Signal(B)))",
+    'cop': "(Chiller(B) * ((Temperature(B) + Flow_Rate(B)) + Power(B))) + (Temperature(B) * Weather(B))",
+    'ecp': "((Zone(B) * Temperature(B) )  + (Weather(B) * Temperature(B))) + "
+           "((AHU(B) % VAV(B)) * (Temperature(B) + Flow_Rate(B)))",
+}
+
+TEMPLATE = """
+SELECT %s
+FROM Building B
+WHERE B.BuildingID = %s AND B.Source = 'LOCAL'
+FILTER B.TIMESTAMP > %s AND B.TIMESTAMP < '20191231'
+LABEL %s
+"""
+
+
+def literal_query(select, i):
+    return TEMPLATE % (select, "'app_%d'" % (i % BUILDINGS), "'201908%02d'" % (i % 28 + 1), "'cop'")
+
+
+def parameterized_query(select):
+    return TEMPLATE % (select, ':building', ':start', ':label')
+
+
+def params(i):
+    return {'building': 'app_%d' % (i % BUILDINGS), 'start': '201908%02d' % (i % 28 + 1), 'label': 'cop'}
+
+
+def timed(func):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # execute() reports its own timings
+        for i in range(REPEAT):
+            func(i)
+    return (time.perf_counter() - start) / REPEAT
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.makedirs(os.path.join(tmp_dir, 'ontology'))
+        for b in range(BUILDINGS):
+            application_graph(10 + b).serialize(destination=os.path.join(tmp_dir, 'ontology', 'app_%d.ttl' % b),
+                                                format='turtle')
+        cwd = os.getcwd()
+        os.chdir(tmp_dir)  # getBuilding() reads ./ontology/<BuildingID>.ttl
+        try:
+            print("%6s %14s %14s %14s %14s" % ('query', 'parse(s)', 'prepared(s)', 'parse+run(s)', 'prepared+run(s)'))
+            for name, select in SELECTS.items():
+                q = parameterized_query(select)
+                parse = lambda i: PreparedQuery(literal_query(select, i), parse_query(literal_query(select, i)))
+                prepared = lambda i: prepare(q).bind(**params(i))
+                run = lambda i: parse(i).execute()
+                prepared_run = lambda i: prepare(q).execute(**params(i))
+                timed(prepared_run)  # index the buildings first
+                print("%6s %14.6f %14.6f %14.6f %14.6f" % (name, timed(parse), timed(prepared),
+                                                           timed(run), timed(prepared_run)))
+        finally:
+            os.chdir(cwd)
+    print("parsed plans:", PLAN_CACHE.stats())
+
+
+if __name__ == '__main__':
+    main()
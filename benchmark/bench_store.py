@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+@file: bench_store.py
+@time: 2021/3/12 5:10 下午
+@desc: data stage reads from the csv (columns.read_columns) against the columnar store (store.read_store):
+       20 of 200 columns of a three year history, all of it and windows of a few weeks; time and peak memory allocated;
+       first checks the round trip of a file with late rows, and of int, bool and blank columns, ingested in small
+       chunks
+       run from the project root: python -m benchmark.bench_store
+
+"""
+
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from benchmark.bench_timefilter import COLUMNS, WINDOWS, write_data
+from engine.columns import ALL_TIME, read_columns, time_index_of, time_range
+from engine.store import ingest, read_store
+
+REPEAT = 5
+
+
+def measured(func):
+    """ (mean seconds, peak bytes allocated by one run) """
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        func()
+    seconds = (time.perf_counter() - start) / REPEAT
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def check_late_rows(tmp_dir):
+    """ rows of months written already (a late January row, a late February one): read back row for row """
+    data = pd.DataFrame({'time': pd.date_range('2019-01-01', periods=90, freq='D').strftime('%Y-%m-%d %H:%M:%S'),
+                         'value': np.arange(90.0), 'name': ['row %d' % i for i in range(90)]})
+    late = pd.DataFrame({'time': ['2019-01-15 12:00:00', '2019-02-03 00:00:00'], 'value': [-1.0, -2.0],
+                         'name': ['late january', 'late february']})
+    data = pd.concat([data.iloc[:50], late.iloc[:1], data.iloc[50:75], late.iloc[1:], data.iloc[75:]],
+                     ignore_index=True)
+    path = os.path.join(tmp_dir, 'late.csv')
+    data.to_csv(path, index=False)
+    manifest = ingest(path, os.path.join(tmp_dir, 'late'), chunk_rows=40)
+    names = [p['name'] for p in manifest['partitions']]
+    assert names == sorted(set(names)), names
+    expected = data.sort_values('time', kind='stable', ignore_index=True)
+    stored = read_store(os.path.join(tmp_dir, 'late'), list(data.columns))
+    assert len(stored) == len(expected), (len(stored), len(expected))
+    for column in data.columns:
+        assert (stored[column].to_numpy() == expected[column].to_numpy()).all(), column
+    print("late rows: %d rows in %d partitions read back" % (len(stored), len(names)))
+
+
+def check_dtypes(tmp_dir):
+    """ the store gives the frame the csv does: ints, booleans, blanks of numbers, booleans and text in some chunks """
+    rows = 120
+    data = pd.DataFrame({'time': pd.date_range('2019-01-01', periods=rows, freq='D').strftime('%Y-%m-%d %H:%M:%S'),
+                         'count': np.arange(rows), 'on': np.arange(rows) % 3 == 0,
+                         'count with blanks': [None if i == 100 else i for i in range(rows)],
+                         'on with blanks': [None if i == 10 else i % 2 == 0 for i in range(rows)],
+                         'name': ['row %d' % i for i in range(rows)],
+                         'name with blanks': [None if i % 7 == 0 else 'row %d' % i for i in range(rows)],
+                         'blank': [None] * rows})
+    path = os.path.join(tmp_dir, 'dtypes.csv')
+    data.to_csv(path, index=False)
+    ingest(path, os.path.join(tmp_dir, 'dtypes'), chunk_rows=40)
+    for window in [ALL_TIME, time_range([('>=', '20190201'), ('<', '20190315')])]:
+        expected = read_columns(path, list(data.columns), window=window)
+        stored = read_store(os.path.join(tmp_dir, 'dtypes'), list(data.columns), window=window)
+        assert stored.equals(expected), pd.DataFrame({'csv': expected.dtypes, 'store': stored.dtypes})
+    print("dtypes: %s read back as from the csv" % ', '.join(str(dtype) for dtype in expected.dtypes.unique()))
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        check_late_rows(tmp_dir)
+        check_dtypes(tmp_dir)
+        path = os.path.join(tmp_dir, 'site.csv')
+        store_dir = os.path.join(tmp_dir, 'store', 'site')
+        rows = write_data(path)
+        time_index_of(path)
+        start = time.perf_counter()
+        manifest = ingest(path, store_dir)
+        print("%d rows, %.1f MB csv, ingested in %.1f s into %d partitions" % (
+            rows, os.path.getsize(path) / 1024 ** 2, time.perf_counter() - start, len(manifest['partitions'])))
+        print("%10s %10s %10s %8s %12s %12s" % ('window', 'csv(ms)', 'store(ms)', 'x', 'csv(MB)', 'store(MB)'))
+        for name, begin, end in [('all', None, None)] + WINDOWS:
+            window = ALL_TIME if begin is None else time_range([('>=', begin), ('<', end)])
+            csv_time, csv_peak = measured(lambda: read_columns(path, COLUMNS, window=window))
+            store_time, store_peak = measured(lambda: read_store(store_dir, COLUMNS, window=window))
+            print("%10s %10.1f %10.1f %8.1f %12.1f %12.1f" % (name, csv_time * 1000, store_time * 1000,
+                                                             csv_time / store_time, csv_peak / 1024 ** 2,
+                                                             store_peak / 1024 ** 2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+@file: bench_stream.py
+@time: 2021/3/12 7:30 下午
+@desc: whole reads (columns.read_columns, store.read_store) against chunked ones (iter_columns, iter_store) of
+       20 of 200 columns of a three year history, windows of growing size; peak RSS of a fresh process per read,
+       over its RSS before the read, stays flat for the chunked reads
+       run from the project root: python -m benchmark.bench_stream
+
+"""
+
+import multiprocessing
+import os
+import tempfile
+import time
+
+from benchmark.bench_timefilter import COLUMNS, write_data
+from engine.columns import ALL_TIME, iter_columns, read_columns, time_index_of, time_range
+from engine.store import ingest, iter_store, read_store
+
+CHUNK_ROWS = 4096
+WINDOWS = [('1 week', '20200301', '20200308'), ('3 months', '20200101', '20200401'),
+           ('1 year', '20190101', '20200101'), ('all', None, None)]
+
+
+def status(field):
+    """ bytes of a /proc/self/status field, VmRSS or VmHWM (linux) """
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) * 1024
+
+
+def reset_peak_rss():
+    """ VmHWM back to the RSS now, it is otherwise inherited from the parent through fork and exec """
+    with open('/proc/self/clear_refs', 'w') as f:
+        f.write('5')
+
+
+def measure(read, source, begin, end):
+    """ in a fresh process: (rows, seconds, peak RSS over the RSS before the read) """
+    window = ALL_TIME if begin is None else time_range([('>=', begin), ('<', end)])
+    reset_peak_rss()
+    before = status('VmRSS')
+    start = time.perf_counter()
+    if read == 'csv':
+        rows = len(read_columns(source, COLUMNS, window=window))
+    elif read == 'store':
+        rows = len(read_store(source, COLUMNS, window=window))
+    elif read == 'csv chunks':
+        rows = sum(len(chunk) for chunk in iter_columns(source, COLUMNS, CHUNK_ROWS, window=window))
+    else:
+        rows = sum(len(chunk) for chunk in iter_store(source, COLUMNS, CHUNK_ROWS, window=window))
+    return rows, time.perf_counter() - start, status('VmHWM') - before
+
+
+def main():
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'site.csv')
+        store_dir = os.path.join(tmp_dir, 'store', 'site')
+        rows = write_data(path)
+        time_index_of(path)
+        ingest(path, store_dir)
+        print("%d rows, %.1f MB csv, chunks of %d rows" % (rows, os.path.getsize(path) / 1024 ** 2, CHUNK_ROWS))
+        print("%10s %8s %12s %10s %12s" % ('window', 'rows', 'read', 'time(ms)', 'peak RSS(MB)'))
+        for name, begin, end in WINDOWS:
+            for read, source in [('csv', path), ('csv chunks', path), ('store', store_dir),
+                                 ('store chunks', store_dir)]:
+                with context.Pool(1) as pool:
+                    n, seconds, peak = pool.apply(measure, (read, source, begin, end))
+                print("%10s %8d %12s %10.1f %12.1f" % (name, n, read, seconds * 1000, peak / 1024 ** 2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+@file: bench_timefilter.py
+@time: 2021/3/12 11:05 上午
+@desc: FILTER B.TIMESTAMP windows of a few weeks out of a three year history: the columns of a query read
+       from the whole data file and filtered, against the seek through the time index of columns.read_columns
+       run from the project root: python -m benchmark.bench_timefilter
+
+"""
+
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from engine.columns import ALL_TIME, in_range, read_columns, time_index_of, time_range, timestamps
+
+POINTS = 200
+YEARS = 3
+COLUMNS = ['Point_%d' % i for i in range(0, POINTS, 10)]  # the 20 columns a query reads
+WINDOWS = [('1 week', '20200301', '20200308'), ('4 weeks', '20200301', '20200329'),
+           ('1 year', '20190101', '20200101')]
+REPEAT = 5
+
+
+def write_data(path):
+    rows = YEARS * 365 * 96  # 15 minute samples
+    data = pd.DataFrame(np.random.rand(rows, POINTS).round(4), columns=['Point_%d' % i for i in range(POINTS)])
+    data.insert(0, 'time', pd.date_range('2018-01-01', periods=rows, freq='15min').strftime('%Y-%m-%d %H:%M:%S'))
+    data.to_csv(path, index=False)
+    return rows
+
+
+def scan(path, window):
+    """ before: every row of the columns parsed, then the window kept """
+    data = pd.read_csv(path, usecols=['time'] + COLUMNS)
+    return data[in_range(timestamps(data['time']), window)].reset_index(drop=True)
+
+
+def timed(func):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        result = func()
+    return result, (time.perf_counter() - start) / REPEAT
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'site.csv')
+        rows = write_data(path)
+        print("%d rows, %d points, %.1f MB" % (rows, POINTS, os.path.getsize(path) / 1024 ** 2))
+        start = time.perf_counter()
+        time_index_of(path)
+        print("time index built in %.1f ms" % ((time.perf_counter() - start) * 1000))
+        print("%10s %8s %10s %10s %10s" % ('window', 'rows', 'scan(ms)', 'seek(ms)', 'read(MB)'))
+        for name, begin, end in WINDOWS:
+            window = time_range([('>=', begin), ('<', end)])
+            expected, scan_time = timed(lambda: scan(path, window))
+            report = {}
+            data, seek_time = timed(lambda: read_columns(path, COLUMNS, report=report, window=window))
+            assert data.equals(expected), name
+            print("%10s %8d %10.1f %10.1f %10.2f" % (name, len(data), scan_time * 1000, seek_time * 1000,
+                                                    report['bytes read'] / 1024 ** 2))
+        _, full_time = timed(lambda: read_columns(path, COLUMNS, window=ALL_TIME))
+        print("%10s %8d %10.1f" % ('no filter', rows, full_time * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+@file: fuzz_parser.py
+@time: 2021/3/5 5:20 下午
+@desc: random DASQL queries (and one-character mutations of them) through the pyparsing grammar of engineQL
+       and the hand-written parser: the same tree, or both reject the query
+       run from the project root: python -m benchmark.fuzz_parser [n_queries] [seed]
+
+"""
+
+import random
+import sys
+
+from pyparsing import ParseException, ParseResults
+
+from engine.engineQL import query_syntax
+from engine.parser import Parameter, parse_query
+
+NAMES = ['VAV', 'AHU', 'Chiller', 'Temperature', 'Flow_Rate', 'Setpoint', 'Room', 'Filter', 'and', 'B2', '_x']
+KEYWORDS = ['SELECT', 'FROM', 'WHERE', 'FILTER', 'LABEL', 'AND', 'OR']
+LITERALS = ["'ecp'", '"hf2"', "'it''s'", "'a\\'b'", '"x\\x4f"', '42', '-7', '+3', '3.', '.5', '1.5e3', '2E-2', '7e',
+            ':building', ':start_1']
+MUTATIONS = '()%*+-/.,=<>!\'":_ 0123456789aBx\n'
+
+
+def space(rng):
+    return rng.choice(['', ' ', '  ', '\n\t', ' '])
+
+
+def keyword(rng, word):
+    return rng.choice([word, word.lower(), word.capitalize()])
+
+
+def algebra(rng, depth=0):
+    if depth > 3 or rng.random() < 0.35:
+        args = ','.join(space(rng) + rng.choice(['B', 'C']) for _ in range(rng.choice([1, 1, 1, 2])))
+        return '%s(%s)' % (rng.choice(NAMES), args)
+    if rng.random() < 0.1:
+        return '-' + space(rng) + algebra(rng, depth + 1)
+    if rng.random() < 0.25:
+        return '(' + space(rng) + algebra(rng, depth + 1) + space(rng) + ')'
+    op = rng.choice(['+', '-', '*', '/', '%', '%', '%2', '%10'])
+    return algebra(rng, depth + 1) + space(rng) + op + space(rng) + algebra(rng, depth + 1)
+
+
+def predicates(rng, depth=0):
+    if depth > 2 or rng.random() < 0.4:
+        return '%s.%s %s %s' % (rng.choice(['B', 'C']), rng.choice(['BuildingID', 'Source', 'TIMESTAMP']),
+                                rng.choice(['=', '>', '<', '>=', '<=', '!=']), rng.choice(LITERALS))
+    if rng.random() < 0.2:
+        return '(' + space(rng) + predicates(rng, depth + 1) + space(rng) + ')'
+    return predicates(rng, depth + 1) + ' ' + keyword(rng, rng.choice(['AND', 'OR'])) + ' ' + \
+        predicates(rng, depth + 1)
+
+
+def query(rng):
+    q = keyword(rng, 'SELECT') + ' ' + algebra(rng)
+    if rng.random() < 0.8:
+        q += ' %s %s' % (keyword(rng, 'FROM'), ', '.join(rng.choice(['Building', 'SubBuilding']) + ' ' +
+                                                        rng.choice(['B', 'C']) for _ in range(rng.choice([1, 2]))))
+        q += ' %s %s' % (keyword(rng, 'WHERE'), predicates(rng))
+        if rng.random() < 0.7:
+            q += ' %s %s' % (keyword(rng, 'FILTER'), predicates(rng))
+    if rng.random() < 0.6:
+        q += ' %s %s' % (keyword(rng, 'LABEL'), ', '.join(rng.choice(LITERALS) for _ in range(rng.choice([1, 2]))))
+    return space(rng) + q + space(rng)
+
+
+def mutate(rng, q):
+    i = rng.randrange(len(q))
+    choice = rng.random()
+    if choice < 0.4:
+        return q[:i] + q[i + 1:]
+    if choice < 0.7:
+        return q[:i] + rng.choice(MUTATIONS) + q[i:]
+    return q[:i] + rng.choice(MUTATIONS) + q[i + 1:]
+
+
+def comparable(tree):
+    """ ParseResults / lists -> nested tuples, Parameters by name """
+    if isinstance(tree, (ParseResults, list)):
+        return tuple(comparable(t) for t in tree)
+    if isinstance(tree, Parameter):
+        return ('Parameter', tree.name)
+    return (type(tree).__name__, tree)
+
+
+def reference(q):
+    try:
+        return comparable(query_syntax.parseString(q, parseAll=True)[0])
+    except ParseException:
+        return None
+
+
+def hand_written(q):
+    try:
+        return comparable(parse_query(q))
+    except ParseException:
+        return None
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rng = random.Random(int(sys.argv[2]) if len(sys.argv) > 2 else 0)
+    counts = {'same tree': 0, 'both reject': 0, 'mismatch': 0}
+    for i in range(n):
+        q = query(rng)
+        if i % 2:
+            q = mutate(rng, q)
+        expected, got = reference(q), hand_written(q)
+        if expected != got:
+            counts['mismatch'] += 1
+            print("mismatch: %r\n  pyparsing:    %s\n  hand-written: %s" % (q, expected, got))
+        elif expected is None:
+            counts['both reject'] += 1
+        else:
+            counts['same tree'] += 1
+    print(counts)
+    return counts['mismatch'] == 0
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+@file: load_server.py
+@time: 2021/3/8 3:30 下午
+@desc: load generator of engine/server.py: concurrent clients pipelining FDD queries, p50 / p99 latency and throughput;
+       starts a local server on a synthetic campus unless --port of a running one is given
+       run from the project root: python -m benchmark.load_server [--clients 16] [--requests 200] [--depth 8]
+
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmark.bench_batch import SELECTS
+from benchmark.bench_planner import application_graph
+
+BUILDINGS = 20
+AHUS = 5  # per building
+
+
+def requests(n, client):
+    for i in range(n):
+        k = client * n + i
+        yield json.dumps({'query': "SELECT %s FROM Building B WHERE B.BuildingID = :building" % SELECTS[k % len(SELECTS)],
+                          'params': {'building': 'site_%d' % (k % BUILDINGS)}, 'id': k})
+
+
+async def client(host, port, n, depth, client_id, latencies, errors):
+    """ keep `depth` requests in flight on one connection, responses come back in order """
+    reader, writer = await asyncio.open_connection(host, port, limit=2 ** 22)
+    sent = []
+    window = asyncio.Semaphore(depth)
+
+    async def send():
+        for line in requests(n, client_id):
+            await window.acquire()
+            sent.append(time.perf_counter())
+            writer.write((line + '\n').encode('utf-8'))
+            await writer.drain()
+
+    sender = asyncio.ensure_future(send())
+    for i in range(n):
+        response = json.loads(await reader.readline())
+        latencies.append(time.perf_counter() - sent[i])
+        if not response['ok']:
+            errors.append(response['error'])
+        window.release()
+    await sender
+    writer.close()
+
+
+async def load(host, port, clients, n, depth):
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*[client(host, port, n, depth, c, latencies, errors) for c in range(clients)])
+    return np.array(latencies), errors, time.perf_counter() - start
+
+
+def start_server(tmp_dir, port, workers):
+    os.makedirs(os.path.join(tmp_dir, 'ontology'))
+    for b in range(BUILDINGS):
+        application_graph(AHUS).serialize(destination=os.path.join(tmp_dir, 'ontology', 'site_%d.ttl' % b),
+                                          format='turtle')
+    command = [sys.executable, '-m', 'engine.server', '--port', str(port), '--warm-up', 'ontology']
+    if workers:
+        command += ['--workers', str(workers)]
+    env = dict(os.environ, PYTHONPATH=os.getcwd())
+    server = subprocess.Popen(command, cwd=tmp_dir, env=env, stdout=subprocess.PIPE, text=True)
+    for line in server.stdout:  # wait for the warm up
+        if 'listening' in line:
+            return server
+    raise RuntimeError("server did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Energon server load generator')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=None, help="a running server, default: start one")
+    parser.add_argument('--workers', type=int, default=None, help="workers of the server started here")
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=200, help="per client")
+    parser.add_argument('--depth', type=int, nargs='+', default=[1, 8], help="requests in flight per client")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        server = None
+        port = args.port
+        if port is None:
+            port = 17878
+            server = start_server(tmp_dir, port, args.workers)
+        try:
+            print("%8s %8s %10s %10s %10s %10s %8s" % ('clients', 'depth', 'requests', 'p50(ms)', 'p99(ms)', 'qps',
+                                                       'errors'))
+            for depth in args.depth:
+                latencies, errors, elapsed = asyncio.run(load(args.host, port, args.clients, args.requests, depth))
+                print("%8d %8d %10d %10.2f %10.2f %10.0f %8d" % (args.clients, depth, len(latencies),
+                                                                 np.percentile(latencies, 50) * 1000,
+                                                                 np.percentile(latencies, 99) * 1000,
+                                                                 len(latencies) / elapsed, len(errors)))
+                if errors:
+                    print("first error:", errors[0])
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -10,6 +10,8 @@
 
 import os
 from hvacbrick.namespace import *
+from tools.cache import IndexCache
+from tools.metrics import Metrics
 
 # project path
 PROJECT_PATH = os.path.abspath(
@@ -49,8 +51,65 @@ reverse_pairs_list = [
     # {BF['hasPart'], BF['isPartOf']}
 ]
 
-# Building Indexing global
-BUILDING_INDEX = {}
+# Building Indexing global, bounded by memory: ttl path -> Indexing;
+# an Indexing edited by apply_changes is pinned, its edits live only in memory and would be lost on eviction
+BUILDING_INDEX_MEMORY_BUDGET = 4 * 1024 ** 3  # bytes
+BUILDING_INDEX_EVICTION = 'LRU'  # or 'LFU'
+BUILDING_INDEX = IndexCache(budget=BUILDING_INDEX_MEMORY_BUDGET, policy=BUILDING_INDEX_EVICTION,
+                            pinned=lambda building_index: building_index.edited)
+
+# on-disk index snapshot, saved next to the ttl file as '<ttl path>.idx'
+INDEX_SNAPSHOT = True
+INDEX_SNAPSHOT_SUFFIX = '.idx'
+
+# build each system / functionality partition of an index on its first access;
+# cuts the cold start of a building that is queried for a few systems only, no snapshot is written
+INDEX_LAZY = False
+
+# build the index straight from the parser, without keeping an rdflib Graph (engine/ingest.py);
+# N-Triples ('.nt') ontologies are parsed in chunks by INDEX_INGEST_PROCESSES workers, default one per cpu
+INDEX_STREAM_INGEST = False
+INDEX_INGEST_PROCESSES = None
+
+# query-only workers: release each building's rdflib Graph once its index is built,
+# it is parsed again only when raw triples are asked for (Indexing.triples, incremental edits)
+INDEX_ONLY = False
+
+# evaluate SELECT through the optimized plan DAG (engine/planner.py) instead of walking the parsed algebra
+QUERY_OPTIMIZER = True
+
+# results of plan nodes (e.g. `AHU(B) % VAV(B)`) shared across queries, LRU bounded by memory;
+# keyed by the building's index version, an edit to the index makes its entries unreachable
+SUBEXPRESSION_CACHE_BUDGET = 256 * 1024 ** 2  # bytes, 0 disables the cache
+SUBEXPRESSION_CACHE = IndexCache(budget=SUBEXPRESSION_CACHE_BUDGET, policy='LRU')
+
+# parsed queries (engineQL.prepare) by query text, LRU over at most PLAN_CACHE_SIZE queries
+PLAN_CACHE_SIZE = 1024
+PLAN_CACHE = IndexCache(budget=PLAN_CACHE_SIZE, policy='LRU', sizer=lambda prepared: 1)
+
+# multi-building queries (several BuildingIDs per FROM alias): the buildings not indexed yet are indexed by
+# MULTI_BUILDING_PROCESSES workers, then the algebra runs per building on MULTI_BUILDING_THREADS threads;
+# None is one per cpu
+MULTI_BUILDING_PROCESSES = None
+MULTI_BUILDING_THREADS = None
+
+# building data files (engineQL.getData): ./data/<BuildingID>.csv, one column per point and a time column;
+# FILTER B.TIMESTAMP windows seek through a sparse index of the time column (every TIME_INDEX_STRIDE-th row),
+# saved next to the file as '<csv>.tix'
+DATA_TIME_COLUMN = 'time'
+TIME_INDEX_STRIDE = 256
+TIME_INDEX_SUFFIX = '.tix'
+
+# columnar store of the data files (engine/store.py): ./store/<BuildingID>/, ingested with
+# `python -m engine.store ./data`; getData reads a building's store instead of its csv while the store is fresh
+DATA_STORE = True
+STORE_CHUNK_ROWS = 65536  # rows of a data file read at a time by the ingest
+DATA_CHUNK_ROWS = 65536  # rows of the (features, labels) chunks of engineQL.iterData / energon_stream
+
+# counters and latency histograms of the query stages (parse, load, index, algebra, data, query),
+# see the `metrics` command of the shell and `--metrics-port` of engine/server.py; disabled, the timers do nothing
+METRICS_ENABLED = True
+METRICS = Metrics(enabled=METRICS_ENABLED)
 
 # system or functionality flag
 SUB_FLAG = {'system': 0, 'functionality': 1}
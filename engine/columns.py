@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+@file: columns.py
+@time: 2021/3/11 4:15 下午
+@desc: column-projected reads of the building data files (./data/<building>.csv, one column per point):
+       the header is read once per file version, a query parses only the columns of its sensors;
+       FILTER TIMESTAMP windows seek through a sparse time index saved next to the file ('<csv>.tix');
+       iter_columns reads them in chunks of rows, for extractions larger than memory
+
+"""
+
+from collections import namedtuple
+from functools import lru_cache
+import csv
+import io
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from config import DATA_TIME_COLUMN, TIME_INDEX_STRIDE, TIME_INDEX_SUFFIX
+
+LAYOUT_SAMPLE_BYTES = 1024 ** 2  # the head of a file sampled for the bytes of its columns
+SCAN_CHUNK_BYTES = 64 * 1024 ** 2  # a data file is scanned for its line ends in chunks of this size
+
+# bump when the time index layout changes, older sidecars are then rebuilt
+TIME_INDEX_FORMAT_VERSION = 1
+
+# columns of a data file, and the mean bytes of each column per line, from a sample of its first lines
+CsvLayout = namedtuple('CsvLayout', ['columns', 'positions', 'field_bytes', 'line_bytes', 'size'])
+
+# time window of FILTER B.TIMESTAMP predicates, bounds in ns since the epoch, None is unbounded
+TimeRange = namedtuple('TimeRange', ['start', 'end', 'start_inclusive', 'end_inclusive'])
+ALL_TIME = TimeRange(start=None, end=None, start_inclusive=True, end_inclusive=True)
+
+# sparse time index of a data file sorted by time: the time and byte offset of every TIME_INDEX_STRIDE-th row,
+# and the offset of the end of the data; sorted is False when the rows are not in time order (no seek then)
+TimeIndex = namedtuple('TimeIndex', ['times', 'offsets', 'end', 'sorted'])
+
+
+def point_column(point):
+    """ data column of a point: its local name, hk:Chiller_Temp_11 -> 'Chiller_Temp_11' """
+    point = str(point)
+    return point[max(point.rfind('#'), point.rfind('/')) + 1:]
+
+
+@lru_cache(maxsize=1024)
+def csv_layout(path, mtime_ns, size):
+    """ CsvLayout of one version of a file, read again when it is rewritten """
+    with open(path, 'r', newline='') as f:
+        sample = f.read(LAYOUT_SAMPLE_BYTES)
+    lines = sample.splitlines(keepends=True)
+    if len(lines) > 1 and len(sample) < size:
+        lines.pop()  # cut by the sample
+    rows = list(csv.reader(io.StringIO(''.join(lines))))
+    header, rows = (rows[0], rows[1:]) if rows else ([], [])
+    field_bytes = [0.0] * len(header)
+    for row in rows:
+        for i, field in enumerate(row[:len(header)]):
+            field_bytes[i] += len(field) + 1  # the separator
+    line_bytes = sum(len(line) for line in lines[1:]) / len(rows) if rows else 0.0
+    field_bytes = [total / len(rows) for total in field_bytes] if rows else field_bytes
+    return CsvLayout(columns=header, positions={column: i for i, column in enumerate(header)},
+                     field_bytes=field_bytes, line_bytes=line_bytes, size=size)
+
+
+def layout_of(path):
+    stat = os.stat(path)
+    return csv_layout(path, stat.st_mtime_ns, stat.st_size)
+
+
+def timestamp(value):
+    """ ns since the epoch of a FILTER argument or data file time, '20190801', '2019-08-01 00:15:00', ... """
+    return pd.Timestamp(str(value)).value
+
+
+def timestamps(column):
+    """ ns since the epoch of a time column """
+    return pd.to_datetime(column).values.astype('datetime64[ns]').astype(np.int64)
+
+
+def time_range(predicates):
+    """
+    TimeRange of AND-ed (operator, argument) predicates on the timestamp, e.g. [('>', '20190801'), ('<', '20191231')]
+    """
+    window = ALL_TIME
+    for operator, argument in predicates:
+        value = timestamp(argument)
+        if operator in ('>', '>=', '='):
+            inclusive = operator != '>'
+            if window.start is None or value > window.start or (value == window.start and not inclusive):
+                window = window._replace(start=value, start_inclusive=inclusive)
+        if operator in ('<', '<=', '='):
+            inclusive = operator != '<'
+            if window.end is None or value < window.end or (value == window.end and not inclusive):
+                window = window._replace(end=value, end_inclusive=inclusive)
+        if operator not in ('>', '>=', '=', '<', '<='):
+            raise ValueError("FILTER: %s is not supported on TIMESTAMP" % operator)
+    return window
+
+
+def in_range(times, window):
+    """ mask of the times (ns) inside the window """
+    mask = np.ones(len(times), dtype=bool)
+    if window.start is not None:
+        mask &= times >= window.start if window.start_inclusive else times > window.start
+    if window.end is not None:
+        mask &= times <= window.end if window.end_inclusive else times < window.end
+    return mask
+
+
+def time_index_path_of(path):
+    return path + TIME_INDEX_SUFFIX
+
+
+def build_time_index(path, layout):
+    """ TimeIndex of a data file: its time column is parsed once, the rows are located by their line ends """
+    times = timestamps(pd.read_csv(path, usecols=[DATA_TIME_COLUMN])[DATA_TIME_COLUMN])
+    line_ends, position = [], 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = np.frombuffer(f.read(SCAN_CHUNK_BYTES), dtype=np.uint8)
+            if not len(chunk):
+                break
+            line_ends.append(np.flatnonzero(chunk == ord('\n')) + position)
+            position += len(chunk)
+    line_ends = np.concatenate(line_ends) if line_ends else np.zeros(0, dtype=np.int64)
+    if position and (not len(line_ends) or line_ends[-1] != position - 1):
+        line_ends = np.append(line_ends, position - 1)  # no newline after the last row
+    if len(line_ends) != len(times) + 1:
+        # quoted newlines or blank lines: rows can not be told from lines, read the whole file
+        return TimeIndex(times=None, offsets=None, end=layout.size, sorted=False)
+    offsets = line_ends[:-1] + 1  # start of every data row
+    if len(times) > 1 and np.any(np.diff(times) < 0):
+        return TimeIndex(times=None, offsets=None, end=layout.size, sorted=False)
+    return TimeIndex(times=times[::TIME_INDEX_STRIDE].copy(), offsets=offsets[::TIME_INDEX_STRIDE].copy(),
+                     end=layout.size, sorted=True)
+
+
+@lru_cache(maxsize=1024)
+def time_index(path, mtime_ns, size):
+    """
+    TimeIndex of one version of a data file, from its sidecar '<csv>.tix' when it belongs to that version,
+    else built and saved there (kept in memory only when the directory is read-only)
+    """
+    index_path = time_index_path_of(path)
+    try:
+        with open(index_path, 'rb') as f:
+            sidecar = pickle.load(f)
+        if sidecar['format'] == TIME_INDEX_FORMAT_VERSION and \
+                sidecar['source'] == {'size': size, 'mtime_ns': mtime_ns}:
+            return TimeIndex(**sidecar['index'])
+    except (OSError, EOFError, KeyError, TypeError, pickle.UnpicklingError):
+        pass
+    index = build_time_index(path, csv_layout(path, mtime_ns, size))
+    sidecar = {'format': TIME_INDEX_FORMAT_VERSION, 'source': {'size': size, 'mtime_ns': mtime_ns},
+               'index': index._asdict()}
+    tmp_path = index_path + '.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(sidecar, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, index_path)  # readers never see a half written sidecar
+    except OSError:
+        pass
+    return index
+
+
+def time_index_of(path):
+    stat = os.stat(path)
+    return time_index(path, stat.st_mtime_ns, stat.st_size)
+
+
+def byte_window(index, window, header_end):
+    """ (first, last) byte offsets holding every row of the window: the sparse entries around it """
+    first, last = header_end, index.end
+    if window.start is not None:
+        # the last sampled row before the start, rows between two samples may still be before it
+        k = np.searchsorted(index.times, window.start, side='left') - 1
+        if k >= 0:
+            first = int(index.offsets[k])
+    if window.end is not None:
+        k = np.searchsorted(index.times, window.end, side='right')
+        if k < len(index.offsets):
+            last = int(index.offsets[k])
+    return first, max(first, last)
+
+
+def selected_columns(layout, columns, window):
+    """ the columns of a data file to parse, in file order: the given ones, and the time column for a window """
+    wanted = set(columns)
+    if window != ALL_TIME:
+        wanted.add(DATA_TIME_COLUMN)  # the rows are filtered on it
+    return [column for column in layout.columns if column in wanted]
+
+
+def read_columns(path, columns, report=None, window=ALL_TIME):
+    """
+    the given columns of a data file, in file order, the others are not parsed;
+    window: TimeRange of the rows, read from the byte range its time index points at when the file is sorted
+    report: filled in with 'columns' read / 'total columns', 'rows', 'bytes read' and the estimated 'bytes needed'
+    """
+    layout = layout_of(path)
+    selected = selected_columns(layout, columns, window)
+    bytes_read = layout.size
+    if not selected:
+        data, bytes_read = pd.DataFrame(columns=selected), 0  # nothing to read
+    elif window == ALL_TIME:
+        data = pd.read_csv(path, usecols=selected, memory_map=True)
+    elif DATA_TIME_COLUMN not in layout.positions:
+        raise ValueError("FILTER TIMESTAMP: %s has no %s column" % (path, DATA_TIME_COLUMN))
+    else:
+        index = time_index_of(path)
+        if index.sorted:
+            with open(path, 'rb') as f:
+                f.readline()
+                first, last = byte_window(index, window, header_end=f.tell())
+                f.seek(first)
+                chunk = f.read(last - first)
+            bytes_read = len(chunk)
+            if chunk.strip():
+                data = pd.read_csv(io.BytesIO(chunk), header=None, names=layout.columns, usecols=selected)
+            else:
+                data = pd.DataFrame(columns=selected)  # the window is after the last row
+        else:
+            data = pd.read_csv(path, usecols=selected, memory_map=True)
+        times = timestamps(data[DATA_TIME_COLUMN])
+        data = data[in_range(times, window)].reset_index(drop=True)
+    if report is not None:
+        report.update(read_report(layout, selected, len(data), bytes_read))
+    return data
+
+
+def read_report(layout, selected, rows, bytes_read):
+    needed = sum(layout.field_bytes[layout.positions[column]] for column in selected)
+    return {'columns': len(selected), 'total columns': len(layout.columns), 'rows': rows, 'bytes read': bytes_read,
+            'bytes needed': int(rows * needed)}
+
+
+class ByteRange(io.RawIOBase):
+    """ the bytes [first, last) of an open file, as a file for the csv parser """
+
+    def __init__(self, f, first, last):
+        super().__init__()
+        f.seek(first)
+        self.f, self.left = f, last - first
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.f.read(min(len(buffer), self.left))
+        buffer[:len(data)] = data
+        self.left -= len(data)
+        return len(data)
+
+
+def iter_columns(path, columns, chunk_rows, report=None, window=ALL_TIME):
+    """
+    read_columns as an iterator of frames of chunk_rows rows, the last one shorter: the file is parsed chunk_rows
+    lines at a time, the rows outside the window dropped, memory holds one chunk whatever the size of the window
+    report: filled in as read_columns' once the iterator is exhausted
+    """
+    layout = layout_of(path)
+    selected = selected_columns(layout, columns, window)
+    if selected and window != ALL_TIME and DATA_TIME_COLUMN not in layout.positions:
+        raise ValueError("FILTER TIMESTAMP: %s has no %s column" % (path, DATA_TIME_COLUMN))
+    index = time_index_of(path) if selected and window != ALL_TIME else None
+    rows, bytes_read = 0, layout.size if selected else 0
+    with open(path, 'rb') as f:
+        if not selected:
+            frames = []
+        elif index is not None and index.sorted:
+            f.readline()
+            first, last = byte_window(index, window, header_end=f.tell())
+            bytes_read = last - first
+            try:
+                frames = pd.read_csv(io.BufferedReader(ByteRange(f, first, last)), header=None, names=layout.columns,
+                                     usecols=selected, chunksize=chunk_rows)
+            except pd.errors.EmptyDataError:
+                frames = []  # the window is after the last row
+        else:
+            frames = pd.read_csv(f, usecols=selected, chunksize=chunk_rows)
+        if window != ALL_TIME:
+            frames = (frame[in_range(timestamps(frame[DATA_TIME_COLUMN]), window)] for frame in frames)
+        for data in rechunk(frames, chunk_rows):
+            rows += len(data)
+            yield data
+    if report is not None:
+        report.update(read_report(layout, selected, rows, bytes_read))
+
+
+def rechunk(frames, chunk_rows):
+    """ frames of any number of rows -> frames of chunk_rows rows, the last one shorter, numbered from 0 """
+    pending, size = [], 0
+    for frame in frames:
+        while len(frame):
+            part = frame.iloc[:chunk_rows - size]
+            frame = frame.iloc[len(part):]
+            pending.append(part)
+            size += len(part)
+            if size == chunk_rows:
+                yield pd.concat(pending, ignore_index=True) if len(pending) > 1 else part.reset_index(drop=True)
+                pending, size = [], 0
+    if pending:
+        yield pd.concat(pending, ignore_index=True) if len(pending) > 1 else pending[0].reset_index(drop=True)
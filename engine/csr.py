@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+@file: csr.py
+@time: 2021/2/22 3:20 下午
+@desc: array-backed CSR adjacency and the term table of int32 term ids
+
+"""
+
+from rdflib import URIRef
+from rdflib.util import from_n3
+import numpy as np
+
+ID_DTYPE = np.int32
+EMPTY_IDS = np.empty(0, dtype=ID_DTYPE)
+
+
+def decode_term(n3):
+    """ term table entry back to rdflib term, URIs (nearly all of them) skip the generic n3 parser """
+    if n3[0] == '<':
+        return URIRef(n3[1:-1])
+    return from_n3(n3)
+
+
+def as_ids(ids):
+    """ any iterable of term ids -> sorted, unique int32 array """
+    return np.unique(np.fromiter(ids, dtype=ID_DTYPE))
+
+
+def as_bitmap(ids, n_nodes):
+    """ term ids -> bool array over all n_nodes term ids """
+    bitmap = np.zeros(n_nodes, dtype=bool)
+    bitmap[np.asarray(ids, dtype=np.int64)] = True
+    return bitmap
+
+
+def fit_bitmap(bitmap, n_nodes):
+    """ pad a bitmap made before terms were interned (incremental edits) to n_nodes """
+    if bitmap.shape[0] >= n_nodes:
+        return bitmap
+    return np.concatenate([bitmap, np.zeros(n_nodes - bitmap.shape[0], dtype=bool)])
+
+
+class CSR:
+    """
+    row i holds the sorted neighbour ids of node i: indices[indptr[i]:indptr[i + 1]];
+    rows rewritten after the build (incremental edits) are kept in `overrides`
+    until compact() folds them back into the arrays
+    """
+
+    def __init__(self, indptr=None, indices=None):
+        self.indptr = np.zeros(1, dtype=np.int64) if indptr is None else indptr
+        self.indices = EMPTY_IDS if indices is None else indices
+        self.overrides = {}
+
+    @classmethod
+    def from_edges(cls, sources, targets, n_nodes):
+        """ edge lists -> CSR, duplicated edges are kept once """
+        if n_nodes == 0:
+            return cls()
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        keys = np.unique(sources * n_nodes + targets)  # sorts by source, then target
+        indices = (keys % n_nodes).astype(ID_DTYPE)
+        counts = np.bincount(keys // n_nodes, minlength=n_nodes)
+        indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        return cls(indptr=indptr, indices=indices)
+
+    @property
+    def n_rows(self):
+        return self.indptr.shape[0] - 1
+
+    def row(self, i):
+        """ neighbour ids of node i, a view into `indices` unless the row was rewritten """
+        if i in self.overrides:
+            return self.overrides[i]
+        if i >= self.n_rows:  # a term interned after the build
+            return EMPTY_IDS
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def rows(self, ids):
+        """ neighbour ids of every node in `ids`, concatenated without a per-row python loop """
+        ids = np.asarray(ids, dtype=np.int64)
+        parts = []
+        if self.overrides:
+            rewritten = np.isin(ids, np.fromiter(self.overrides, dtype=np.int64, count=len(self.overrides)))
+            parts.extend(self.overrides[i] for i in ids[rewritten].tolist())
+            ids = ids[~rewritten]
+        ids = ids[ids < self.n_rows]
+        starts = self.indptr[ids]
+        lengths = self.indptr[ids + 1] - starts
+        positions = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(lengths.sum())
+        parts.append(self.indices[positions])
+        return np.concatenate(parts)
+
+    def set_row(self, i, ids):
+        self.overrides[i] = as_ids(ids)
+
+    def edges(self):
+        """ (sources, targets) of every edge, overrides included """
+        if not self.overrides:
+            sources = np.repeat(np.arange(self.n_rows, dtype=ID_DTYPE), np.diff(self.indptr))
+            return sources, self.indices
+        rows = set(range(self.n_rows)) | set(self.overrides)
+        sources = [np.full(len(self.row(i)), i, dtype=ID_DTYPE) for i in sorted(rows)]
+        targets = [self.row(i) for i in sorted(rows)]
+        return np.concatenate(sources or [EMPTY_IDS]), np.concatenate(targets or [EMPTY_IDS])
+
+    def compact(self, n_nodes):
+        """ fold rewritten rows back into the arrays """
+        if self.overrides or self.n_rows != n_nodes:
+            compacted = CSR.from_edges(*self.edges(), n_nodes=n_nodes)
+            self.indptr, self.indices, self.overrides = compacted.indptr, compacted.indices, {}
+        return self
+
+    @property
+    def nbytes(self):
+        return self.indptr.nbytes + self.indices.nbytes + sum(ids.nbytes for ids in self.overrides.values())
+
+
+class TermTable:
+    """
+    term id <-> rdflib term; after the build the terms are packed (n3, utf-8) into one blob
+    with an offset array, and the term -> id dict is only rebuilt when new terms are interned
+    """
+
+    def __init__(self, blob=b'', offsets=None):
+        self.blob = blob
+        self.offsets = np.zeros(1, dtype=np.int64) if offsets is None else offsets
+        self.appended = []  # terms interned after the last pack()
+        self.ids = None  # term -> id, alive while interning
+
+    def __len__(self):
+        return self.offsets.shape[0] - 1 + len(self.appended)
+
+    def __getitem__(self, i):
+        n_packed = self.offsets.shape[0] - 1
+        if i < n_packed:
+            return decode_term(self.blob[self.offsets[i]:self.offsets[i + 1]].decode('utf-8'))
+        return self.appended[i - n_packed]
+
+    def intern(self, term):
+        if self.ids is None:
+            self.ids = {self[i]: i for i in range(len(self))}
+        i = self.ids.get(term)
+        if i is None:
+            i = self.ids[term] = len(self)
+            self.appended.append(term)
+        return i
+
+    def pack(self):
+        """ move the appended terms into the blob and drop the lookup dict """
+        if self.appended:
+            encoded = [term.n3().encode('utf-8') for term in self.appended]
+            lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+            self.offsets = np.concatenate([self.offsets, self.offsets[-1] + np.cumsum(lengths)])
+            self.blob = self.blob + b''.join(encoded)
+            self.appended = []
+        self.ids = None
+        return self
+
+    @property
+    def nbytes(self):
+        return len(self.blob) + self.offsets.nbytes
@@ -1,18 +1,56 @@
 from pyparsing import Group, delimitedList, Optional, Word, alphas, alphanums, quotedString, \
-    pyparsing_common, Literal, infixNotation, opAssoc, oneOf, empty
+    pyparsing_common, Literal, infixNotation, opAssoc, oneOf, empty, Regex
 from engine.engineKeywords import SELECT, FROM, WHERE, FILTER, LABEL, AND, OR, SUBSYSTEM_LOOKUP
 
-from rdflib import Graph
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import glob
+import itertools
 import os
+import time
 import pandas as pd
 
-from hvacbrick.building2 import Building2
-from hvacbrick.misc import print_graph
-
-from tools.basic import TimeRecorder
+from hvacbrick.building2 import Building2, PortfolioSub, building_index_key, load_building_index, warm_up_building_index
+from engine.columns import iter_columns, point_column, read_columns, time_range
+from engine.store import iter_store, load_manifest, read_store
+from engine.explain import plan_lines, stage_line
+from engine.parser import Parameter, parse_query, split_explain
+from engine.planner import logical_plan, optimize, execute
+from config import BUILDING_INDEX, QUERY_OPTIMIZER, SUBEXPRESSION_CACHE, SUBEXPRESSION_CACHE_BUDGET, PLAN_CACHE
+from config import MULTI_BUILDING_PROCESSES, MULTI_BUILDING_THREADS, METRICS, DATA_STORE, DATA_CHUNK_ROWS
+from tools.metrics import serve_metrics
 
 __TRACE__ = False
 
+# data columns read whenever the data file has them
+DEFAULT_FEATURES = ['time', 'coolingLoad', 'flowRate', 'R2', 'age', 'chillerName']
+
+def ontology_path(BuildingID):
+    return "./ontology/" + BuildingID + ".ttl"
+
+
+def data_path(BuildingID):
+    return "./data/" + BuildingID + ".csv"
+
+
+def store_path(BuildingID):
+    return "./store/" + BuildingID
+
+
+def warm_up(buildings, processes=None):
+    """
+    index buildings before the first query arrives
+    buildings: building ids (e.g. 'ecp') or directories of ttl files (e.g. './ontology')
+    """
+    ttl_paths = []
+    for building in buildings:
+        if os.path.isdir(building):
+            ttl_paths.extend(sorted(glob.glob(os.path.join(building, '*.ttl'))))
+        else:
+            ttl_paths.append(ontology_path(building))
+    return warm_up_building_index(ttl_paths, processes=processes)
+
+
 def getBuilding(BuildingID=None, Source=None):
     """
     retrive ontology from database
@@ -24,10 +62,8 @@ def getBuilding(BuildingID=None, Source=None):
         #         BuildingID = BuildingID[1:-1]
         # else:
         #     BuildingID = str(BuildingID)
-        g = Graph()
-        ttl = "./ontology/" + BuildingID + ".ttl"
-        if os.path.isfile(ttl):
-            g.parse(ttl, format="turtle")
+        # the graph is parsed (or its snapshot loaded) once per building by load_building_index
+        ttl = ontology_path(BuildingID)
         # return Building(BuildingID, g, ttl_path=ttl)
         return Building2(BuildingID, ttl_path=ttl)
 
@@ -73,29 +109,113 @@ def evalAlgebra(algebra, buildingDic):
         return evalAlgebra(left, buildingDic) * evalAlgebra(right, buildingDic)
     elif op == '%':
         return evalAlgebra(left, buildingDic) % evalAlgebra(right, buildingDic)
+    elif op.startswith('%'):
+        # '%2': bounded path join, the right segments within 2 feeds hops of the left ones
+        return evalAlgebra(left, buildingDic).join(evalAlgebra(right, buildingDic), max_hops=int(op[1:]))
 
 def trace(b):
     global __TRACE__
     __TRACE__ = b
 
-def getData(subs, labels):
-    if __TRACE__:
-        print_graph(subs.ontology)
-    csvfile = "./data/" + subs.buildingID + ".csv"
-    if os.path.isfile(csvfile):
-        data = pd.read_csv(csvfile)    
-    query = """ select ?uuid where { ?sub ?pred ?uuid . filter ( ?pred = brick:hasUuid ) . } """
-    features = set()
-    default_features = set(['time', 'coolingLoad', 'flowRate', 'R2', 'age', 'chillerName'])
+def getData(subs, labels, report=None, filtering=()):
+    """
+    sensor data of a sub-ontology, (features, labels) frames of ./data/<building>.csv:
+    the columns of its sensors (named by their hasUuid or the point, see data_columns), DEFAULT_FEATURES and the labels;
+    the columns are resolved from the sub-ontology first, only those are parsed. (None, None) without a data file;
+    a multi-building result gives the rows of its buildings one after the other, the features with a first
+    'building' column (as iterData), the buildings without a data file are left out.
+    With DATA_STORE they are read from ./store/<building> (engine/store.py) while it holds the current data file,
+    with the same dtypes and values, the rows of a month sorted by time
+    report: filled in with the columns read, the rows and the bytes read / needed (columns.read_columns, store.read_store)
+    filtering: bound FILTER conditions, the TIMESTAMP ones (AND-ed) select the rows read
+    """
+    if isinstance(subs, PortfolioSub):
+        features, label_data = [], []
+        for name, sub in subs.items():
+            building_features, building_labels = getData(sub, labels, filtering=filtering)
+            if building_features is None:
+                continue
+            building_features.insert(0, 'building', name)
+            features.append(building_features)
+            label_data.append(building_labels)
+        if not features:
+            return None, None
+        return pd.concat(features, ignore_index=True), pd.concat(label_data, ignore_index=True)
+    window = time_range([(predicate, arg) for _, kw, predicate, arg in filtering if kw.upper() == 'TIMESTAMP'])
+    csvfile = data_path(subs.building_id)
+    manifest = load_manifest(store_path(subs.building_id), csv_path=csvfile) if DATA_STORE else None
+    if manifest is None and not os.path.isfile(csvfile):
+        return None, None
+    report = {} if report is None else report
+    with METRICS.timer('data'):
+        columns = data_columns(subs, labels)
+        if manifest is not None:
+            data = read_store(store_path(subs.building_id), columns, manifest=manifest, report=report, window=window)
+        else:
+            data = read_columns(csvfile, columns, report=report, window=window)
+    data_read(report)
+    return split_labels(data, labels)
+
+def iterData(subs, labels, chunk_rows=None, report=None, filtering=()):
+    """
+    getData as an iterator of (features, labels) chunks of chunk_rows rows (DATA_CHUNK_ROWS), the last one shorter:
+    the store or the data file is read a chunk at a time (store.iter_store, columns.iter_columns), memory holds
+    one chunk whatever the size of the window. Nothing without a data file; the chunks of a multi-building result
+    come building after building, the features with a first 'building' column.
+    report: filled in as getData's once the iterator is exhausted
+    """
+    if isinstance(subs, PortfolioSub):
+        for name, sub in subs.items():
+            for features, label_data in iterData(sub, labels, chunk_rows=chunk_rows, filtering=filtering):
+                features.insert(0, 'building', name)
+                yield features, label_data
+        return
+    chunk_rows = chunk_rows or DATA_CHUNK_ROWS
+    window = time_range([(predicate, arg) for _, kw, predicate, arg in filtering if kw.upper() == 'TIMESTAMP'])
+    csvfile = data_path(subs.building_id)
+    manifest = load_manifest(store_path(subs.building_id), csv_path=csvfile) if DATA_STORE else None
+    if manifest is None and not os.path.isfile(csvfile):
+        return
+    report = {} if report is None else report
+    columns = data_columns(subs, labels)
+    if manifest is not None:
+        chunks = iter_store(store_path(subs.building_id), columns, chunk_rows, manifest=manifest, report=report,
+                            window=window)
+    else:
+        chunks = iter_columns(csvfile, columns, chunk_rows, report=report, window=window)
+    while True:
+        with METRICS.timer('data chunk'):
+            data = next(chunks, None)
+        if data is None:
+            break
+        yield split_labels(data, labels)
+    data_read(report)
+
+def data_columns(subs, labels):
+    """
+    the data columns of a sub-ontology: its sensors (by hasUuid, point name and IRI), DEFAULT_FEATURES and the labels
+    """
+    building_index = load_building_index(subs.ttl_path)
+    features = set(DEFAULT_FEATURES)
+    for point in subs.points().tolist():
+        term = building_index.term(point)
+        features.update((str(term), point_column(term)))
+        features.update(building_index.uuids.get(point, ()))
     # label = set(['cop', 'damper stuck', 'heating coil valve leaking', 'cooling coil valve stuck'])
-    for row in subs.ontology.query(query):
-        features.add(str(row[0]))
-    existing_features = set(data.columns).intersection(features.union(default_features))
-    existing_labels = set(data.columns).intersection(set(labels))
+    return features.union(labels)
+
+def data_read(report):
+    """ metrics (and trace) of the bytes a getData / iterData read """
+    METRICS.count('data bytes read', report['bytes read'])
+    METRICS.count('data bytes needed', report['bytes needed'])
     if __TRACE__:
-        print(existing_features, existing_labels)
+        print("data: %(columns)d of %(total columns)d columns, %(rows)d rows, %(bytes read)d bytes read, "
+              "%(bytes needed)d needed" % report)
 
-    return data[existing_features], data[existing_labels]
+def split_labels(data, labels):
+    """ (features, labels) frames of the data columns """
+    labels = set(labels)
+    return data[[c for c in data.columns if c not in labels]], data[[c for c in data.columns if c in labels]]
 
 def normalization(pred):
     if any(e == 'AND' or e == 'OR' for e in pred):
@@ -104,97 +224,257 @@ def normalization(pred):
         # TO DO normaliztion
         return [pred]
 
-def evalQuery(tokens):
-    """
-    The execution plan looks like:
-    1. Construct algebra function call
-    2. Extract data from ontology extration
-    3. Post filter the sensor data
-    """
-    time_recorder = TimeRecorder()
-    time_recorder.tick()
-    length = len(tokens[0])
-
-    if length == 1:
-        # extract everything
-        algebra = tokens[0][0]
-        print("You are trying to extract everything!")
-        pass
-    
-    algebra = tokens[0][0]
-    buildingList = tokens[0][1]
-    buildings = tokens[0][2]
-    filtering = None
-    labels = []
-    if length >= 4:
-        filtering = tokens[0][3]
-    if length >= 5:
-        for label in tokens[0][4]:
-            if isinstance(label, str):
-                if label[0] in '"\'':
-                    labels.append(label[1:-1])
-            else:
-                labels.append(str(label))
+def as_list(arg):
+    """ a BuildingID or a list of them -> list """
+    if isinstance(arg, (list, tuple)):
+        return list(arg)
+    return [] if arg is None else [arg]
 
 
-    if __TRACE__:
-        print("algebra: ", algebra)
-        print("buildingList: ", buildingList)
-        print("buildings: ", buildings)
-        print("filtering: ", filtering)
-        print("labels: ", labels)
-
-    buildingsDic = {}
+def unquote(arg):
+    if isinstance(arg, str) and arg and arg[0] in '"\'':
+        return arg[1:-1]
+    return arg
 
-    for _, building in buildingList:
-        buildingsDic[building] = {}
-    
-    buildings = normalization(buildings)
 
-    for building in buildings:
-        # TO DO:
-        # transform to conjunctive normal form
-        # process CNF
-        if building in ('AND', 'OR'):
+def conditions(pred):
+    """ WHERE / FILTER predicates -> [(building, keyword, operator, argument)], AND / OR and parentheses are skipped """
+    result = []
+    for p in normalization(pred):
+        if p in ('AND', 'OR'):
             continue
+        if len(p) == 5 and p[1] == '.':
+            result.append((p[0], p[2], p[3], p[4]))
         else:
-            building, _, kw, predicate, arg = building
+            result.extend(conditions(p))  # (B.BuildingID = 'a' OR B.BuildingID = 'b')
+    return result
 
-            if isinstance(arg, str):
-                if arg[0] in '"\'':
-                    arg = arg[1:-1]
 
-            if building in buildingsDic:
-                buildingsDic[building][kw] = arg
+def algebra_buildings(algebra):
+    """ the building aliases the algebra reads, e.g. ['B'] """
+    if algebra[0] == '-':
+        return algebra_buildings(algebra[1])
+    if isinstance(algebra[0], str):
+        return list(dict.fromkeys(algebra[1:]))  # VAV(B)
+    aliases = []
+    for operand in algebra[::2]:
+        aliases.extend(a for a in algebra_buildings(operand) if a not in aliases)
+    return aliases
 
-    # time_recorder.tock("Test building index started1 !")
-    for building in buildingsDic:
-        args = buildingsDic[building]  # buildingsDic:  {'B': {'BuildingID': 'ecp', 'Source': 'LOCAL'}}
-        buildingsDic[building] = getBuilding(**args)
 
-    if __TRACE__:
-        print("building lookups: ", buildingsDic)
+def has_or(pred):
+    """ whether OR joins any of the WHERE / FILTER predicates """
+    return any(p == 'OR' or (not isinstance(p, (str, int, float, Parameter)) and has_or(p)) for p in pred)
 
-    # algebra ([(['VAV', 'B'], {}), '*', ([(['Temperature', 'B'], {}), '+', (['Setpoint', 'B'], {})], {})], {})
 
-    time_recorder.tock("Test ontology loading Finished !")
-    for i in range(1):
-        subontology = evalAlgebra(algebra, buildingsDic)
-    time_recorder.tock("Test subontology Finished !")
-    print('\n\n')
-    return
-    data, label = getData(subontology, labels)
+def is_labels(token):
+    """ the LABEL group: quoted strings, numbers and parameters only; predicates hold names or groups """
+    return all(isinstance(e, (int, float, Parameter)) or (isinstance(e, str) and e[:1] in '"\'') for e in token)
 
-    return data, label
+
+class PreparedQuery(object):
+    """
+    a query parsed once: the optimized plan, and the WHERE / FILTER / LABEL arguments,
+    which may be bind parameters (:name) given to execute()
+    """
+
+    def __init__(self, text, tokens):
+        self.text = text
+        tokens = list(tokens)
+        # LABEL is the last group, with or without FILTER
+        self.labels = list(tokens.pop()) if len(tokens) > 1 and is_labels(tokens[-1]) else []
+        length = len(tokens)
+        if length == 1:
+            # extract everything
+            print("You are trying to extract everything!")
+
+        self.algebra = tokens[0]
+        self.plan = optimize(logical_plan(self.algebra)) if QUERY_OPTIMIZER else None
+        self.building_list = [building for _, building in tokens[1]] if length >= 3 else []
+        self.algebra_buildings = algebra_buildings(self.algebra)
+        self.where = conditions(tokens[2]) if length >= 3 else []
+        self.filtering = conditions(tokens[3]) if length >= 4 else []
+        self.filter_or = has_or(tokens[3]) if length >= 4 else False
+        self.parameters = {arg.name for _, _, _, arg in self.where + self.filtering if isinstance(arg, Parameter)}
+        self.parameters.update(label.name for label in self.labels if isinstance(label, Parameter))
+
+    def bind(self, **params):
+        """
+        arguments with the bind parameters replaced:
+        {'buildings': {'B': {'BuildingID': 'ecp', 'Source': 'LOCAL'}}, 'filtering': [...], 'labels': [...]}
+        several BuildingIDs of an alias (OR-ed predicates, or a list bound to a parameter) are kept as a list
+        """
+        missing = self.parameters - set(params)
+        if missing:
+            raise ValueError("missing bind parameters: %s" % ', '.join(sorted(missing)))
+        unknown = set(params) - self.parameters
+        if unknown:
+            raise ValueError("unknown bind parameters: %s" % ', '.join(sorted(unknown)))
+        value = lambda arg: params[arg.name] if isinstance(arg, Parameter) else unquote(arg)
+
+        buildingsDic = {building: {} for building in self.building_list}
+        for building, kw, predicate, arg in self.where:
+            if building not in buildingsDic:
+                continue
+            arg = value(arg)
+            if kw == 'BuildingID' and kw in buildingsDic[building]:
+                arg = as_list(buildingsDic[building][kw]) + as_list(arg)
+            buildingsDic[building][kw] = arg
+        filtering = [(building, kw, predicate, value(arg)) for building, kw, predicate, arg in self.filtering]
+        labels = [str(value(label)) for label in self.labels]
+        return {'buildings': buildingsDic, 'filtering': filtering, 'labels': labels}
+
+    def execute(self, **params):
+        """
+        The execution plan looks like:
+        1. Construct algebra function call
+        2. Extract data from ontology extration
+        3. Post filter the sensor data
+        """
+        with METRICS.timer('query'):
+            return self.run(**params)
+
+    def run(self, **params):
+        """ execute() without the query timer """
+        with METRICS.timer('bind'):
+            bound = self.bind(**params)
+
+        if __TRACE__:
+            print("algebra: ", self.algebra)
+            print("buildings: ", bound['buildings'])
+            print("filtering: ", bound['filtering'])
+            print("labels: ", bound['labels'])
+
+        sites = self.sites(bound['buildings'])
+        if len(sites) > 1:
+            return self.evaluate_portfolio(sites)
+
+        with METRICS.timer('load'):
+            buildingsDic = {}
+            for building, args in sites[0].items():
+                # args:  {'BuildingID': 'ecp', 'Source': 'LOCAL'}
+                buildingsDic[building] = getBuilding(**args)
+
+        if __TRACE__:
+            print("building lookups: ", buildingsDic)
+
+        with METRICS.timer('algebra'):
+            subontology = self.evaluate(buildingsDic)
+        return subontology
+
+    def data(self, **params):
+        """ execute(), then the sensor data of the sub-ontology: getData(subontology, labels, filtering) """
+        bound = self.bind(**params)
+        return getData(self.execute(**params), bound['labels'], filtering=self.data_filtering(bound))
+
+    def stream(self, chunk_rows=None, **params):
+        """ execute(), then an iterator of (features, labels) chunks of the sensor data: iterData """
+        bound = self.bind(**params)
+        filtering = self.data_filtering(bound)
+        return iterData(self.execute(**params), bound['labels'], chunk_rows=chunk_rows, filtering=filtering)
+
+    def data_filtering(self, bound):
+        """ the bound FILTER conditions getData applies: the TIMESTAMP window of AND-ed predicates """
+        if self.filter_or and any(kw.upper() == 'TIMESTAMP' for _, kw, _, _ in bound['filtering']):
+            raise ValueError("FILTER: TIMESTAMP predicates joined by OR are not supported")
+        return bound['filtering']
+
+    def evaluate(self, buildingsDic, results=None):
+        """ the algebra on one building per alias; results: plan node results shared with other queries """
+        if self.plan is not None:
+            if __TRACE__:
+                print("plan: ", self.plan)
+            return execute(self.plan, buildingsDic, results=results,
+                           cache=SUBEXPRESSION_CACHE if SUBEXPRESSION_CACHE_BUDGET > 0 else None)
+        return evalAlgebra(self.algebra, buildingsDic)
+
+    def sites(self, buildings):
+        """
+        one {alias: getBuilding arguments} per combination of the BuildingIDs of the aliases the algebra reads,
+        e.g. `B.BuildingID = 'a' OR B.BuildingID = 'b'` is two sites
+        """
+        aliases = [alias for alias in self.algebra_buildings if alias in buildings]
+        choices = [[dict(buildings[alias], BuildingID=building_id)
+                    for building_id in as_list(buildings[alias].get('BuildingID'))] for alias in aliases]
+        sites = []
+        for combination in itertools.product(*choices):
+            site = dict(buildings)
+            site.update(zip(aliases, combination))
+            sites.append(site)
+        return sites
+
+    def site_name(self, site):
+        """ the building column: 'ecp', or 'ecp/hf2' when the algebra reads two aliases """
+        return '/'.join(dict.fromkeys(str(site[alias]['BuildingID']) for alias in self.algebra_buildings))
+
+    def evaluate_portfolio(self, sites):
+        """
+        the algebra per site: the buildings not indexed yet are indexed in a process pool first,
+        then every site is evaluated on a thread of its own, sharing the indexes and the sub-expression cache
+        """
+        with METRICS.timer('load'):
+            failed = index_buildings(site_buildings(sites), processes=MULTI_BUILDING_PROCESSES)
+
+        def evaluate_site(site):
+            buildingsDic = {building: getBuilding(**args) for building, args in site.items()}
+            return self.evaluate(buildingsDic)
+
+        valid = [site for site in sites if available(site, failed, self.site_name(site))]
+        METRICS.count('sites', len(valid))
+        with METRICS.timer('algebra'), \
+                ThreadPoolExecutor(max_workers=MULTI_BUILDING_THREADS or os.cpu_count()) as executor:
+            subs = dict(zip([self.site_name(site) for site in valid], executor.map(evaluate_site, valid)))
+        return PortfolioSub(subs)
+
+
+def site_buildings(sites):
+    """ the BuildingIDs of the sites, each once """
+    return list(dict.fromkeys(args['BuildingID'] for site in sites for args in site.values() if args.get('BuildingID')))
+
+
+def index_buildings(building_ids, processes=None):
+    """
+    index the buildings not indexed yet, in a pool of `processes` workers (warm_up_building_index);
+    :return: the BuildingIDs with no ontology file or a failed index
+    """
+    missing = [building_id for building_id in building_ids if not os.path.isfile(ontology_path(building_id))]
+    not_indexed = warm_up_building_index([ontology_path(building_id) for building_id in building_ids
+                                          if building_id not in missing], processes=processes)
+    failed = set(missing)
+    failed.update(building_id for building_id in building_ids if ontology_path(building_id) in not_indexed)
+    return failed
+
+
+def available(site, failed, name):
+    unavailable = [str(args['BuildingID']) for args in site.values() if args.get('BuildingID') in failed]
+    if unavailable:
+        print("Skipped %s: no index for %s" % (name, ', '.join(unavailable)))
+    return not unavailable
+
+
+def prepare(q):
+    """ PreparedQuery of the query text, from the LRU cache of parsed plans when the text was seen before """
+    prepared = PLAN_CACHE.get(q)
+    if prepared is None:
+        with METRICS.timer('parse'):
+            prepared = PreparedQuery(q, parse_query(q))
+        PLAN_CACHE[q] = prepared
+    return prepared
+
+
+def evalQuery(tokens):
+    """ parse action of `query`: execute the query as soon as it is parsed """
+    PreparedQuery(None, tokens[0]).execute()
 
 # identifier = Word(alphanums)
 identifier = Word(alphas+"_", alphanums+"_")
-literal = quotedString ^ pyparsing_common.number
+parameter = Regex(r':[A-Za-z_][A-Za-z0-9_]*').setParseAction(lambda tokens: Parameter(tokens[0][1:]))
+literal = quotedString ^ pyparsing_common.number ^ parameter
 building = Literal('Building') ^ Literal('SubBuilding')
 sub_extraction = Group(identifier + Literal('(').suppress() + delimitedList(identifier) + Literal(')').suppress()).setName('Subontology Extraction')
 algebra = infixNotation(sub_extraction,
                         [ ('-', 1, opAssoc.RIGHT),
-                          (oneOf('%'), 2, opAssoc.LEFT),
+                          (Regex('%[0-9]*'), 2, opAssoc.LEFT),
                           (oneOf('* /'), 2, opAssoc.LEFT),
                           (oneOf('+ -'), 2, opAssoc.LEFT) ]).setName('Algebra')
 buildings = Group(delimitedList(
@@ -210,7 +490,7 @@ quantifications = predicates
 
 labels = Group(delimitedList(literal))
 
-query = Group(
+query_syntax = Group(
     SELECT.suppress() + algebra +
     Optional(
         FROM.suppress() + buildings + 
@@ -220,18 +500,167 @@ query = Group(
         )
     ) +
     Optional(LABEL.suppress() + labels)
-    ).addParseAction(evalQuery)
+    )
 
-def energon(q):
+query = query_syntax.copy().addParseAction(evalQuery)
+
+def explain(q, analyze=False, **params):
+    """
+    EXPLAIN: the plan tree of the query;
+    EXPLAIN ANALYZE runs it and reports the time of every stage (parse, bind, building load, algebra, data),
+    and per operator its time, input / output cardinalities, cache hits and the index partitions read
+    """
+    lines = []
+    plan_cached = q in PLAN_CACHE
+    start = time.perf_counter()
+    prepared = prepare(q)
+    parse_time = time.perf_counter() - start
+    plan = prepared.plan if prepared.plan is not None else optimize(logical_plan(prepared.algebra))
+    if not analyze:
+        lines.append('Plan:')
+        lines.extend(plan_lines(plan))
+        return '\n'.join(lines)
+
+    start = time.perf_counter()
+    bound = prepared.bind(**params)
+    bind_time = time.perf_counter() - start
+    lines.append(stage_line('parse', parse_time, 'plan cache hit' if plan_cached else 'parsed'))
+    lines.append(stage_line('bind', bind_time, ', '.join('%s=%r' % item for item in sorted(params.items()))))
+    cache = SUBEXPRESSION_CACHE if SUBEXPRESSION_CACHE_BUDGET > 0 else None
+    for site in prepared.sites(bound['buildings']):
+        lines.append('Building %s:' % prepared.site_name(site))
+        buildingsDic = {}
+        for alias, args in site.items():
+            ttl_path = ontology_path(args['BuildingID']) if args.get('BuildingID') else None
+            indexed = ttl_path is not None and building_index_key(ttl_path) in BUILDING_INDEX
+            start = time.perf_counter()
+            buildingsDic[alias] = getBuilding(**args)
+            lines.append(stage_line('load %s' % alias, time.perf_counter() - start,
+                                    '%s, %s' % (args.get('BuildingID'), 'index in memory' if indexed else 'index loaded')))
+        stats, results = {}, {}
+        start = time.perf_counter()
+        execute(plan, buildingsDic, results=results, cache=cache, stats=stats)
+        algebra_time = time.perf_counter() - start
+        hits = sum(1 for node_stats in stats.values() if node_stats['source'] == 'cache')
+        lines.append(stage_line('algebra', algebra_time, '%d nodes evaluated, %d from the sub-expression cache'
+                                % (len(stats) - hits, hits)))
+        report = {}
+        start = time.perf_counter()
+        getData(results[plan], bound['labels'], report=report, filtering=prepared.data_filtering(bound))
+        if report:
+            partitions = ', %d of %d partitions' % (report['partitions'], report['total partitions']) \
+                if 'partitions' in report else ''
+            lines.append(stage_line('data', time.perf_counter() - start,
+                                    '%d of %d columns%s, %d rows, read %d bytes, needed ~%d bytes'
+                                    % (report['columns'], report['total columns'], partitions, report['rows'],
+                                       report['bytes read'], report['bytes needed'])))
+        else:
+            lines.append(stage_line('data', None, 'no data file %s' % data_path(results[plan].building_id)))
+        lines.extend(plan_lines(plan, stats=stats, results=results))
+    return '\n'.join(lines)
+
+
+def energon(q, **params):
+    """
+    run a query; params bind its parameters, e.g. energon(q, building='ecp') for `B.BuildingID = :building`;
+    EXPLAIN [ANALYZE] SELECT ... prints and returns the report of explain()
+    """
     from pyparsing import ParseException
     retv = None
     try:
-        retv = query.parseString(q)[0]
+        mode, q = split_explain(q)
+        if mode is not None:
+            retv = explain(q, analyze=mode == 'EXPLAIN ANALYZE', **params)
+            print(retv)
+        else:
+            retv = prepare(q).execute(**params)
     except ParseException:
+        METRICS.count('errors')
         print("Not a valid Energon Query!")
+    except ValueError as e:
+        METRICS.count('errors')
+        print(e)
     finally:
         return retv
 
+def energon_stream(q, chunk_rows=None, **params):
+    """
+    run a query for its sensor data in chunks, e.g. to train incrementally or write to disk with bounded memory:
+    an iterator of (features, labels) frames of chunk_rows rows (DATA_CHUNK_ROWS), see iterData;
+    None when the query does not parse or bind
+    """
+    from pyparsing import ParseException
+    try:
+        return prepare(q).stream(chunk_rows=chunk_rows, **params)
+    except ParseException:
+        METRICS.count('errors')
+        print("Not a valid Energon Query!")
+    except ValueError as e:
+        METRICS.count('errors')
+        print(e)
+    return None
+
+def energon_batch(queries, processes=1):
+    """
+    run many queries, the results in input order (None for a query that does not parse, bind or evaluate,
+    the others still run); queries: query texts, or (query text, {bind parameter: value}) pairs.
+    The queries are grouped by the buildings they read: each building is indexed once, by a pool of `processes`
+    workers for the buildings not indexed yet (1: in this process, None: one per cpu), and the plans of a group share one results dict,
+    a sub-expression common to several queries of the group is evaluated once
+    """
+    from pyparsing import ParseException
+    # a bad query: parse errors, unbound parameters, algebra the planner or the operators reject (TypeError),
+    # unknown subsystems (KeyError)
+    query_errors = (ParseException, ValueError, TypeError, KeyError)
+    METRICS.count('batch queries', len(queries))
+    results = [None] * len(queries)
+    failed_queries = set()
+    portfolios = {}  # query index -> {site name: Building2Sub}, multi-building queries
+    groups = {}  # buildings of a site -> [(query index, prepared query, site name)]
+    sites = {}
+    for i, q in enumerate(queries):
+        text, params = (q, {}) if isinstance(q, str) else q
+        try:
+            prepared = prepare(text)
+            query_sites = prepared.sites(prepared.bind(**params)['buildings'])
+        except query_errors as e:
+            METRICS.count('errors')
+            print("Query %d skipped: %s" % (i, e))
+            continue
+        if len(query_sites) > 1:
+            portfolios[i] = dict.fromkeys(prepared.site_name(site) for site in query_sites)
+        for site in query_sites:
+            key = tuple(sorted((alias, tuple(sorted(args.items()))) for alias, args in site.items()))
+            sites[key] = site
+            groups.setdefault(key, []).append((i, prepared, prepared.site_name(site) if i in portfolios else None))
+
+    with METRICS.timer('batch load'):
+        failed = index_buildings(site_buildings(sites.values()), processes=processes)
+    with METRICS.timer('batch algebra'):
+        for key, group in groups.items():
+            if not available(sites[key], failed, '/'.join(str(args.get('BuildingID')) for args in sites[key].values())):
+                continue
+            buildingsDic = {building: getBuilding(**args) for building, args in sites[key].items()}
+            shared = {}
+            for i, prepared, site_name in group:
+                if i in failed_queries:
+                    continue
+                try:
+                    sub = prepared.evaluate(buildingsDic, results=shared)
+                except query_errors as e:
+                    METRICS.count('errors')
+                    print("Query %d failed: %s" % (i, e))
+                    failed_queries.add(i)
+                    continue
+                if site_name is None:
+                    results[i] = sub
+                else:
+                    portfolios[i][site_name] = sub
+    for i, subs in portfolios.items():
+        if i not in failed_queries:
+            results[i] = PortfolioSub({name: sub for name, sub in subs.items() if sub is not None})
+    return results
+
 from cmd import Cmd
 
 class Energon(Cmd):
@@ -240,11 +669,36 @@ class Energon(Cmd):
         print("Bye")
         return True
 
+    def do_stats(self, inp):
+        """ building index cache and sub-expression cache: entries, bytes, hits, misses, evictions """
+        print("building index:", BUILDING_INDEX.stats())
+        print("sub-expression:", SUBEXPRESSION_CACHE.stats())
+        print("parsed plans:", PLAN_CACHE.stats())
+        return False
+
+    def do_metrics(self, inp):
+        """ query counters and stage latencies (parse, bind, load, index, algebra, data, query); `metrics json` """
+        print(METRICS.to_json() if inp.strip() == 'json' else METRICS.to_text())
+        return False
+
     def default(self, inp):
-        print(energon(inp))
+        retv = energon(inp)
+        if not isinstance(retv, str):  # EXPLAIN reports are printed by energon
+            print(retv)
         return False
 
 # __ENERGON__ = Energon().cmdloop()
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Energon query shell')
+    parser.add_argument('--warm-up', nargs='+', metavar='BUILDING', default=[],
+                        help="building ids or ontology directories (e.g. ./ontology) to index before the first query")
+    parser.add_argument('--processes', type=int, default=None, help="warm up pool size, default one per cpu")
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help="serve the metrics on http://127.0.0.1:<port>/metrics (Prometheus), /metrics.json")
+    args = parser.parse_args()
+    if args.metrics_port:
+        serve_metrics(METRICS, port=args.metrics_port)
+    if args.warm_up:
+        warm_up(args.warm_up, processes=args.processes)
     Energon().cmdloop()
\ No newline at end of file
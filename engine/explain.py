@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+@file: explain.py
+@time: 2021/3/9 2:10 下午
+@desc: EXPLAIN / EXPLAIN ANALYZE of a DASQL query: the plan tree, and per stage / per operator timings,
+       cardinalities, cache hits and index partitions read
+
+"""
+
+from config import SUB_FLAG
+from engine.planner import Leaf, kind_of, leaf_names, SYSTEM
+
+INDENT = '      '
+
+
+def node_label(node):
+    """ AHU(B) system, `*` system, ... """
+    kind = 'system' if kind_of(node) == SYSTEM else 'functionality'
+    if isinstance(node, Leaf):
+        return ' + '.join('%s(%s)' % (name, node.building) for name in leaf_names(node)) + '  [%s]' % kind
+    return '%s  [%s]' % (node.op, kind)
+
+
+def cardinality(sub):
+    """ (segments, points) of a Building2Sub, segments is None for a functionality """
+    if sub.sys_func_flag != SUB_FLAG['system']:
+        return None, int(sub.bitmap.sum())
+    segments = points = 0
+    for _, sensors in sub.segment_points():
+        segments += 1
+        points += len(sensors)
+    return segments, points
+
+
+def format_cardinality(counts):
+    segments, points = counts
+    return '%d points' % points if segments is None else '%d segments/%d points' % (segments, points)
+
+
+def ms(seconds):
+    return '%.3f ms' % (seconds * 1000)
+
+
+def plan_lines(plan, stats=None, results=None):
+    """
+    the plan tree, children indented under their operator; a node shared by two parents is printed once,
+    the second time as `(shared)`. With stats / results of execute(): the analysis of every node
+    """
+    lines = []
+    seen = set()
+    counts = {}
+
+    def counted(node):
+        if node not in counts:
+            counts[node] = cardinality(results[node]) if results is not None and node in results else None
+        return counts[node]
+
+    def visit(node, depth):
+        line = INDENT * depth + '->  ' + node_label(node)
+        if node in seen:
+            lines.append(line + '  (shared)')
+            return
+        seen.add(node)
+        if stats is not None and node in stats:
+            node_stats = stats[node]
+            details = ['%s' % node_stats['source'], 'time=%s' % ms(node_stats['time']),
+                       'total=%s' % ms(node_stats['total'])]
+            if not isinstance(node, Leaf) and node_stats['source'] == 'computed':
+                inputs = [counted(node.left), counted(node.right)]
+                details.append('in=[%s]' % ', '.join(format_cardinality(c) for c in inputs if c is not None))
+            if counted(node) is not None:
+                details.append('out=%s' % format_cardinality(counted(node)))
+            if node_stats['partitions']:
+                details.append('read=%s' % ', '.join(node_stats['partitions']))
+            line += '  (%s)' % '; '.join(details)
+        elif stats is not None:
+            line += '  (not evaluated)'
+        lines.append(line)
+        if not isinstance(node, Leaf):
+            visit(node.left, depth + 1)
+            visit(node.right, depth + 1)
+
+    visit(plan, 0)
+    return lines
+
+
+def stage_line(name, seconds, detail=''):
+    return '%-18s %12s  %s' % (name, ms(seconds) if seconds is not None else '-', detail)
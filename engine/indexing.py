@@ -9,44 +9,269 @@
 """
 
 from rdflib import Graph, Literal
+from array import array
+from collections.abc import Mapping
+import numpy as np
+import hashlib
+import itertools
+import os
+import pickle
 import re
 
-from config import PROJECT_PATH
+from config import PROJECT_PATH, INDEX_SNAPSHOT_SUFFIX, METRICS
 from config import system_name_list, inter_type_list, intra_type_list, reverse_pairs_list
 from config import function_name_dict
-from tools.basic import find_inverse_predicate, multi_hop_traversal
+from engine.csr import CSR, TermTable, ID_DTYPE, EMPTY_IDS, as_ids
+from engine.ingest import rdf_format_of, stream_triples
+from tools.basic import find_inverse_predicate, multi_hop_ids, reachability_index
+
+# one pattern for all systems: '(chiller_)[0-9]' or '(chiller)[0-9]' for every system name.
+# the lookahead lets a subject such as 'vav_1_room_2' fall into more than one system
+SYSTEM_PATTERN = re.compile('(?=(%s)_?[0-9])' % '|'.join(re.escape(name.lower()) for name in system_name_list))
+SYSTEM_NAME_LOOKUP = {name.lower(): name for name in system_name_list}
+
+
+def classify_subject(sub_name):
+    """ system names (e.g. 'CHILLER') that the subject belongs to, a subject may match none or several """
+    return {SYSTEM_NAME_LOOKUP[m.group(1)] for m in SYSTEM_PATTERN.finditer(sub_name.lower())}
+
+
+# predicates whose edges the index is built from, matched as make_completed_predicate() does
+INDEXED_PREDICATE_NAMES = intra_type_list + inter_type_list + ['type']
+
+
+def is_indexed_predicate(predicate):
+    return any(name in predicate for name in INDEXED_PREDICATE_NAMES)
+
+
+# a point's hasUuid literal names its column in the building data file
+UUID_PREDICATE_NAME = 'hasUuid'
+
+
+def is_uuid_predicate(predicate):
+    return UUID_PREDICATE_NAME in predicate
+
+
+def indexed_triple(s, p, o):
+    """ streaming ingest: the triples Indexing reads, edges of an indexed predicate, uuids or a segment's triples """
+    return is_indexed_predicate(p) or is_uuid_predicate(p) or bool(classify_subject(s))
+
+
+# rough resident bytes, for the memory accounting of the building index cache
+GRAPH_TRIPLE_BYTES = 1200  # one triple of an rdflib Graph, terms included
+SEGMENT_BYTES = 100  # one segment id of a SegmentTable
+TERM_ID_BYTES = 200  # one entry of the term -> id dict
+
+# every Indexing, and every edit applied to one, gets a new version; results computed on an index are keyed by it
+INDEX_VERSIONS = itertools.count(1)
+
+# bump when the snapshot layout changes, older snapshots are then rebuilt
+SNAPSHOT_FORMAT_VERSION = 3
+
+
+def snapshot_path_of(ttl_file_path):
+    """ the snapshot lives next to the ttl file """
+    return ttl_file_path + INDEX_SNAPSHOT_SUFFIX
+
+
+def write_snapshot(snapshot, snapshot_path):
+    """ pickle a snapshot, None if it can not be written (e.g. read-only ontology directory) """
+    tmp_path = snapshot_path + '.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, snapshot_path)  # readers never see a half written snapshot
+    except OSError:
+        return None  # keep serving from memory
+    return snapshot_path
+
+
+def file_digest(file_path):
+    """ sha1 of the file content """
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+class SegmentTable(Mapping):
+    """
+    one system of index_system: segment id -> storage table; only the ids are kept,
+    the storage table is made on access as views into the index arrays
+    """
+
+    def __init__(self, index, segment_ids=()):
+        self.index = index
+        self.segment_ids = dict.fromkeys(segment_ids)  # ordered set
+        self._ids = None
+
+    @property
+    def ids(self):
+        """ the segment ids as an array, in table order; made once, until the table is edited """
+        if self._ids is None:
+            self._ids = np.fromiter(self.segment_ids, dtype=ID_DTYPE, count=len(self.segment_ids))
+        return self._ids
+
+    def __getitem__(self, segment_id):
+        if segment_id not in self.segment_ids:
+            raise KeyError(segment_id)
+        return self.index.make_segment(segment_id=segment_id)
+
+    def __contains__(self, segment_id):
+        return segment_id in self.segment_ids
+
+    def __iter__(self):
+        return iter(self.segment_ids)
+
+    def __len__(self):
+        return len(self.segment_ids)
+
+    def add(self, segment_id):
+        self.segment_ids[segment_id] = None
+        self._ids = None
+
+    def discard(self, segment_id):
+        """ True if the segment was there """
+        self._ids = None
+        return self.segment_ids.pop(segment_id, False) is None
+
+
+class LazyPartitions(Mapping):
+    """
+    index_system / index_func: partition name -> partition;
+    a partition is made by `builder(name)` on its first access and then memoized,
+    `on_complete()` is called once the last one is made
+    """
+
+    def __init__(self, names, builder=None, on_complete=None):
+        self.names = list(names)
+        self.builder = builder
+        self.on_complete = on_complete
+        self.built = dict()
+
+    def __getitem__(self, name):
+        if name not in self.built:
+            if name not in self.names:
+                raise KeyError(name)
+            self.built[name] = self.builder(name)
+            if self.complete and self.on_complete is not None:
+                self.on_complete()
+        return self.built[name]
+
+    def __setitem__(self, name, partition):
+        self.built[name] = partition
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def complete(self):
+        return len(self.built) == len(self.names)
+
+
+class IndexSink(object):
+    """
+    streaming ingest: what Indexing would read from the graph, collected while the file is parsed;
+    the segment ids of every system, the edges of the indexed predicates, as term ids, and the uuids
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.predicates = set()
+        self.indexed = dict()  # predicate -> whether its edges are kept
+        self.edges = dict()  # indexed predicate -> (sources, targets)
+        self.segments = {system_name: [] for system_name in system_name_list}
+        self.segment_ids = set()
+        self.uuid_predicates = set()
+        self.uuids = dict()  # point id -> its hasUuid literals
+
+    def triple(self, s, p, o):
+        if p not in self.indexed:
+            self.predicates.add(p)
+            self.indexed[p] = is_indexed_predicate(p)
+            if is_uuid_predicate(p):
+                self.uuid_predicates.add(p)
+        systems = classify_subject(s)
+        if systems:
+            segment_id = self.index.term_id(s)
+            if segment_id not in self.segment_ids:  # first-seen order, as the graph pass
+                self.segment_ids.add(segment_id)
+                for system_name in systems:
+                    self.segments[system_name].append(segment_id)
+        if self.indexed[p]:
+            sources, targets = self.edges.setdefault(p, (array('i'), array('i')))
+            sources.append(self.index.term_id(s))
+            targets.append(self.index.term_id(o))
+        if p in self.uuid_predicates:
+            self.uuids.setdefault(self.index.term_id(s), set()).add(str(o))
 
 
 class Indexing:
     """ build the indexing structure for the Building """
 
-    def __init__(self, ttl_file_path):
-        """ load the graph"""
+    def __init__(self, ttl_file_path, lazy=False, index_only=False):
+        """
+        load the graph
+        :parameter lazy: build each system / functionality partition on its first access instead of all of them now
+        :parameter index_only: release the graph once the index is built, see release_graph()
+        """
+        self.ttl_file_path = ttl_file_path
+        self.lazy = lazy
+        self.version = next(INDEX_VERSIONS)
         self.g = Graph()  # Initialize a new graph.
-        self.g.parse(ttl_file_path, format='turtle')  # Load the stored graph.
-        self.spo_dict = self.record_all_spo_in_building()
-        self.index_system = dict()
-        self.index_func = dict()
+        self.g.parse(ttl_file_path, format=rdf_format_of(ttl_file_path))  # Load the stored graph.
+        self.terms = TermTable()  # term id <-> rdflib term
+        self.predicates = set()
+        self.adjacency = dict()  # 'hasPoint', 'isPointOf', 'feeds', 'hasLocation' -> CSR
+        self.closure = dict()  # 'feeds', 'hasLocation' -> CSR, multi-hop downstream of every segment
+        self.index_system = LazyPartitions(system_name_list, builder=self.build_system_partition,
+                                           on_complete=self.pack_terms_if_complete)
+        self.index_func = LazyPartitions(function_name_dict, builder=self.build_func_partition,
+                                         on_complete=self.pack_terms_if_complete)
+        self.sensor_types = dict()  # function name -> sensor type the functionality index was built on
+        self.segments = None  # system name -> segment ids, from the classification pass; until its partition is built
+        self.classes = None  # objects of rdf:type, until the functionality index is built
+        self.uuids = dict()  # point id -> its hasUuid literals, the data columns named by uuid
+        self.edited = False  # apply_changes was called, the index differs from the file
+        self.on_resize = None  # called when the graph is loaded, released or edited, e.g. to account the new nbytes
 
         # 建索引
         self.build_index()
+        if index_only:
+            self.release_graph()
 
-    def record_all_spo_in_building(self):
-        """
-        s p o record
-        """
-        spo_dict = {'s': set(), 'p': set(), 'o': set()}
-        for s in self.g.subjects():
-            spo_dict['s'].add(s)
-        for p in self.g.predicates():
-            spo_dict['p'].add(p)
-        for o in self.g.objects():
-            spo_dict['o'].add(o)
-        return spo_dict
+    def term_id(self, term):
+        """ intern the term, ids are dense int32 starting from 0 """
+        return self.terms.intern(term)
+
+    def term(self, i):
+        """ term id -> rdflib term """
+        return self.terms[i]
+
+    @property
+    def nbytes(self):
+        """ approximate memory held by this building: index arrays, term table and the graph if loaded """
+        size = self.terms.nbytes
+        size += sum(csr.nbytes for csr in self.adjacency.values()) + sum(csr.nbytes for csr in self.closure.values())
+        size += sum(ids.nbytes for ids in self.index_func.built.values())
+        size += sum(len(system_dict) for system_dict in self.index_system.built.values()) * SEGMENT_BYTES
+        if self.terms.ids is not None:
+            size += len(self.terms.ids) * TERM_ID_BYTES
+        size += sum(len(uuids) for uuids in self.uuids.values()) * TERM_ID_BYTES
+        if self.g is not None:
+            size += len(self.g) * GRAPH_TRIPLE_BYTES
+        return size
 
     def make_completed_predicate(self, p):
         """p maybe 'hasPoint', need to transform to the 'predicate' in ttl file """
-        for value in self.spo_dict['p']:
+        for value in self.predicates:
             if p in value:
                 return value
         return None
@@ -56,80 +281,462 @@ class Indexing:
         build the subsystem indexing structure for this building
         """
         # 1. layer: system
+        # 2. layer: segment list
+        self.classify_segments()
+
+        # 3. layer: Storage Table, rows of the adjacency arrays
+        self.build_segment_tables()
+
+    def build_segment_tables(self):
+        """ inter closures of all segments in one reachability pass per predicate, then one SegmentTable per system """
+        segment_ids = set().union(*self.segments.values())
+        for p in inter_type_list:
+            self.closure[p] = CSR.from_edges(*self.multi_hop_edges(p=p, segment_ids=segment_ids),
+                                             n_nodes=len(self.terms))
         for system_name in system_name_list:
-            self.index_system.update({system_name: dict()})
+            self.index_system[system_name] = SegmentTable(index=self, segment_ids=self.segments.pop(system_name))
 
-        # 2. layer: segment list
-        for key, value in self.index_system.items():
-            system_name = key.lower()  # e.g. 'chiller'
-            d = value  # here is empty dict
-            for sub_name in self.g.subjects():
-                if re.compile('(%s_)[0-9]' % system_name).search(sub_name.lower()) or \
-                        re.compile('(%s)[0-9]' % system_name).search(sub_name.lower()):
-                    d.update({sub_name: {'intra': dict(zip(intra_type_list, [list() for i in range(intra_type_list.__len__())])),
-                                         'inter': dict(zip(inter_type_list, [list() for i in range(inter_type_list.__len__())]))
-                                         }
-                              })
-
-        # 3. layer: Storage Table
-        for system_key, system_dict in self.index_system.items():
-            for segment_name, segment_dict in system_dict.items():
-                # 3.1 intra edge
-                for p, down_list in segment_dict['intra'].items():  # edge's name and downstream node list（save as list in Storage Table）
-                    predicate = self.make_completed_predicate(p=p)
-                    if predicate:  # maybe None
-                        for obj in self.g.objects(subject=segment_name, predicate=predicate):
-                            down_list.append(obj)  # e.g. obj is Damper_1, Damper_2 in slides
-                    # Reverse screening
-                    inverse_p = find_inverse_predicate(p=p)
-                    inverse_predicate = self.make_completed_predicate(p=inverse_p)
-                    if inverse_predicate:
-                        for sub in self.g.subjects(predicate=inverse_predicate, object=segment_name):
-                            down_list.append(sub)
-
-                # 3.2 inter edge
-                for p, down_list in segment_dict['inter'].items():
-                    inter_results_list = []
-                    predicate = self.make_completed_predicate(p=p)
-                    multi_hop_traversal(g=self.g, subject0=segment_name, p=predicate, results_list=inter_results_list)
-                    down_list.extend(inter_results_list)
+    def classify_segments(self):
+        """
+        segment ids of every system, one pass over the distinct subjects;
+        plus the adjacency arrays, which every system partition reads
+        """
+        self.segments = {system_name: [] for system_name in system_name_list}
+        for sub_name in dict.fromkeys(self.g.subjects()):  # keep first-seen order, drop duplicates
+            for system_name in classify_subject(sub_name):
+                self.segments[system_name].append(self.term_id(sub_name))
+        self.build_adjacency()
+        self.closure = {p: CSR() for p in inter_type_list}
+
+    def build_system_partition(self, system_name):
+        """ lazy mode: one system of index_system, with the inter closures of its segments only """
+        if self.segments is None:
+            self.classify_segments()
+        segment_ids = self.segments.pop(system_name)
+        for p in inter_type_list:
+            reach = reachability_index(adjacency=self.adjacency[p], sources=sorted(set(segment_ids)))
+            for segment_id, reached in reach.items():
+                self.closure[p].set_row(segment_id, reached)
+        return SegmentTable(index=self, segment_ids=segment_ids)
+
+    def graph_edges(self):
+        """ full predicate -> (sources, targets) term ids, for the predicates of the adjacency arrays """
+        edges = dict()
+        for p in intra_type_list + inter_type_list:
+            predicate = self.make_completed_predicate(p=p)
+            if predicate and predicate not in edges:  # maybe None
+                sources, targets = edges[predicate] = ([], [])
+                for sub, obj in self.g.subject_objects(predicate=predicate):
+                    sources.append(self.term_id(sub))
+                    targets.append(self.term_id(obj))
+        return edges
+
+    def build_adjacency(self, edges=None):
+        """
+        one CSR per predicate over term ids; an intra edge is stored in both directions,
+        i.e. 'A hasPoint x' is also the row of x in isPointOf, as the reverse screening did.
+        edges: full predicate -> (sources, targets), read from the graph when not given (streaming ingest)
+        """
+        if edges is None:
+            edges = self.graph_edges()
+        edges = {p: edges.get(self.make_completed_predicate(p=p), (EMPTY_IDS, EMPTY_IDS))
+                 for p in intra_type_list + inter_type_list}
+
+        n_nodes = len(self.terms)
+        for p in intra_type_list:
+            sources, targets = edges[p]
+            inverse_p = find_inverse_predicate(p=p)
+            if inverse_p in edges:  # Reverse screening
+                sources = np.concatenate([np.asarray(sources, dtype=np.int64), edges[inverse_p][1]])
+                targets = np.concatenate([np.asarray(targets, dtype=np.int64), edges[inverse_p][0]])
+            self.adjacency[p] = CSR.from_edges(sources=sources, targets=targets, n_nodes=n_nodes)
+        for p in inter_type_list:
+            self.adjacency[p] = CSR.from_edges(*edges[p], n_nodes=n_nodes)
+
+    def multi_hop_edges(self, p, segment_ids):
+        """ (segment, node) for every node a segment reaches along inter edge p """
+        reach = reachability_index(adjacency=self.adjacency[p], sources=sorted(segment_ids))
+        sources = np.repeat(np.fromiter(reach, dtype=ID_DTYPE, count=len(reach)),
+                            [len(reached) for reached in reach.values()])
+        targets = np.concatenate(list(reach.values()) or [EMPTY_IDS])
+        return sources, targets
+
+    def make_segment(self, segment_id):
+        """
+        storage table of one segment: intra edges and the multi-hop inter edges,
+        all of them views into the adjacency / closure arrays
+        """
+        return {'intra': {p: self.adjacency[p].row(segment_id) for p in intra_type_list},
+                'inter': {p: self.closure[p].row(segment_id) for p in inter_type_list}}
+
+    def find_sensor_type(self, function_name, classes):
+        """ 'Temperature_Sensor' -> the sensor type's full name in ttl file, None if the building has no such sensor """
+        sensor_type = function_name_dict[function_name]
+        for obj in classes:
+            if sensor_type in obj:
+                return obj
+        return None
 
     def build_func_index(self):
         """
         functionality index
         """
         # 1. layer: function
+        # 2. array to save corresponding sensor
         for function_name in function_name_dict.keys():
-            self.index_func.update({function_name: []}
-                                   )
+            self.index_func[function_name] = self.build_func_partition(function_name=function_name)
 
-        # 2. list to save corresponding sensor
-        for function_name, value in self.index_func.items():
-            sensor_type = function_name_dict[function_name]
-            completed_sensor_type = None
+    def build_func_partition(self, function_name):
+        """ sorted ids of the sensors of one functionality """
+        rdf_type = self.make_completed_predicate(p='type')  # find 'type' full name
+        if self.classes is None:
+            self.classes = set(self.g.objects(predicate=rdf_type)) if rdf_type else set()
+        completed_sensor_type = self.find_sensor_type(function_name=function_name, classes=self.classes)
+        if completed_sensor_type is None:  # this if branch means no this sensor_type in building
+            return EMPTY_IDS
+        self.sensor_types[function_name] = completed_sensor_type
 
-            # find sensor_type full name
-            for obj in self.spo_dict['o']:
-                if sensor_type in obj:
-                    completed_sensor_type = obj
-                    break
+        return as_ids(self.term_id(sub) for sub in self.g.subjects(predicate=rdf_type, object=completed_sensor_type))
 
-            if completed_sensor_type is None:  # this if branch means no this sensor_type in building
+    def build_func_index_from_edges(self, edges):
+        """ streaming ingest: functionality index from the rdf:type edges """
+        rdf_type = self.make_completed_predicate(p='type')
+        sources, targets = (np.asarray(ids, dtype=ID_DTYPE) for ids in edges.get(rdf_type, (EMPTY_IDS, EMPTY_IDS)))
+        classes = {self.term(class_id): class_id for class_id in np.unique(targets).tolist()}
+        for function_name in function_name_dict.keys():
+            completed_sensor_type = self.find_sensor_type(function_name=function_name, classes=set(classes))
+            if completed_sensor_type is None:
+                self.index_func[function_name] = EMPTY_IDS
                 continue
-            # find 'type' full name
-            rdf_type = None
-            for p in self.spo_dict['p']:
-                if 'type' in p:
-                    rdf_type = p
-                    break
+            self.sensor_types[function_name] = completed_sensor_type
+            self.index_func[function_name] = as_ids(sources[targets == classes[completed_sensor_type]])
 
-            for sub in self.g.subjects(predicate=rdf_type, object=completed_sensor_type):
-                self.index_func[function_name].append(sub)
+    def pack_terms_if_complete(self):
+        """ lazy mode: once the last partition is built, terms are no longer interned """
+        if self.index_system.complete and self.index_func.complete:
+            self.terms.pack()
+            self.classes = None
+
+    def collect_uuids(self):
+        """ point id -> its hasUuid literals, read from the graph """
+        uuids = dict()
+        for predicate in self.predicates:
+            if is_uuid_predicate(predicate):
+                for sub, obj in self.g.subject_objects(predicate=predicate):
+                    uuids.setdefault(self.term_id(sub), set()).add(str(obj))
+        return uuids
 
     def build_index(self):
-        self.build_system_index()
-        self.build_func_index()
+        self.predicates = set(self.g.predicates())
+        self.uuids = self.collect_uuids()
+        if not self.lazy:
+            self.build_system_index()
+            self.build_func_index()
+            self.terms.pack()
+            self.classes = None
+
+    def release_graph(self):
+        """
+        index-only mode: queries read index_system / index_func only, so drop the graph
+        (lazy partitions are built first, they read it); return the approximate bytes reclaimed.
+        load_graph() parses the file again if raw triples are asked for later
+        """
+        if self.g is None:
+            return 0
+        for _ in self.index_system.values():
+            pass
+        for _ in self.index_func.values():
+            pass
+        size = self.nbytes
+        self.g = None
+        self.classes = None
+        released = size - self.nbytes
+        self.resized()
+        METRICS.count('graph bytes released', released)
+        return released
+
+    def triples(self, pattern):
+        """ raw triples of the building, the graph is parsed again if it was released """
+        return self.load_graph().triples(pattern)
+
+    def load_graph(self):
+        """ parse the ttl file again for an Indexing that was loaded from a snapshot or released its graph """
+        if self.g is None:
+            self.g = Graph()
+            self.g.parse(self.ttl_file_path, format=rdf_format_of(self.ttl_file_path))
+            self.predicates = set(self.g.predicates())
+            rdf_type = self.make_completed_predicate(p='type')
+            classes = set(self.g.objects(predicate=rdf_type)) if rdf_type else set()
+            self.sensor_types = {function_name: self.find_sensor_type(function_name=function_name, classes=classes)
+                                 for function_name in function_name_dict}
+            self.resized()
+        return self.g
+
+    def resized(self):
+        if self.on_resize is not None:
+            self.on_resize()
+
+    def add_triples(self, triples):
+        """ e.g. a new VAV with its points, or a new feeds edge """
+        return self.apply_changes(added=triples)
+
+    def remove_triples(self, triples):
+        """ e.g. a retired sensor, or the old end of a re-pointed feeds edge """
+        return self.apply_changes(removed=triples)
+
+    def apply_changes(self, added=(), removed=()):
+        """
+        apply ontology edits to the graph and patch the index in place,
+        only the adjacency rows and segments touched by the edits are rebuilt;
+        return the set of segment names that were rebuilt or dropped
+        """
+        self.version = next(INDEX_VERSIONS)
+        self.edited = True
+        self.load_graph()
+        if self.segments is None and not self.index_system.complete:
+            self.classify_segments()  # lazy mode: adjacency first, from the graph before the edits
+        removed = [t for t in removed if t in self.g]
+        added = [t for t in added if t not in self.g]
+        for s, p, o in removed:
+            self.g.remove((s, p, o))
+            if is_uuid_predicate(p):
+                self.uuids.get(self.term_id(s), set()).discard(str(o))
+        for s, p, o in added:
+            self.g.add((s, p, o))
+            self.predicates.add(p)
+            if is_uuid_predicate(p):
+                self.uuids.setdefault(self.term_id(s), set()).add(str(o))
+        for s, p, o in removed:
+            if (None, p, None) not in self.g:
+                self.predicates.discard(p)
+        self.classes = None
+
+        rdf_type = self.make_completed_predicate(p='type')
+        tracked = {self.make_completed_predicate(p=p): p for p in intra_type_list + inter_type_list}
+        tracked.pop(None, None)
+        dirty_rows = {p: set() for p in intra_type_list + inter_type_list}
+        dirty = set()
+        dirty_types = set()
+        for s, p, o in removed + added:
+            # intra edges and segment membership of both ends
+            dirty.add(s)
+            dirty.add(o)
+            edge = tracked.get(p)
+            if edge in intra_type_list:  # both directions of an intra edge are stored
+                for intra_p in intra_type_list:
+                    dirty_rows[intra_p].update((s, o))
+            elif edge in inter_type_list:
+                dirty_rows[edge].add(s)
+                # every segment that reaches s through this inter edge has a new closure
+                dirty.update(self.upstream_of(node=s, predicate=p))
+            if p == rdf_type:
+                dirty_types.add(o)
+
+        for p, nodes in dirty_rows.items():
+            for node in nodes:
+                self.adjacency[p].set_row(self.term_id(node), self.adjacency_row(p=p, node=node))
+
+        touched = set()
+        for segment_name in dirty:
+            systems = set() if isinstance(segment_name, Literal) else classify_subject(segment_name)
+            if not systems:
+                continue
+            segment_id = self.term_id(segment_name)
+            exists = (segment_name, None, None) in self.g  # a segment is a subject of the building
+            for p in inter_type_list:
+                reached = multi_hop_ids(adjacency=self.adjacency[p], start=segment_id) if exists else []
+                self.closure[p].set_row(segment_id, reached)
+            for system_name in systems:
+                if system_name not in self.index_system.built:  # lazy mode: closures are made on its first access
+                    pending = self.segments[system_name]
+                    if exists and segment_id not in pending:
+                        pending.append(segment_id)
+                    elif not exists and segment_id in pending:
+                        pending.remove(segment_id)
+                    continue
+                system_dict = self.index_system[system_name]
+                if exists:
+                    system_dict.add(segment_id)
+                    touched.add(segment_name)
+                elif system_dict.discard(segment_id):
+                    touched.add(segment_name)
+
+        if dirty_types:
+            self.update_func_index(dirty_types=dirty_types)
+        self.resized()
+        return touched
+
+    def adjacency_row(self, p, node):
+        """ neighbours of node along p, read from the graph """
+        neighbours = []
+        predicate = self.make_completed_predicate(p=p)
+        if predicate:
+            neighbours.extend(self.term_id(obj) for obj in self.g.objects(subject=node, predicate=predicate))
+        if p in intra_type_list:
+            inverse_predicate = self.make_completed_predicate(p=find_inverse_predicate(p=p))
+            if inverse_predicate:
+                neighbours.extend(self.term_id(sub) for sub in self.g.subjects(predicate=inverse_predicate, object=node))
+        return neighbours
+
+    def upstream_of(self, node, predicate):
+        """ node and every node that reaches it along predicate """
+        visited = {node}
+        stack = [node]
+        while stack:
+            for sub in self.g.subjects(predicate=predicate, object=stack.pop()):
+                if sub not in visited:
+                    visited.add(sub)
+                    stack.append(sub)
+        return visited
+
+    def update_func_index(self, dirty_types):
+        """ re-collect the functionality arrays whose sensor type was added to or removed from """
+        rdf_type = self.make_completed_predicate(p='type')
+        for function_name in function_name_dict:
+            if function_name not in self.index_func.built:  # lazy mode: read from the graph on its first access
+                continue
+            completed_sensor_type = self.sensor_types.get(function_name)
+            if completed_sensor_type is None or (None, rdf_type, completed_sensor_type) not in self.g:
+                classes = set(self.g.objects(predicate=rdf_type)) if rdf_type else set()
+                completed_sensor_type = self.find_sensor_type(function_name=function_name, classes=classes)
+                self.sensor_types[function_name] = completed_sensor_type  # first of its kind added, or last removed
+            elif completed_sensor_type not in dirty_types:
+                continue
+            if completed_sensor_type is None:
+                self.index_func[function_name] = EMPTY_IDS
+            else:
+                self.index_func[function_name] = as_ids(
+                    self.term_id(sub) for sub in self.g.subjects(predicate=rdf_type, object=completed_sensor_type))
+
+    @classmethod
+    def stream(cls, ttl_file_path, processes=None):
+        """
+        build the Indexing straight from the triples of a Turtle / N-Triples file, no Graph is kept:
+        only segment ids and the edges of the indexed predicates are collected while parsing.
+        N-Triples is parsed in chunks by `processes` worker processes; like a snapshot,
+        the graph is parsed again only when raw triples are needed (load_graph)
+        """
+        ind = cls.__new__(cls)
+        ind.ttl_file_path = ttl_file_path
+        ind.lazy = False
+        ind.version = next(INDEX_VERSIONS)
+        ind.g = None
+        ind.terms = TermTable()
+        ind.adjacency = dict()
+        ind.closure = dict()
+        ind.index_system = LazyPartitions(system_name_list)
+        ind.index_func = LazyPartitions(function_name_dict)
+        ind.sensor_types = dict()
+        ind.classes = None
+        ind.edited = False
+        ind.on_resize = None
 
+        sink = stream_triples(ttl_file_path, sink=IndexSink(index=ind), keep=indexed_triple, processes=processes)
+        ind.predicates = sink.predicates
+        ind.segments = sink.segments
+        ind.uuids = sink.uuids
+        ind.build_adjacency(edges=sink.edges)
+        ind.build_segment_tables()
+        ind.build_func_index_from_edges(edges=sink.edges)
+        ind.terms.pack()
+        return ind
+
+    @classmethod
+    def load(cls, ttl_file_path, lazy=False, stream=False, processes=None, index_only=False):
+        """
+        load the building's Indexing from its snapshot, parse the ttl file and
+        (re)write the snapshot only when the snapshot is missing or stale;
+        a lazy build writes no snapshot, it would have to build every partition.
+        stream: build with Indexing.stream() (`processes` N-Triples workers) instead of a Graph;
+        a snapshot or a streamed index holds no graph, index_only applies to the Graph build
+        """
+        ind = cls.load_snapshot(ttl_file_path)
+        if ind is None:
+            if stream:
+                ind = cls.stream(ttl_file_path=ttl_file_path, processes=processes)
+            else:
+                ind = cls(ttl_file_path=ttl_file_path, lazy=lazy, index_only=index_only)
+            if not ind.lazy:
+                ind.save_snapshot()
+        return ind
+
+    def snapshot(self):
+        """
+        the index as plain arrays: the term table, the adjacency / closure arrays, index_system, index_func
+        and the uuids of the points; terms are stored once (n3) and everything else is int32 ids
+        """
+        n_nodes = len(self.terms)
+        return {'format': SNAPSHOT_FORMAT_VERSION,
+                'terms': (self.terms.pack().blob, self.terms.offsets),
+                'adjacency': {p: (csr.compact(n_nodes).indptr, csr.indices) for p, csr in self.adjacency.items()},
+                'closure': {p: (csr.compact(n_nodes).indptr, csr.indices) for p, csr in self.closure.items()},
+                'index_system': {system_name: np.fromiter(system_dict, dtype=ID_DTYPE)
+                                 for system_name, system_dict in self.index_system.items()},
+                'index_func': dict(self.index_func),
+                'uuids': self.uuids}
+
+    @classmethod
+    def from_snapshot(cls, ttl_file_path, snapshot):
+        """ an Indexing made from snapshot(), without the graph """
+        ind = cls.__new__(cls)
+        ind.ttl_file_path = ttl_file_path
+        ind.lazy = False
+        ind.version = next(INDEX_VERSIONS)
+        ind.g = None  # the graph is not needed to answer queries
+        ind.terms = TermTable(*snapshot['terms'])
+        ind.predicates = set()
+        ind.adjacency = {p: CSR(*arrays) for p, arrays in snapshot['adjacency'].items()}
+        ind.closure = {p: CSR(*arrays) for p, arrays in snapshot['closure'].items()}
+        ind.index_system = LazyPartitions(snapshot['index_system'])
+        for system_name, segment_ids in snapshot['index_system'].items():
+            ind.index_system[system_name] = SegmentTable(index=ind, segment_ids=segment_ids.tolist())
+        ind.index_func = LazyPartitions(snapshot['index_func'])
+        for function_name, sensor_ids in snapshot['index_func'].items():
+            ind.index_func[function_name] = sensor_ids
+        ind.uuids = snapshot['uuids']
+        ind.sensor_types = dict()
+        ind.segments = None
+        ind.classes = None
+        ind.edited = False
+        ind.on_resize = None
+        return ind
+
+    def save_snapshot(self, snapshot_path=None):
+        """
+        save snapshot() to a binary file next to the ttl file, together with the ttl size, mtime and sha1
+        """
+        snapshot_path = snapshot_path or snapshot_path_of(self.ttl_file_path)
+        stat = os.stat(self.ttl_file_path)
+        snapshot = self.snapshot()
+        snapshot['source'] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                              'sha1': file_digest(self.ttl_file_path)}
+        return write_snapshot(snapshot, snapshot_path)
+
+    @classmethod
+    def load_snapshot(cls, ttl_file_path, snapshot_path=None):
+        """
+        map a snapshot back to an Indexing without parsing the ttl file,
+        None if there is no snapshot or it does not belong to the current ttl content
+        """
+        snapshot_path = snapshot_path or snapshot_path_of(ttl_file_path)
+        try:
+            with open(snapshot_path, 'rb') as f:
+                snapshot = pickle.load(f)
+            if snapshot['format'] != SNAPSHOT_FORMAT_VERSION:
+                return None
+            source = snapshot['source']
+            stat = os.stat(ttl_file_path)
+            if stat.st_size != source['size']:
+                return None
+            if stat.st_mtime_ns != source['mtime_ns']:
+                if file_digest(ttl_file_path) != source['sha1']:
+                    return None  # touched and changed
+                # only touched: still fresh, remember the new mtime so the next load does not hash the file again
+                source['mtime_ns'] = stat.st_mtime_ns
+                write_snapshot(snapshot, snapshot_path)
+        except (OSError, EOFError, KeyError, TypeError, pickle.UnpicklingError):
+            return None
+        return cls.from_snapshot(ttl_file_path=ttl_file_path, snapshot=snapshot)
 
 if __name__ == '__main__':
     ttl_file_path = PROJECT_PATH + '/hvacbrick/CP1_dy_test.ttl'
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+@file: ingest.py
+@time: 2021/2/26 10:40 上午
+@desc: stream the triples of a Turtle / N-Triples file into a sink, without building a Graph
+
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+from rdflib import Graph
+from rdflib.plugins.parsers.ntriples import W3CNTriplesParser
+from rdflib.store import Store
+from rdflib.util import guess_format
+
+NTRIPLES_CHUNK_BYTES = 16 * 1024 ** 2  # one task of the N-Triples worker pool
+
+
+def rdf_format_of(file_path):
+    """ 'nt' for '.nt' files, and so on; the ontologies are turtle unless told otherwise """
+    return guess_format(file_path) or 'turtle'
+
+
+class SinkStore(Store):
+    """ the store under a Graph().parse(): every parsed triple goes to sink.triple(s, p, o) and is not kept """
+
+    def __init__(self, sink):
+        super(SinkStore, self).__init__()
+        self.sink = sink
+
+    def add(self, triple, context, quoted=False):
+        self.sink.triple(*triple)
+
+    def __len__(self, context=None):
+        return 0
+
+
+class LabelBNodes(dict):
+    """ bnode context of the N-Triples parser: '_:b1' is the same BNode in every chunk of the file """
+
+    def get(self, label, default=None):
+        return label
+
+
+class ChunkSink(object):
+    """ worker side sink: the predicates seen, and only the triples `keep(s, p, o)` wants """
+
+    def __init__(self, keep):
+        self.keep = keep
+        self.predicates = set()
+        self.triples = []
+
+    def triple(self, s, p, o):
+        self.predicates.add(p)
+        if self.keep(s, p, o):
+            self.triples.append((s, p, o))
+
+
+def ntriples_chunks(file_path, chunk_bytes=NTRIPLES_CHUNK_BYTES):
+    """ (start, end) byte ranges of the file, every range ends at the end of a line """
+    size = os.path.getsize(file_path)
+    chunks = []
+    start = 0
+    with open(file_path, 'rb') as f:
+        while start < size:
+            f.seek(min(start + chunk_bytes, size))
+            f.readline()  # move on to the next line start
+            end = min(f.tell(), size)
+            chunks.append((start, end))
+            start = end
+    return chunks
+
+
+def parse_ntriples_chunk(file_path, start, end, keep):
+    """ worker: parse one byte range, send back the predicates and the kept triples only """
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    sink = ChunkSink(keep=keep)
+    W3CNTriplesParser(sink=sink, bnode_context=LabelBNodes()).parsestring(data)
+    return sink.predicates, sink.triples
+
+
+def stream_ntriples(file_path, sink, keep, processes=None):
+    """ N-Triples in chunks over a process pool, sink.triple() is called in file order """
+    chunks = ntriples_chunks(file_path, chunk_bytes=NTRIPLES_CHUNK_BYTES)
+    processes = min(processes or os.cpu_count() or 1, len(chunks))
+    if processes <= 1:
+        results = (parse_ntriples_chunk(file_path, start, end, keep) for start, end in chunks)
+        return feed_chunks(results, sink)
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        starts, ends = zip(*chunks)
+        results = executor.map(parse_ntriples_chunk, [file_path] * len(chunks), starts, ends, [keep] * len(chunks))
+        return feed_chunks(results, sink)
+
+
+def feed_chunks(results, sink):
+    for predicates, triples in results:
+        sink.predicates.update(predicates)
+        for s, p, o in triples:
+            sink.triple(s, p, o)
+    return sink
+
+
+def stream_triples(file_path, sink, keep, processes=None):
+    """
+    every triple of the file to sink.triple(s, p, o);
+    N-Triples is split into chunks parsed by `processes` worker processes, and only the triples
+    `keep(s, p, o)` (a module level function, workers get it pickled) wants are sent back.
+    Turtle cannot be split (prefixes, multi-line statements), it is parsed in this process
+    straight into the sink, no Graph is kept either way
+    """
+    file_format = rdf_format_of(file_path)
+    if file_format == 'nt':
+        return stream_ntriples(file_path, sink=sink, keep=keep, processes=processes)
+    Graph(store=SinkStore(sink)).parse(file_path, format=file_format)
+    return sink
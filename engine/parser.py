@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+@file: parser.py
+@time: 2021/3/5 2:40 下午
+@desc: hand-written DASQL tokenizer and recursive-descent parser, the same trees as the pyparsing grammar of
+       engineQL (query_syntax, algebra) as plain lists, without running the query
+
+"""
+
+import re
+import string
+
+from pyparsing import ParseException
+
+
+class Parameter(object):
+    """ bind parameter of a prepared query, e.g. `:building` in `WHERE B.BuildingID = :building` """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return ':' + self.name
+
+
+# token kinds, tried in this order at every position (whitespace skipped as pyparsing does)
+TOKENS = re.compile(r'''
+    (?P<string>"(?:[^"\n\r\\]|(?:"")|(?:\\(?:[^x]|x[0-9a-fA-F]+)))*"
+              |'(?:[^'\n\r\\]|(?:'')|(?:\\(?:[^x]|x[0-9a-fA-F]+)))*')
+  | (?P<number>[+-]?(?:\d+\.\d*|\.\d+|\d+)(?:[eE][+-]?\d+)?)
+  | (?P<parameter>:[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<join>%[0-9]*)
+  | (?P<compare>>=|<=|!=|>|<|=)
+  | (?P<punct>[().,*/+-])
+''', re.VERBOSE)
+WHITESPACE = re.compile(r'[ \t\r\n]*')
+KEYWORD_CHARS = set(string.ascii_letters + string.digits + '_$')  # pyparsing Keyword.DEFAULT_KEYWORD_CHARS
+EXPLAIN = re.compile(r'[ \t\r\n]*EXPLAIN(?![A-Za-z0-9_$])(?:[ \t\r\n]+(ANALYZE)(?![A-Za-z0-9_$]))?', re.IGNORECASE)
+
+# binary operators of the algebra, loosest first, every level left associative; unary '-' binds tightest
+ALGEBRA_LEVELS = [('punct', ('+', '-')), ('punct', ('*', '/')), ('join', None)]
+
+
+def number(text):
+    """ int, or float when there is a '.' or an exponent (pyparsing_common.number) """
+    if '.' in text or 'e' in text or 'E' in text:
+        return float(text)
+    return int(text)
+
+
+def tokenize(text):
+    """ [(kind, value, position)], kind 'end' last; keywords are names, Filter(B) is a sub extraction """
+    tokens = []
+    pos = WHITESPACE.match(text).end()
+    while pos < len(text):
+        match = TOKENS.match(text, pos)
+        if match is None:
+            raise ParseException(text, pos, "unexpected character %r" % text[pos])
+        kind, value = match.lastgroup, match.group()
+        if kind == 'number':
+            value = number(value)
+        elif kind == 'parameter':
+            value = Parameter(value[1:])
+        tokens.append((kind, value, pos))
+        pos = WHITESPACE.match(text, match.end()).end()
+    tokens.append(('end', None, pos))
+    return tokens
+
+
+class Parser(object):
+    """ recursive descent over the tokens, one method per grammar rule of engineQL """
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = tokenize(text)
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos]
+
+    def at(self, kind, values=None):
+        token_kind, value, _ = self.tokens[self.pos]
+        return token_kind == kind and (values is None or value in values)
+
+    def at_keyword(self, keyword):
+        """ SELECT, FROM, ... AND, OR are caseless, and not glued to the end of a word or number (.5FILTER) """
+        token_kind, value, pos = self.tokens[self.pos]
+        return token_kind == 'name' and value.upper() == keyword and \
+            (pos == 0 or self.text[pos - 1] not in KEYWORD_CHARS)
+
+    def next(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token[1]
+
+    def keyword(self, keyword):
+        if not self.at_keyword(keyword):
+            self.expect(keyword)
+        self.pos += 1
+        return keyword
+
+    def expect(self, kind, values=None):
+        if not self.at(kind, values):
+            pos = self.peek()[2]
+            raise ParseException(self.text, pos, "expected %s" % (' or '.join(values) if values else kind))
+        return self.next()
+
+    def query(self):
+        """ SELECT algebra [FROM buildings WHERE predicates [FILTER predicates]] [LABEL labels] """
+        self.keyword('SELECT')
+        tokens = [self.algebra()]
+        if self.at_keyword('FROM'):
+            self.next()
+            tokens.append(self.buildings())
+            self.keyword('WHERE')
+            tokens.append(self.predicates())
+            if self.at_keyword('FILTER'):
+                self.next()
+                tokens.append(self.predicates())
+        if self.at_keyword('LABEL'):
+            self.next()
+            tokens.append(self.labels())
+        return tokens
+
+    def algebra(self, level=0):
+        """ a + b - c is one flat [a, '+', b, '-', c], a single operand is not wrapped (infixNotation) """
+        if level == len(ALGEBRA_LEVELS):
+            return self.unary()
+        kind, values = ALGEBRA_LEVELS[level]
+        operands = [self.algebra(level + 1)]
+        while self.at(kind, values):
+            operands.append(self.next())
+            operands.append(self.algebra(level + 1))
+        return operands[0] if len(operands) == 1 else operands
+
+    def unary(self):
+        if self.at('punct', ('-',)):
+            self.next()
+            return ['-', self.unary()]
+        if self.at('punct', ('(',)):
+            self.next()
+            algebra = self.algebra()
+            self.expect('punct', (')',))
+            return algebra
+        # sub extraction: VAV(B), identifier(identifier, ...)
+        extraction = [self.expect('name')]
+        self.expect('punct', ('(',))
+        extraction.append(self.expect('name'))
+        while self.at('punct', (',',)):
+            self.next()
+            extraction.append(self.expect('name'))
+        self.expect('punct', (')',))
+        return extraction
+
+    def buildings(self):
+        """ Building B, SubBuilding C -> [['Building', 'B'], ['SubBuilding', 'C']] """
+        buildings = [self.building()]
+        while self.at('punct', (',',)):
+            self.next()
+            buildings.append(self.building())
+        return buildings
+
+    def building(self):
+        token_kind, value, _ = self.peek()
+        for kind in ('SubBuilding', 'Building'):
+            rest = value[len(kind):] if token_kind == 'name' and value.startswith(kind) else ''
+            if rest[:1].isalpha() or rest[:1] == '_':
+                # the grammar matches the literal 'Building' as a prefix: BuildingB is Building B
+                self.next()
+                return [kind, rest]
+        return [self.expect('name', ('Building', 'SubBuilding')), self.expect('name')]
+
+    def predicates(self, operators=('OR', 'AND')):
+        """ AND binds tighter than OR, flat and left associative like the algebra """
+        if not operators:
+            return self.predicate()
+        operands = [self.predicates(operators[1:])]
+        while self.at_keyword(operators[0]):
+            operands.append(self.keyword(operators[0]))
+            operands.append(self.predicates(operators[1:]))
+        return operands[0] if len(operands) == 1 else operands
+
+    def predicate(self):
+        if self.at('punct', ('(',)):
+            self.next()
+            predicates = self.predicates()
+            self.expect('punct', (')',))
+            return predicates
+        # B.BuildingID = 'ecp'
+        return [self.expect('name'), self.expect('punct', ('.',)), self.expect('name'), self.expect('compare'),
+                self.literal()]
+
+    def literal(self):
+        if self.at('string') or self.at('number') or self.at('parameter'):
+            return self.next()
+        return self.expect('literal')
+
+    def labels(self):
+        labels = [self.literal()]
+        while self.at('punct', (',',)):
+            self.next()
+            labels.append(self.literal())
+        return labels
+
+    def done(self, tree):
+        self.expect('end')
+        return tree
+
+
+def parse_query(text):
+    """ the tree of query_syntax.parseString(text, parseAll=True)[0], as lists; ParseException on bad queries """
+    parser = Parser(text)
+    return parser.done(parser.query())
+
+
+def split_explain(text):
+    """
+    'EXPLAIN [ANALYZE] SELECT ...' -> ('EXPLAIN' or 'EXPLAIN ANALYZE', 'SELECT ...'), other text -> (None, text)
+    """
+    match = EXPLAIN.match(text)
+    if match is None:
+        return None, text
+    return ('EXPLAIN ANALYZE' if match.group(1) else 'EXPLAIN'), text[match.end():]
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+@file: planner.py
+@time: 2021/3/3 4:50 下午
+@desc: logical plan of the SELECT algebra: rewrites, common sub-expressions evaluated once,
+       functionality unions of one building read as one leaf
+
+"""
+
+from collections import namedtuple
+from functools import lru_cache
+import time
+
+from engine.engineKeywords import SUBSYSTEM_LOOKUP
+from hvacbrick.building2 import building_index_key, load_building_index
+
+# plan nodes are tuples, equal sub-expressions are equal (and hash equal) nodes: a plan is a DAG
+# name upper case, e.g. Leaf('VAV', 'B'); a sorted tuple of functionality names for their union,
+# e.g. Leaf(('SETPOINT', 'TEMPERATURE'), 'B') for Temperature(B) + Setpoint(B), built in one pass over index_func
+Leaf = namedtuple('Leaf', ['name', 'building'])
+Op = namedtuple('Op', ['op', 'left', 'right'])  # op: '+', '-', '*', '%', '%2' (2 hop join)
+
+SYSTEM, FUNCTIONALITY = 's', 'f'
+
+
+def logical_plan(algebra):
+    """
+    pyparsing algebra -> plan; `a + b + c` (one group of 5) is folded to the left, as evalAlgebra would nest it
+    """
+    if len(algebra) == 2:
+        sub, building = algebra
+        if sub == '-':
+            raise TypeError("unary - is not supported")
+        return Leaf(name=sub.upper(), building=building)
+    plan = logical_plan(algebra[0])
+    for i in range(1, len(algebra), 2):
+        plan = Op(op=algebra[i], left=plan, right=logical_plan(algebra[i + 1]))
+    return plan
+
+
+@lru_cache(maxsize=4096)
+def kind_of(node):
+    """ SYSTEM or FUNCTIONALITY, the flag of the Building2Sub the node evaluates to """
+    if isinstance(node, Leaf):
+        return SYSTEM if node.name in SUBSYSTEM_LOOKUP else FUNCTIONALITY
+    if node.op in ('+', '-'):
+        return kind_of(node.left)
+    return SYSTEM  # s * f, s % s
+
+
+def union_operands(node):
+    """ leaves / sub-plans of a tree of functionality unions """
+    if isinstance(node, Op) and node.op == '+' and kind_of(node) == FUNCTIONALITY:
+        return union_operands(node.left) | union_operands(node.right)
+    return {node}
+
+
+def leaf_names(leaf):
+    return leaf.name if isinstance(leaf.name, tuple) else (leaf.name,)
+
+
+def fused_leaves(operands):
+    """ the functionality leaves of a union, one Leaf per building of all their names """
+    names, others = {}, []
+    for operand in operands:
+        if isinstance(operand, Leaf):
+            names.setdefault(operand.building, set()).update(leaf_names(operand))
+        else:
+            others.append(operand)
+    leaves = [Leaf(name=tuple(sorted(building_names)) if len(building_names) > 1 else building_names.pop(),
+                   building=building) for building, building_names in names.items()]
+    return leaves + others
+
+
+@lru_cache(maxsize=4096)
+def rewrite(node):
+    """ one bottom-up pass of the rewrite rules """
+    if isinstance(node, Leaf):
+        return node
+    op, left, right = node.op, rewrite(node.left), rewrite(node.right)
+
+    if op == '*' and kind_of(left) == FUNCTIONALITY:
+        # f * s = s * f
+        left, right = right, left
+    if op == '+' and left == right:
+        # x + x = x
+        return left
+    if op == '+' and kind_of(left) == FUNCTIONALITY:
+        # f unions are commutative and associative: one left-deep union of the distinct operands, sorted,
+        # the leaves of a building fused into one
+        operands = sorted(fused_leaves(union_operands(left) | union_operands(right)), key=repr)
+        union = operands[0]
+        for operand in operands[1:]:
+            union = Op(op='+', left=union, right=operand)
+        return union
+    if op == '+' and isinstance(left, Op) and isinstance(right, Op) and left.op == right.op == '*' \
+            and left.right == right.right:
+        # (s1 * f) + (s2 * f) = (s1 + s2) * f
+        return Op(op='*', left=rewrite(Op(op='+', left=left.left, right=right.left)), right=left.right)
+    if op == '*' and isinstance(left, Op) and left.op.startswith('%'):
+        # (s1 % s2) * f = s1 % (s2 * f): the join keeps the storage tables of s2, filter them where they come from
+        return Op(op=left.op, left=left.left, right=rewrite(Op(op='*', left=left.right, right=right)))
+    if op == '*' and isinstance(left, Op) and left.op == '-' and kind_of(left.right) == SYSTEM:
+        # (s1 - s2) * f = (s1 * f) - s2
+        return Op(op='-', left=rewrite(Op(op='*', left=left.left, right=right)), right=left.right)
+    return Op(op=op, left=left, right=right)
+
+
+def optimize(plan):
+    """ rewrite until nothing changes """
+    while True:
+        rewritten = rewrite(plan)
+        if rewritten == plan:
+            return plan
+        plan = rewritten
+
+
+def plan_nodes(plan):
+    """ distinct nodes of the plan DAG, children before parents """
+    nodes = {}
+
+    def visit(node):
+        if node in nodes:
+            return
+        if isinstance(node, Op):
+            visit(node.left)
+            visit(node.right)
+        nodes[node] = None
+
+    visit(plan)
+    return list(nodes)
+
+
+def execute(plan, buildingDic, results=None, cache=None, stats=None):
+    """
+    evaluate the plan DAG, every distinct node once;
+    results: node -> Building2Sub, filled in, may be shared by the plans of a batch
+    cache: e.g. config.SUBEXPRESSION_CACHE, node results shared across queries, a hit skips the whole subtree
+    stats: node -> {'source': 'computed' / 'cache' / 'shared', 'time': seconds of the node's own operator,
+           'total': seconds with its subtree, 'partitions': index partitions read}, filled in (EXPLAIN ANALYZE)
+    """
+    results = {} if results is None else results
+    keys = {}
+    building_keys = {}
+
+    def building_key(alias):
+        """ (ttl file, index version) of the building, looked up once per alias """
+        if alias not in building_keys:
+            ttl_path = buildingDic[alias].ttl_path
+            building_keys[alias] = (building_index_key(ttl_path), load_building_index(ttl_path).version)
+        return building_keys[alias]
+
+    def cache_key(node):
+        """ the node with each building alias replaced by (ttl file, index version) """
+        if node not in keys:
+            if isinstance(node, Leaf):
+                keys[node] = (node.name,) + building_key(node.building)
+            else:
+                keys[node] = (node.op, cache_key(node.left), cache_key(node.right))
+        return keys[node]
+
+    def evaluate(node):
+        result = results.get(node)
+        if result is not None:
+            if stats is not None and node not in stats:
+                stats[node] = {'source': 'shared', 'time': 0.0, 'total': 0.0, 'partitions': []}
+            return result
+        start = time.perf_counter() if stats is not None else None  # no clock reads on the query path
+        if cache is not None:
+            result = cache.get(cache_key(node))
+            if result is not None:
+                results[node] = result
+                if stats is not None:
+                    elapsed = time.perf_counter() - start
+                    stats[node] = {'source': 'cache', 'time': elapsed, 'total': elapsed, 'partitions': []}
+                return result
+        if isinstance(node, Leaf):
+            building = buildingDic[node.building]
+            partitions = [] if stats is None else leaf_partitions(node, building)
+            op_start = time.perf_counter() if stats is not None else None
+            if kind_of(node) == SYSTEM:
+                result = building.extract_sub_system(node.name)
+            else:
+                result = building.extract_sub_functionality(list(leaf_names(node)))
+        else:
+            left, right = evaluate(node.left), evaluate(node.right)
+            partitions = []
+            if stats is not None and node.op.startswith('%'):
+                partitions = ['closure[feeds]' if node.op == '%' else 'adjacency[feeds]']
+            op_start = time.perf_counter() if stats is not None else None
+            if node.op == '+':
+                result = left + right
+            elif node.op == '-':
+                result = left - right
+            elif node.op == '*':
+                result = left * right
+            elif node.op == '%':
+                result = left % right
+            elif node.op.startswith('%'):
+                result = left.join(right, max_hops=int(node.op[1:]))
+            else:
+                raise TypeError("unknown operator %s" % node.op)
+        results[node] = result
+        if stats is not None:
+            end = time.perf_counter()
+            stats[node] = {'source': 'computed', 'time': end - op_start, 'total': end - start, 'partitions': partitions}
+        if cache is not None:
+            cache[cache_key(node)] = result
+        return result
+
+    return evaluate(plan)
+
+
+def leaf_partitions(leaf, building):
+    """ the index partitions a leaf reads, e.g. ['index_system[AHU] (built now)'] when a lazy index builds it """
+    building_index = load_building_index(building.ttl_path)
+    if kind_of(leaf) == SYSTEM:
+        name, partitions = 'index_system', building_index.index_system
+    else:
+        name, partitions = 'index_func', building_index.index_func
+    return ['%s[%s]%s' % (name, leaf_name, '' if leaf_name in partitions.built else ' (built now)')
+            for leaf_name in leaf_names(leaf) if leaf_name in partitions]
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+@file: server.py
+@time: 2021/3/8 10:20 上午
+@desc: asyncio DASQL server, a TCP line protocol: one query per line in, one JSON line per query out, in order.
+       A request line is the query text, or {"query": ..., "params": {...}, "id": ...};
+       a response is {"ok": true, "columns": [...], "rows": [...]} or {"ok": false, "error": ...}, with the id if given;
+       EXPLAIN [ANALYZE] SELECT ... is answered with {"ok": true, "explain": report}.
+       Queries run on a pool of worker processes forked after the warm up, every worker keeps BUILDING_INDEX warm;
+       clients may pipeline, each connection has at most PIPELINE_DEPTH queries in flight, the server MAX_IN_FLIGHT,
+       beyond that the connection is not read (TCP backpressure).
+       The workers send their stage timings with a response once a second, merged into config.METRICS of the server,
+       which serves them with --metrics-port on http://127.0.0.1:<port>/metrics (Prometheus) and /metrics.json
+       run from the project root: python -m engine.server --warm-up ./ontology --metrics-port 9478
+
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+import time
+
+from config import METRICS
+from engine.engineQL import explain, prepare, warm_up
+from engine.parser import split_explain
+from hvacbrick.building2 import SUB_COLUMNS
+from tools.metrics import serve_metrics
+
+PIPELINE_DEPTH = 64  # queries in flight per connection
+MAX_IN_FLIGHT = 256  # queries in flight over all connections
+METRICS_INTERVAL = 1.0  # seconds, a worker sends its metrics with the first response after that long
+next_metrics = 0.0  # worker: time.monotonic() of the next metrics sent
+
+
+def quiet_worker():
+    """ worker initializer: e.g. the 'Skipped ...' lines of multi-building queries would flood the server log """
+    METRICS.reset()  # the warm up was counted by the server already
+    sys.stdout = open(os.devnull, 'w')
+
+
+def run_query(text, params):
+    """
+    worker: execute one query, the result as a JSON-able table (rows of Building2Sub / PortfolioSub);
+    at most every METRICS_INTERVAL the worker's metrics since it sent them last as 'metrics'
+    """
+    global next_metrics
+    try:
+        mode, text = split_explain(text)
+        if mode is not None:
+            response = {'ok': True, 'explain': explain(text, analyze=mode == 'EXPLAIN ANALYZE', **params)}
+        else:
+            response = {'ok': True, 'columns': SUB_COLUMNS, 'rows': prepare(text).execute(**params).rows()}
+    except Exception as e:  # a bad query must not take the worker down
+        METRICS.count('errors')
+        response = {'ok': False, 'error': '%s: %s' % (type(e).__name__, e)}
+    if METRICS.enabled and time.monotonic() >= next_metrics:
+        response['metrics'] = METRICS.drain()
+        next_metrics = time.monotonic() + METRICS_INTERVAL
+    return response
+
+
+def parse_request(line):
+    """ request line -> (query text, bind parameters, request id) """
+    line = line.strip()
+    if line.startswith('{'):
+        request = json.loads(line)
+        return request['query'], request.get('params') or {}, request.get('id')
+    return line, {}, None
+
+
+class QueryServer(object):
+
+    def __init__(self, executor, pipeline_depth=PIPELINE_DEPTH, max_in_flight=MAX_IN_FLIGHT):
+        self.executor = executor
+        self.pipeline_depth = pipeline_depth
+        self.in_flight = asyncio.Semaphore(max_in_flight)
+        self.served = 0
+
+    async def submit(self, line):
+        """ (future of the response, request id, submit time); waits while MAX_IN_FLIGHT queries are running """
+        loop = asyncio.get_running_loop()
+        try:
+            text, params, request_id = parse_request(line)
+        except (ValueError, KeyError) as e:
+            future = loop.create_future()
+            future.set_result({'ok': False, 'error': 'bad request: %s' % e})
+            return future, None, time.perf_counter()
+        submitted = time.perf_counter()
+        await self.in_flight.acquire()
+        METRICS.count('requests')
+        future = loop.run_in_executor(self.executor, run_query, text, params)
+        future.add_done_callback(lambda _: self.in_flight.release())
+        return future, request_id, submitted
+
+    async def handle(self, reader, writer):
+        """ one connection: read and submit queries while the writer sends the responses back in request order """
+        pending = asyncio.Queue(maxsize=self.pipeline_depth)  # full: stop reading the client
+        responder = asyncio.ensure_future(self.respond(pending, writer))
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                await pending.put(await self.submit(line.decode('utf-8')))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            await pending.put(None)
+            await responder
+            writer.close()
+
+    async def respond(self, pending, writer):
+        while True:
+            item = await pending.get()
+            if item is None:
+                return
+            future, request_id, submitted = item
+            try:
+                response = await future
+            except Exception as e:  # e.g. a worker process died
+                response = {'ok': False, 'error': '%s: %s' % (type(e).__name__, e)}
+            METRICS.merge(response.pop('metrics', None))
+            METRICS.observe('request', time.perf_counter() - submitted)  # queueing in the pool included
+            if request_id is not None:
+                response = dict(response, id=request_id)
+            self.served += 1
+            try:
+                writer.write((json.dumps(response) + '\n').encode('utf-8'))
+                await writer.drain()  # the client reads slowly: so do we
+            except ConnectionError:
+                pass
+
+
+async def serve(host, port, executor, pipeline_depth=PIPELINE_DEPTH, max_in_flight=MAX_IN_FLIGHT):
+    query_server = QueryServer(executor, pipeline_depth=pipeline_depth, max_in_flight=max_in_flight)
+    server = await asyncio.start_server(query_server.handle, host, port, limit=2 ** 20)
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    print("Energon server listening on %s:%d" % server.sockets[0].getsockname()[:2], flush=True)
+    async with server:
+        try:
+            await server.serve_forever()
+        except asyncio.CancelledError:
+            print("Energon server stopped, %d queries served" % query_server.served)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Energon query server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7878)
+    parser.add_argument('--workers', type=int, default=None, help="query worker processes, default one per cpu")
+    parser.add_argument('--warm-up', nargs='+', metavar='BUILDING', default=[],
+                        help="building ids or ontology directories (e.g. ./ontology) to index before serving")
+    parser.add_argument('--processes', type=int, default=None, help="warm up pool size, default one per cpu")
+    parser.add_argument('--pipeline-depth', type=int, default=PIPELINE_DEPTH)
+    parser.add_argument('--max-in-flight', type=int, default=MAX_IN_FLIGHT)
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help="serve the metrics on http://127.0.0.1:<port>/metrics (Prometheus), /metrics.json")
+    args = parser.parse_args()
+    if args.metrics_port:
+        serve_metrics(METRICS, port=args.metrics_port)
+    if args.warm_up:
+        warm_up(args.warm_up, processes=args.processes)
+    # the workers are forked from the warm process: every one starts with the buildings indexed
+    executor = ProcessPoolExecutor(max_workers=args.workers or os.cpu_count(), initializer=quiet_worker)
+    executor.submit(int).result()  # fork them now, before the listening socket exists
+    try:
+        asyncio.run(serve(args.host, args.port, executor, pipeline_depth=args.pipeline_depth,
+                          max_in_flight=args.max_in_flight))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        executor.shutdown()
+
+
+if __name__ == '__main__':
+    main()
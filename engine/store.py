@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+@file: store.py
+@time: 2021/3/12 3:40 下午
+@desc: columnar, time-partitioned store of the building data files: ./store/<building>/<yyyy-mm>/c<k>.npy,
+       one .npy per column and month, and a manifest.json of the columns, their dtypes as the csv parses them
+       and the time range of every partition; the rows of a month are sorted by time.npy, its parsed time column;
+       reads prune partitions by the FILTER TIMESTAMP window and columns by the query, the arrays are memory mapped;
+       iter_store reads them in chunks of rows
+       ingest from the project root: python -m engine.store ./data
+
+"""
+
+from collections import namedtuple
+from functools import lru_cache
+import argparse
+import glob
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from config import DATA_TIME_COLUMN, STORE_CHUNK_ROWS
+from engine.columns import ALL_TIME, in_range, rechunk, timestamps
+
+# bump when the store layout changes, older stores are then ignored until ingested again
+STORE_FORMAT_VERSION = 2
+MANIFEST = 'manifest.json'
+WHOLE = 'all'  # the one partition of a data file without a time column
+TIME_FILE = 'time.npy'  # ns of the rows of a partition, the time column itself is kept as the csv has it
+
+# start / end: ns of its first / last row; missing: positions of the text columns with blanks in the partition
+Partition = namedtuple('Partition', ['name', 'start', 'end', 'rows', 'missing'])
+
+
+def column_file(k):
+    return 'c%d.npy' % k
+
+
+def missing_file(k):
+    """ mask of the blanks of a text column """
+    return 'c%d.na.npy' % k
+
+
+def partition_of(times):
+    """ 'yyyy-mm' of every time (ns) """
+    return np.datetime_as_string(times.astype('datetime64[ns]').astype('datetime64[M]'), unit='M')
+
+
+def column_array(column):
+    """
+    (the stored array of a column, the mask of its blanks or None): numbers and booleans as parsed, NaN for the
+    blanks of a float column; text as fixed width strings with a mask of its blanks, other objects (e.g. booleans
+    with blanks) as they are
+    """
+    if pd.api.types.is_numeric_dtype(column) or pd.api.types.is_bool_dtype(column):
+        return column.to_numpy(), None
+    values = column.to_numpy(dtype=object)
+    missing = pd.isna(values)
+    if not all(isinstance(value, str) for value in values[~missing].tolist()):
+        return values, None
+    return np.where(missing, '', values).astype(str), missing if missing.any() else None
+
+
+def stored_dtype(column):
+    """ dtype of a column as the csv parser gives it: numbers and booleans as they are, anything else object """
+    dtype = column.dtype
+    return dtype if isinstance(dtype, np.dtype) and dtype.kind in 'biuf' else np.dtype(object)
+
+
+def common_dtype(dtype, other):
+    """ dtype of a column parsed in chunks, as read_csv joins them: numbers widen, anything else is object """
+    if dtype == other:
+        return dtype
+    if dtype.kind in 'iuf' and other.kind in 'iuf':
+        return np.result_type(dtype, other)
+    return np.dtype(object)
+
+
+def write_partition(store_dir, name, frame, columns, times):
+    """ one .npy per column, the mask of the blanks of text columns and the times (None: no time column) """
+    partition_dir = os.path.join(store_dir, name)
+    os.makedirs(partition_dir, exist_ok=True)
+    missing = []
+    for k, column in enumerate(columns):
+        array, mask = column_array(frame[column])
+        np.save(os.path.join(partition_dir, column_file(k)), array, allow_pickle=array.dtype == object)
+        if mask is not None:
+            np.save(os.path.join(partition_dir, missing_file(k)), mask)
+            missing.append(k)
+    if times is not None:
+        np.save(os.path.join(partition_dir, TIME_FILE), times)
+        return Partition(name=name, start=int(times[0]), end=int(times[-1]), rows=len(frame), missing=missing)
+    return Partition(name=name, start=None, end=None, rows=len(frame), missing=missing)
+
+
+def load_column(partition_dir, partition, k, rows=slice(None)):
+    """ rows of a stored column: memory mapped, but objects and text with blanks (NaN again) are loaded """
+    path = os.path.join(partition_dir, column_file(k))
+    try:
+        array = np.load(path, mmap_mode='r')
+    except ValueError:  # objects can not be mapped
+        array = np.load(path, allow_pickle=True)
+    array = array[rows]
+    if k in partition.missing:
+        array = array.astype(object)
+        array[np.load(os.path.join(partition_dir, missing_file(k)), mmap_mode='r')[rows]] = np.nan
+    return array
+
+
+def ingest(csv_path, store_dir, chunk_rows=None):
+    """
+    convert a data file into a store, read in chunks of `chunk_rows` rows, rows sorted by time within a month;
+    while the rows come in time order a month is written once the next one starts, the others once the file
+    is read through; a late row of a month written already is merged into it (the month is read back and written
+    again with the others). Every column keeps the dtype the csv parser gives it on the whole file.
+    Written next to the store and renamed over it, readers see the old store or the new one
+    :return: the manifest
+    """
+    stat = os.stat(csv_path)
+    tmp_dir = store_dir.rstrip('/\\') + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    columns, dtypes, written = None, None, {}  # month -> Partition written
+    pending = {}  # month -> [(frame, times)], not written yet
+    in_order, last_time = True, None
+    for chunk in pd.read_csv(csv_path, chunksize=chunk_rows or STORE_CHUNK_ROWS):
+        if columns is None:
+            columns = list(chunk.columns)
+            dtypes = [stored_dtype(chunk[column]) for column in columns]
+        dtypes = [common_dtype(dtype, stored_dtype(chunk[column])) for dtype, column in zip(dtypes, columns)]
+        if DATA_TIME_COLUMN not in columns:
+            pending.setdefault(WHOLE, []).append((chunk, None))
+            continue
+        times = timestamps(chunk[DATA_TIME_COLUMN])
+        months = partition_of(times)
+        for month in dict.fromkeys(months.tolist()):
+            if month in written:  # a late row: never two partitions of a month
+                pending.setdefault(month, []).append(read_partition(tmp_dir, written.pop(month), columns))
+            pending.setdefault(month, []).append((chunk[months == month], times[months == month]))
+        if in_order and times.size:
+            in_order = (last_time is None or times[0] >= last_time) and bool(np.all(np.diff(times) >= 0))
+            last_time = times[-1]
+        if in_order:
+            for month in sorted(m for m in pending if m < months[-1]):  # no more rows for them while sorted
+                written[month] = flush(tmp_dir, month, pending.pop(month), columns)
+    for month in sorted(pending):
+        written[month] = flush(tmp_dir, month, pending.pop(month), columns)
+    partitions = list(written.values())
+
+    manifest = {'format': STORE_FORMAT_VERSION,
+                'source': {'path': os.path.abspath(csv_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns},
+                'time column': DATA_TIME_COLUMN if DATA_TIME_COLUMN in (columns or []) else None,
+                'columns': columns or [],
+                'dtypes': [dtype.name for dtype in dtypes or []],
+                'partitions': [p._asdict() for p in sorted(partitions, key=lambda p: p.name)]}
+    with open(os.path.join(tmp_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    old_dir = store_dir.rstrip('/\\') + '.old'
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.isdir(store_dir):
+        os.replace(store_dir, old_dir)
+    os.replace(tmp_dir, store_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return manifest
+
+
+def read_partition(store_dir, partition, columns):
+    """ (the frame, the times) of a partition written by write_partition """
+    partition_dir = os.path.join(store_dir, partition.name)
+    frame = pd.DataFrame({column: np.array(load_column(partition_dir, partition, k))
+                          for k, column in enumerate(columns)}, columns=columns)
+    return frame, np.load(os.path.join(partition_dir, TIME_FILE))
+
+
+def flush(store_dir, name, parts, columns):
+    frame = pd.concat([frame for frame, _ in parts], ignore_index=True)
+    if name == WHOLE:
+        return write_partition(store_dir, name, frame, columns, None)
+    times = np.concatenate([times for _, times in parts])
+    order = np.argsort(times, kind='stable')
+    return write_partition(store_dir, name, frame.take(order).reset_index(drop=True), columns, times[order])
+
+
+@lru_cache(maxsize=1024)
+def manifest_of(store_dir, mtime_ns):
+    with open(os.path.join(store_dir, MANIFEST)) as f:
+        manifest = json.load(f)
+    manifest['partitions'] = [Partition(**p) for p in manifest['partitions']]
+    manifest['positions'] = {column: k for k, column in enumerate(manifest['columns'])}
+    manifest['dtypes'] = [np.dtype(dtype) for dtype in manifest['dtypes']]
+    return manifest
+
+
+def load_manifest(store_dir, csv_path=None):
+    """
+    the manifest of a store, None when there is none, it has another format,
+    or it was ingested from another version of csv_path (the data file was rewritten since)
+    """
+    try:
+        manifest = manifest_of(store_dir, os.stat(os.path.join(store_dir, MANIFEST)).st_mtime_ns)
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    if manifest.get('format') != STORE_FORMAT_VERSION:
+        return None
+    if csv_path is not None and os.path.isfile(csv_path):
+        stat = os.stat(csv_path)
+        if (stat.st_size, stat.st_mtime_ns) != (manifest['source']['size'], manifest['source']['mtime_ns']):
+            return None
+    return manifest
+
+
+def read_store(store_dir, columns, manifest=None, report=None, window=ALL_TIME):
+    """
+    the given columns of a store, in file order, the rows of the window: like columns.read_columns, only the
+    partitions overlapping the window are opened, and only the column files asked for, memory mapped;
+    the columns come back with the dtypes and values read_columns gives
+    report: 'columns' / 'total columns', 'partitions' / 'total partitions', 'rows', 'bytes read', 'bytes needed'
+    """
+    manifest = manifest or load_manifest(store_dir)
+    selected, partitions = store_selection(store_dir, manifest, columns, window)
+
+    parts = {column: [] for column in selected}
+    bytes_read = rows = 0
+    for partition in partitions:
+        partition_dir = os.path.join(store_dir, partition.name)
+        rows_of = partition_rows(partition_dir, manifest, partition, window)
+        for column in selected:
+            array = load_column(partition_dir, partition, manifest['positions'][column], rows_of)
+            bytes_read += array.nbytes
+            parts[column].append(array)
+        rows += len(parts[selected[0]][-1])
+
+    data = pd.DataFrame({column: concatenate(arrays, column_dtype(manifest, column))
+                         for column, arrays in parts.items()},
+                        columns=selected, copy=False)  # columns of one partition stay views of the mapped files
+    if report is not None:
+        report.update(store_report(manifest, selected, partitions, rows, bytes_read))
+    return data
+
+
+def iter_store(store_dir, columns, chunk_rows, manifest=None, report=None, window=ALL_TIME):
+    """
+    read_store as an iterator of frames of chunk_rows rows, the last one shorter: the partitions of the window are
+    mapped one after the other and copied out a chunk at a time, memory holds one chunk whatever the window
+    report: filled in as read_store's once the iterator is exhausted
+    """
+    manifest = manifest or load_manifest(store_dir)
+    selected, partitions = store_selection(store_dir, manifest, columns, window)
+    counts = {'rows': 0, 'bytes read': 0}
+
+    def frames():
+        for partition in partitions:
+            partition_dir = os.path.join(store_dir, partition.name)
+            rows_of = partition_rows(partition_dir, manifest, partition, window)
+            arrays = {column: load_column(partition_dir, partition, manifest['positions'][column], rows_of)
+                      for column in selected}
+            size = len(arrays[selected[0]])
+            counts['bytes read'] += sum(array.nbytes for array in arrays.values())
+            for first in range(0, size, chunk_rows):
+                chunk = {column: np.array(array[first:first + chunk_rows], dtype=column_dtype(manifest, column))
+                         for column, array in arrays.items()}
+                counts['rows'] += len(chunk[selected[0]])
+                yield pd.DataFrame(chunk, columns=selected, copy=False)
+            del arrays  # unmapped before the next partition
+
+    yield from rechunk(frames(), chunk_rows)
+    if report is not None:
+        report.update(store_report(manifest, selected, partitions, counts['rows'], counts['bytes read']))
+
+
+def store_selection(store_dir, manifest, columns, window):
+    """ (the columns to read in file order, the partitions overlapping the window) """
+    time_column = manifest['time column']
+    wanted = set(columns)
+    if window != ALL_TIME:
+        if time_column is None:
+            raise ValueError("FILTER TIMESTAMP: %s has no %s column" % (store_dir, DATA_TIME_COLUMN))
+        wanted.add(time_column)
+    selected = [column for column in manifest['columns'] if column in wanted]
+    return selected, [p for p in manifest['partitions'] if overlaps(p, window)] if selected else []
+
+
+def partition_rows(partition_dir, manifest, partition, window):
+    """ slice of the rows of a partition in the window """
+    if window == ALL_TIME or within(partition, window):
+        return slice(None)
+    # the window starts or ends in this partition: its rows by the sorted times
+    times = np.load(os.path.join(partition_dir, TIME_FILE), mmap_mode='r')
+    first = 0 if window.start is None else \
+        np.searchsorted(times, window.start, side='left' if window.start_inclusive else 'right')
+    last = len(times) if window.end is None else \
+        np.searchsorted(times, window.end, side='right' if window.end_inclusive else 'left')
+    return slice(int(first), int(max(first, last)))
+
+
+def store_report(manifest, selected, partitions, rows, bytes_read):
+    """ as columns.read_report: 'bytes needed' estimated from the rows and the item size of the selected columns """
+    needed = sum(column_dtype(manifest, column).itemsize for column in selected)
+    return {'columns': len(selected), 'total columns': len(manifest['columns']),
+            'partitions': len(partitions), 'total partitions': len(manifest['partitions']),
+            'rows': rows, 'bytes read': bytes_read, 'bytes needed': rows * needed}
+
+
+def overlaps(partition, window):
+    if partition.start is None:
+        return True
+    return bool(in_range(np.array([partition.end]), window._replace(end=None))[0]) and \
+        bool(in_range(np.array([partition.start]), window._replace(start=None))[0])
+
+
+def within(partition, window):
+    """ every row of the partition is in the window """
+    return partition.start is not None and bool(in_range(np.array([partition.start, partition.end]), window).all())
+
+
+def column_dtype(manifest, column):
+    return manifest['dtypes'][manifest['positions'][column]]
+
+
+def concatenate(arrays, dtype):
+    """
+    one array of the column's partitions, of the column's dtype (e.g. float64 for ints of a month and blanks of
+    another, object for text); a single mapped partition of that dtype is not copied
+    """
+    if not arrays:
+        return np.zeros(0, dtype=dtype)
+    if len(arrays) == 1:
+        return arrays[0] if arrays[0].dtype == dtype else arrays[0].astype(dtype)
+    return np.concatenate([array if array.dtype == dtype else array.astype(dtype) for array in arrays])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ingest building data files into the columnar store')
+    parser.add_argument('data', nargs='+', help="data files (./data/<building>.csv) or directories of them")
+    parser.add_argument('--store', default='./store', help="store root, one directory per building")
+    parser.add_argument('--chunk-rows', type=int, default=None, help="rows read at a time")
+    args = parser.parse_args()
+    csv_paths = []
+    for data in args.data:
+        csv_paths.extend(sorted(glob.glob(os.path.join(data, '*.csv'))) if os.path.isdir(data) else [data])
+    for csv_path in csv_paths:
+        building = os.path.splitext(os.path.basename(csv_path))[0]
+        manifest = ingest(csv_path, os.path.join(args.store, building), chunk_rows=args.chunk_rows)
+        print("%s: %d columns, %d partitions, %d rows" % (building, len(manifest['columns']),
+                                                          len(manifest['partitions']),
+                                                          sum(p['rows'] for p in manifest['partitions'])))
+
+
+if __name__ == '__main__':
+    main()
@@ -10,22 +10,97 @@
 
 from rdflib import Graph, Literal
 from rdflib.plugins.sparql import prepareQuery
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+import numpy as np
+import os
+import pandas as pd
 
 from engine.indexing import Indexing
-from config import BUILDING_INDEX, SUB_FLAG
+from engine.csr import ID_DTYPE, EMPTY_IDS, as_bitmap, fit_bitmap
+from config import BUILDING_INDEX, SUB_FLAG, INDEX_SNAPSHOT, INDEX_LAZY, INDEX_STREAM_INGEST, INDEX_INGEST_PROCESSES
+from config import INDEX_ONLY, METRICS
 from tools.basic import merge_dicts
 
 
+SUB_COLUMNS = ['building', 'segment', 'point']  # Building2Sub.rows()
+
+
+def building_index_key(ttl_path):
+    """ one BUILDING_INDEX entry per ttl file, however its path is spelled """
+    return os.path.abspath(ttl_path)
+
+
+def build_building_index(ttl_path):
+    """ the whole building's Indexing, or with INDEX_LAZY its partitions on first access """
+    with METRICS.timer('index'):
+        if INDEX_SNAPSHOT:
+            return Indexing.load(ttl_file_path=ttl_path, lazy=INDEX_LAZY,  # snapshot next to the ttl, rebuilt when stale
+                                 stream=INDEX_STREAM_INGEST, processes=INDEX_INGEST_PROCESSES, index_only=INDEX_ONLY)
+        elif INDEX_STREAM_INGEST:
+            return Indexing.stream(ttl_file_path=ttl_path, processes=INDEX_INGEST_PROCESSES)
+        else:
+            return Indexing(ttl_file_path=ttl_path, lazy=INDEX_LAZY, index_only=INDEX_ONLY)
+
+
 def load_building_index(ttl_path):
     """
-    index manager
+    index manager, BUILDING_INDEX is a memory bounded cache (config.BUILDING_INDEX_MEMORY_BUDGET)
+    """
+    key = building_index_key(ttl_path)
+    building_index = BUILDING_INDEX.get(key)  # counts a hit or a miss; LRU / LFU bookkeeping
+    if building_index is None:
+        building_index = install_building_index(key, build_building_index(ttl_path=ttl_path))
+    elif building_index.lazy:
+        BUILDING_INDEX.resize(key)  # partitions built since the last access
+    return building_index
+
+
+def install_building_index(key, building_index):
+    """ into BUILDING_INDEX, which may evict other buildings to stay within the memory budget; its size is
+    accounted again whenever its graph is loaded, released or edited """
+    building_index.on_resize = partial(BUILDING_INDEX.resize, key)
+    BUILDING_INDEX[key] = building_index
+    return building_index
+
+
+def build_index_snapshot(ttl_path):
+    """ worker of warm_up_building_index: index one building, send back the arrays but not the graph """
+    return build_building_index(ttl_path=ttl_path).snapshot()
+
+
+def warm_up_building_index(ttl_paths, processes=None):
     """
-    if ttl_path in BUILDING_INDEX:
-        return BUILDING_INDEX[ttl_path]
-    else:
-        building_index = Indexing(ttl_file_path=ttl_path)  # load the whole building's Indexing
-        BUILDING_INDEX[ttl_path] = building_index
-        return BUILDING_INDEX[ttl_path]
+    build the Indexing of many buildings in a process pool and install them into BUILDING_INDEX,
+    e.g. before a service starts to accept queries; buildings already indexed are skipped
+    :parameter processes: pool size, None for one worker per cpu, 1 indexes them in this process
+    :return: the ttl paths that could not be indexed
+    """
+    pending = [ttl_path for ttl_path in dict.fromkeys(ttl_paths) if building_index_key(ttl_path) not in BUILDING_INDEX]
+    failed = []
+    if not pending:
+        return failed
+    if processes == 1:
+        for ttl_path in pending:
+            try:
+                load_building_index(ttl_path)
+            except Exception as e:
+                print("Index warm up failed for %s: %s" % (ttl_path, e))
+                failed.append(ttl_path)
+        return failed
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = {executor.submit(build_index_snapshot, ttl_path): ttl_path for ttl_path in pending}
+        for future in as_completed(futures):
+            ttl_path = futures[future]
+            try:
+                snapshot = future.result()
+            except Exception as e:
+                print("Index warm up failed for %s: %s" % (ttl_path, e))
+                failed.append(ttl_path)
+                continue
+            install_building_index(building_index_key(ttl_path),
+                                   Indexing.from_snapshot(ttl_file_path=ttl_path, snapshot=snapshot))
+    return failed
 
 
 class Building2:
@@ -66,13 +141,17 @@ class Building2Sub():
     """
     subsystem
     index
+    the sub-ontology is a bitmap over the building's term ids (segments of a system, sensors of a functionality),
+    the operators are vectorized bit operations on it
     """
 
-    def __init__(self, building_id, sub_type, sys_func_flag, ttl_path, sub_index=None):
+    def __init__(self, building_id, sub_type, sys_func_flag, ttl_path, bitmap=None, point_filters=None):
         """
         :parameter sub_type: e.g. 'VAV'
         :parameter sys_func_flag:
-        :parameter sub_index: subsystem's sub_index ，can assign value directly
+        :parameter bitmap: subsystem's members，can assign value directly
+        :parameter point_filters: system only, [(segments bitmap, points bitmap or None)];
+                   a segment keeps the hasPoint sensors of the last filter covering it, None keeps them all
         """
         # super().__init__(building_id)
         self.building_id = building_id
@@ -84,22 +163,90 @@ class Building2Sub():
             self.sub_type_list = [sub_type.upper()]
         else:
             self.sub_type_list = sub_type  # finally self.sub_type_list = []
+        self.point_filters = point_filters or []
 
         # 2. load sub's indexing
-        if sub_index:
-            # this scenario is parameter `sub_index` not None; when operation, first get index from __add__(), and assign value directly
-            self.sub_index = sub_index
+        if bitmap is not None:
+            # this scenario is parameter `bitmap` not None; when operation, first get bitmap from __add__(), and assign value directly
+            self.bitmap = bitmap
         else:
-            if self.sys_func_flag == SUB_FLAG['system']:
-                self.sub_index = {}
-                for sub_type in self.sub_type_list:
-                    sub_dict = BUILDING_INDEX[self.ttl_path].index_system[sub_type]  # dict {Chiller_1, Chiller_2}, if type is 'CHILLER'
-                    self.sub_index.update(sub_dict)
-            else:
-                self.sub_index = []
-                for sub_type in self.sub_type_list:
-                    sub_list = BUILDING_INDEX[self.ttl_path].index_func[sub_type]  # list
-                    self.sub_index.extend(sub_list)
+            building_index = load_building_index(self.ttl_path)
+            n_nodes = len(building_index.terms)
+            self.bitmap = np.zeros(n_nodes, dtype=bool)
+            for sub_type in self.sub_type_list:
+                if self.sys_func_flag == SUB_FLAG['system']:
+                    # segment ids {Chiller_1, Chiller_2}, if type is 'CHILLER'
+                    ids = building_index.index_system[sub_type].ids
+                else:
+                    ids = building_index.index_func[sub_type]  # sorted id array
+                self.bitmap |= as_bitmap(ids, n_nodes=n_nodes)
+
+    @property
+    def ids(self):
+        """ sorted term ids of the segments / sensors """
+        return np.flatnonzero(self.bitmap).astype(ID_DTYPE)
+
+    @property
+    def nbytes(self):
+        """ bitmaps held, for the memory budget of the sub-expression cache """
+        return self.bitmap.nbytes + sum(segments.nbytes + (0 if points is None else points.nbytes)
+                                        for segments, points in self.point_filters)
+
+    @property
+    def sub_index(self):
+        """
+        system: {segment id: storage table}, hasPoint filtered by point_filters;
+        functionality: sorted array of sensor ids
+        """
+        if self.sys_func_flag != SUB_FLAG['system']:
+            return self.ids
+        building_index = load_building_index(self.ttl_path)
+        sub_index = {}
+        for segment_id, sensors in self.segment_points():
+            storage_table = building_index.make_segment(segment_id)
+            storage_table['intra']['hasPoint'] = sensors
+            sub_index[segment_id] = storage_table
+        return sub_index
+
+    def segment_points(self):
+        """
+        system: (segment id, its hasPoint sensors left by the point filters) per segment
+        """
+        building_index = load_building_index(self.ttl_path)
+        n_nodes = len(building_index.terms)
+        owner = np.full(n_nodes, -1)  # segment id -> its point filter
+        for k, (segments, _) in enumerate(self.point_filters):
+            owner[fit_bitmap(segments, n_nodes)] = k
+        kept = [None if points is None else fit_bitmap(points, n_nodes) for _, points in self.point_filters]
+
+        has_point = building_index.adjacency['hasPoint']
+        for segment_id in self.ids.tolist():
+            sensors = has_point.row(segment_id)
+            points = kept[owner[segment_id]] if owner[segment_id] >= 0 else None
+            yield segment_id, sensors if points is None else sensors[points[sensors]]
+
+    def points(self):
+        """
+        sorted term ids of the sensors: the hasPoint sensors of the segments left by the point filters,
+        or the sensors of a functionality
+        """
+        if self.sys_func_flag != SUB_FLAG['system']:
+            return self.ids
+        sensors = [points for _, points in self.segment_points()]
+        return np.unique(np.concatenate(sensors)).astype(ID_DTYPE) if sensors else EMPTY_IDS
+
+    def rows(self):
+        """
+        one (building, segment, point) per sensor, segment is None for a functionality
+        """
+        building_index = load_building_index(self.ttl_path)
+        if self.sys_func_flag != SUB_FLAG['system']:
+            return [(self.building_id, None, str(building_index.term(point))) for point in self.ids.tolist()]
+        return [(self.building_id, str(building_index.term(segment_id)), str(building_index.term(point)))
+                for segment_id, sensors in self.segment_points() for point in sensors.tolist()]
+
+    def to_frame(self):
+        return pd.DataFrame(self.rows(), columns=SUB_COLUMNS)
 
     def __add__(self, other):
         """
@@ -110,37 +257,65 @@ class Building2Sub():
         sub_type_list.extend(other.sub_type_list)
 
         if self.sys_func_flag == SUB_FLAG['system'] and other.sys_func_flag == SUB_FLAG['system']:
-            # s + s = s
+            # s + s = s, a segment of both keeps the storage table of `other`
             sys_func_flag = SUB_FLAG['system']
-
-            added_sub_index = {}
-            added_sub_index.update(self.sub_index)
-            added_sub_index.update(other.sub_index)
+            point_filters = self.point_filters + [(other.bitmap, None)] + [
+                (bit_and(segments, other.bitmap), kept) for segments, kept in other.point_filters]
+            while point_filters and point_filters[0][1] is None:  # a leading `keep all` changes nothing
+                point_filters.pop(0)
 
             return Building2Sub(building_id=self.building_id,
                                 sub_type=sub_type_list,
                                 sys_func_flag=sys_func_flag,
                                 ttl_path=self.ttl_path,
-                                sub_index=added_sub_index
+                                bitmap=bit_or(self.bitmap, other.bitmap),
+                                point_filters=point_filters
                                 )
 
         elif self.sys_func_flag == SUB_FLAG['functionality'] and other.sys_func_flag == SUB_FLAG['functionality']:
             # f + f = f
             sys_func_flag = SUB_FLAG['functionality']
 
-            added_sub_index = []
-            added_sub_index.extend(self.sub_index)
-            added_sub_index.extend(other.sub_index)
-
             return Building2Sub(building_id=self.building_id,
                                 sub_type=sub_type_list,
                                 sys_func_flag=sys_func_flag,
                                 ttl_path=self.ttl_path,
-                                sub_index=added_sub_index
+                                bitmap=bit_or(self.bitmap, other.bitmap)
                                 )
         else:
             raise TypeError("__add__ error: Can't add system + functionality")
 
+    def __sub__(self, other):
+        """
+        s-s and f-f remove the segments / sensors of `other`,
+        s-f removes the sensors of `other` from the hasPoint of every segment
+        """
+        if self.sys_func_flag == other.sys_func_flag:
+            # s - s = s, f - f = f
+            return Building2Sub(building_id=self.building_id,
+                                sub_type=self.sub_type_list,
+                                sys_func_flag=self.sys_func_flag,
+                                ttl_path=self.ttl_path,
+                                bitmap=bit_and_not(self.bitmap, other.bitmap),
+                                point_filters=self.point_filters
+                                )
+
+        elif self.sys_func_flag == SUB_FLAG['system'] and other.sys_func_flag == SUB_FLAG['functionality']:
+            # s - f = s
+            sub_type_list = []
+            sub_type_list.extend(self.sub_type_list)
+            sub_type_list.extend(other.sub_type_list)
+            return Building2Sub(building_id=self.building_id,
+                                sub_type=sub_type_list,
+                                sys_func_flag=SUB_FLAG['system'],
+                                ttl_path=self.ttl_path,
+                                bitmap=self.bitmap,
+                                point_filters=filter_points(s=self, points=~other.bitmap)
+                                )
+
+        else:
+            raise TypeError("__sub__ error: Can't subtract system from functionality")
+
     def __mul__(self, other):
         """
         only s * f ,   (s * s is special，is downstream of join，two s should be same type
@@ -151,21 +326,21 @@ class Building2Sub():
         sub_type_list.extend(other.sub_type_list)
 
         if self.sys_func_flag == SUB_FLAG['system'] and other.sys_func_flag == SUB_FLAG['functionality']:
-            final_index = system_mul_func(s=self, f=other)
             return Building2Sub(building_id=self.building_id,
                                 sub_type=sub_type_list,
                                 sys_func_flag=SUB_FLAG['system'],
                                 ttl_path=self.ttl_path,
-                                sub_index=final_index
+                                bitmap=self.bitmap,
+                                point_filters=filter_points(s=self, points=other.bitmap)
                                 )
 
         elif self.sys_func_flag == SUB_FLAG['functionality'] and other.sys_func_flag == SUB_FLAG['system']:
-            final_index = system_mul_func(s=other, f=self)
             return Building2Sub(building_id=self.building_id,
                                 sub_type=sub_type_list,
                                 sys_func_flag=SUB_FLAG['system'],
                                 ttl_path=self.ttl_path,
-                                sub_index=final_index
+                                bitmap=other.bitmap,
+                                point_filters=filter_points(s=other, points=self.bitmap)
                                 )
 
         else:
@@ -173,38 +348,104 @@ class Building2Sub():
 
     def __mod__(self, other):
         """
-        %; used to overwrite join
+        %; used to overwrite join: semi-join, the segments of `other` fed (multi-hop) by `self`
         """
-        self_feeds_entity_name = []  # all the entity name, which feeds by self system
+        return self.join(other, predicate='feeds')
 
+    def join(self, other, predicate='feeds', max_hops=None):
+        """
+        path join: the segments of `other` reached from the segments of `self` along `predicate`
+        in 1 to max_hops hops (e.g. 'Chiller feeds+ Room' is max_hops=None), storage tables of `other`;
+        the transitive join reads the closure arrays of the index, the bounded one walks its adjacency arrays
+        """
         if self.sys_func_flag != SUB_FLAG['system'] or other.sys_func_flag != SUB_FLAG['system']:
             raise TypeError("__join__ error: ")
-        for entity_name, entity_dict in self.sub_index.items():
-            self_feeds_entity_name.extend(entity_dict['inter']['feeds'])
+        building_index = load_building_index(self.ttl_path)
+        if predicate not in building_index.adjacency:
+            raise ValueError("join error: %s is not an indexed predicate" % predicate)
+        n_nodes = max(len(building_index.terms), other.bitmap.shape[0])
 
-        final_sub_dict = other.sub_index.copy()
-        for entity in other.sub_index:
-            if entity not in self_feeds_entity_name:
-                del final_sub_dict[entity]
+        if max_hops is None and predicate in building_index.closure:
+            reached = as_bitmap(building_index.closure[predicate].rows(self.ids), n_nodes=n_nodes)
+        else:
+            adjacency = building_index.adjacency[predicate]
+            reached = np.zeros(n_nodes, dtype=bool)
+            frontier = self.ids
+            hops = 0
+            while frontier.size and (max_hops is None or hops < max_hops):
+                frontier = np.unique(adjacency.rows(frontier))
+                frontier = frontier[~reached[frontier]]  # each node is expanded once
+                reached[frontier] = True
+                hops += 1
 
         return Building2Sub(building_id=self.building_id,
                             sub_type=other.sub_type_list,
                             sys_func_flag=SUB_FLAG['system'],
                             ttl_path=self.ttl_path,
-                            sub_index=final_sub_dict
+                            bitmap=bit_and(other.bitmap, reached),
+                            point_filters=other.point_filters
                             )
 
 
+class PortfolioSub(object):
+    """
+    result of a multi-building query: one Building2Sub per building, in the order the buildings were given
+    """
+
+    def __init__(self, subs):
+        self.subs = subs  # building id -> Building2Sub
+
+    def __getitem__(self, building_id):
+        return self.subs[building_id]
+
+    def __iter__(self):
+        return iter(self.subs)
+
+    def __len__(self):
+        return len(self.subs)
+
+    def items(self):
+        return self.subs.items()
+
+    @property
+    def nbytes(self):
+        return sum(sub.nbytes for sub in self.subs.values())
+
+    def rows(self):
+        """
+        the sensors of every building, the `building` column tells them apart
+        """
+        return [row for sub in self.subs.values() for row in sub.rows()]
+
+    def to_frame(self):
+        return pd.DataFrame(self.rows(), columns=SUB_COLUMNS)
+
+
+def aligned(a, b):
+    """ two bitmaps over the same term ids, terms may have been interned between their making """
+    n_nodes = max(a.shape[0], b.shape[0])
+    return fit_bitmap(a, n_nodes), fit_bitmap(b, n_nodes)
+
+
+def bit_or(a, b):
+    a, b = aligned(a, b)
+    return a | b
+
+
+def bit_and(a, b):
+    a, b = aligned(a, b)
+    return a & b
+
+
+def bit_and_not(a, b):
+    a, b = aligned(a, b)
+    return a & ~b
 
 
-def system_mul_func(s, f):
+def filter_points(s, points):
     """
-    only for s*f,
-    both are objective of Building2Sub
+    s*f and s-f: point filters of `s` with hasPoint of every segment also limited to `points`;
+    the storage tables of the building's index are shared and never changed
     """
-    the_system_index_dict = s.sub_index.copy()  # dict in `system`
-    for segment_name, segment_dict in the_system_index_dict.items():
-        belonged_sensors = segment_dict['intra']['hasPoint']
-        segment_dict['intra']['hasPoint'] = list(set(belonged_sensors) &
-                                                 set(f.sub_index))
-    return s.sub_index
+    return [(s.bitmap, points)] + [(segments, points if kept is None else bit_and(kept, points))
+                                   for segments, kept in s.point_filters]
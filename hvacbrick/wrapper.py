@@ -3,6 +3,26 @@ import pandas as pd
 import os
 
 from hvacbrick.namespace import *
+from config import DATA_STORE, DATA_TIME_COLUMN
+from engine.columns import layout_of
+from engine.store import load_manifest, read_store
+
+
+def date_columns(header):
+    """ the columns read as dates: the third one of a data file, and its time column """
+    return [column for i, column in enumerate(header) if i == 2 or column == DATA_TIME_COLUMN]
+
+
+def parse_dates(df, columns):
+    """ the given text columns of df as datetime64[ns], the same from the csv or the store; numbers and text
+    that is no date are left as they are """
+    for column in columns:
+        if column in df.columns and not pd.api.types.is_numeric_dtype(df[column]):
+            try:
+                df[column] = pd.to_datetime(df[column]).astype('datetime64[ns]')
+            except (ValueError, TypeError):
+                pass
+    return df
 
 class HVACGraph(object):
     """
@@ -60,16 +80,29 @@ class HVACGraph(object):
 
         return rows
 
-    def getBuildingStream(self, building):
+    def getBuildingStream(self, building, columns=None):
+        """
+        data of a building: the given columns (None: all of them) in file order, the date columns parsed the same
+        way from the columnar store and from the csv
+        """
         preparedQuery = """select ?buildingID where {
             ?building rdf:type brick:Building .
             ?building brick:hasID ?buildingID .
             }
             """
         filePath = 'data/'
+        storePath = 'store/'
         buildingIDs = self.query(preparedQuery)
         if [Literal(building)] in buildingIDs:
-            df = pd.read_csv(filePath + building + '.csv', parse_dates = [2] )
-            return df
+            # the columnar store (engine/store.py) while it holds the current csv: no text parsing, memory mapped
+            csvPath = filePath + building + '.csv'
+            manifest = load_manifest(storePath + building, csv_path=csvPath) if DATA_STORE else None
+            header = manifest['columns'] if manifest is not None else layout_of(csvPath).columns
+            selected = header if columns is None else [column for column in header if column in set(columns)]
+            if manifest is not None:
+                df = read_store(storePath + building, selected, manifest=manifest)
+            else:
+                df = pd.read_csv(csvPath, usecols=selected)
+            return parse_dates(df, date_columns(header))
         else:
             raise Exception("Building {0} not exist!".format(building))
\ No newline at end of file
@@ -8,7 +8,9 @@
 
 """
 from config import reverse_pairs_list
-import time
+import numpy as np
+
+from engine.csr import ID_DTYPE, EMPTY_IDS
 
 
 def find_inverse_predicate(p):
@@ -21,17 +23,90 @@ def find_inverse_predicate(p):
     return None  # not all predicate has inverse value
 
 
-def multi_hop_traversal(g, subject0, p, results_list):
+def multi_hop_ids(adjacency, start):
+    """
+    ids of every node that `start` reaches along the adjacency (a CSR over term ids),
+    each node once; `start` itself only when it lies on a cycle
+    """
+    visited = set()
+    stack = list(adjacency.row(start))
+    while stack:
+        node = stack.pop()
+        if node not in visited:
+            visited.add(node)
+            stack.extend(adjacency.row(node))
+    return visited
+
+
+def strongly_connected_components(adjacency, roots):
+    """
+    Tarjan's algorithm without recursion, over the nodes reachable from `roots`;
+    components come out in reverse topological order (a component after every component it reaches)
+    returns (list of member lists, node -> component number)
+    """
+    index, low = {}, {}
+    stack, on_stack = [], set()
+    components, component_of = [], {}
+    for root in roots:
+        if root in index:
+            continue
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(adjacency.row(root).tolist()))]
+        while work:
+            node, neighbours = work[-1]
+            for nxt in neighbours:
+                if nxt not in index:
+                    index[nxt] = low[nxt] = len(index)
+                    stack.append(nxt)
+                    on_stack.add(nxt)
+                    work.append((nxt, iter(adjacency.row(nxt).tolist())))
+                    break
+                elif nxt in on_stack:
+                    low[node] = min(low[node], index[nxt])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    members = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component_of[member] = len(components)
+                        members.append(member)
+                        if member == node:
+                            break
+                    components.append(members)
+    return components, component_of
+
+
+def reachability_index(adjacency, sources):
     """
-    based on（across system）predicate，find all system that initial subject0 can visit
-    subject0: initial node while traverse
+    every node each of `sources` reaches along the adjacency (a CSR over term ids), computed once:
+    cycles are condensed into their strongly connected component and reach sets are propagated
+    from the sinks upwards, so a downstream chain shared by many upstream nodes is walked once
+    returns {source: sorted id array}
     """
-    # 3.2 inter edge
-    # for predicate, down_list in segment_dict['inter'].items():  # edge's name and downstream list（ save as lsit in Storage Table）
-    for obj in g.objects(subject=subject0, predicate=p):
-        results_list.append(obj)
-        # recursively
-        multi_hop_traversal(g=g, subject0=obj, p=p, results_list=results_list)  # the second parameter
+    components, component_of = strongly_connected_components(adjacency=adjacency, roots=sources)
+    reach = []  # component number -> sorted id array of everything it reaches
+    for number, members in enumerate(components):  # sinks first
+        parts = []
+        cyclic = len(members) > 1
+        for member in members:
+            for nxt in adjacency.row(member).tolist():
+                successor = component_of[nxt]
+                if successor != number:
+                    parts.append(reach[successor])
+                    parts.append(components[successor])
+                elif nxt == member:
+                    cyclic = True  # self loop
+        if cyclic:
+            parts.append(members)
+        reach.append(np.unique(np.concatenate(parts)).astype(ID_DTYPE) if parts else EMPTY_IDS)
+    return {source: reach[component_of[source]] for source in sources}
 
 
 def merge_dicts(*dict_args):
@@ -44,16 +119,3 @@ def merge_dicts(*dict_args):
         result.update(dictionary)
     return result
 
-
-class TimeRecorder(object):
-    def __init__(self):
-        self.tick_time = 0
-
-    def tick(self):
-        self.tick_time = time.time()
-
-    def tock(self, process_name):
-        now = time.time()
-        elpased = now - self.tick_time
-        self.tick_time = now
-        print("\n\n[%s] used time : %8.6fs" % (process_name, elpased))
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+@file: cache.py
+@time: 2021/2/24 2:15 下午
+@desc: memory bounded cache, for the building indexes and for sub-expression results
+
+"""
+
+from collections import OrderedDict
+import threading
+
+
+class IndexCache(object):
+    """
+    dict-like cache with a memory budget in bytes;
+    the size of an entry is `sizer(value)`, entries are evicted by 'LRU' or 'LFU' once the budget is exceeded;
+    an entry for which `pinned(value)` is true is never evicted (e.g. a building index holding edits).
+    hits / misses are counted by get() and [], `in` only peeks
+    """
+
+    def __init__(self, budget, policy='LRU', sizer=None, pinned=None):
+        if policy not in ('LRU', 'LFU'):
+            raise ValueError("unknown eviction policy: %s" % policy)
+        self.budget = budget
+        self.policy = policy
+        self.sizer = sizer or (lambda value: getattr(value, 'nbytes', 0))
+        self.pinned = pinned or (lambda value: False)
+        self.entries = OrderedDict()  # key -> value, least recently used first
+        self.sizes = {}
+        self.uses = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.RLock()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(list(self.entries))
+
+    def __getitem__(self, key):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                raise KeyError(key)
+            self.hits += 1
+            self.uses[key] += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.sizes[key]
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            self.sizes[key] = self.sizer(value)
+            self.uses.setdefault(key, 0)
+            self.total_bytes += self.sizes[key]
+            self.evict(keep=key)
+
+    def __delitem__(self, key):
+        with self.lock:
+            del self.entries[key]
+            self.total_bytes -= self.sizes.pop(key)
+            del self.uses[key]
+
+    def pop(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                return default
+            value = self.entries[key]
+            del self[key]
+            return value
+
+    def clear(self):
+        with self.lock:
+            for key in list(self.entries):
+                del self[key]
+
+    def resize(self, key):
+        """ account an entry again after it grew or shrank (e.g. its graph was loaded or released) """
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.sizes[key]
+                self.sizes[key] = self.sizer(self.entries[key])
+                self.total_bytes += self.sizes[key]
+                self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """ drop entries until the budget holds; `keep` (the entry just used) and pinned entries are never dropped """
+        while self.total_bytes > self.budget and len(self.entries) > 1:
+            victim = self.victim(keep=keep)
+            if victim is None:
+                break
+            del self[victim]
+            self.evictions += 1
+
+    def victim(self, keep=None):
+        # least recently used first
+        candidates = [key for key in self.entries if key != keep and not self.pinned(self.entries[key])]
+        if not candidates:
+            return None
+        if self.policy == 'LRU':
+            return candidates[0]
+        return min(candidates, key=lambda key: self.uses[key])  # ties go to the least recently used
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries),
+                    'bytes': self.total_bytes,
+                    'budget': self.budget,
+                    'policy': self.policy,
+                    'pinned': sum(1 for value in self.entries.values() if self.pinned(value)),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions}
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+
+"""
+
+@file: metrics.py
+@time: 2021/3/10 3:30 下午
+@desc: instrumentation of the query path: named counters and latency histograms (timers),
+       snapshots as text, JSON or Prometheus exposition format, served from a local HTTP endpoint
+
+"""
+
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+
+# upper bounds of the latency buckets in seconds, 50us .. 10s; the last bucket is +Inf
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class Timer(object):
+    """ `with metrics.timer('parse'):` observes the seconds spent in the block """
+
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class NullTimer(object):
+    """ the timer of a disabled registry: does nothing """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+class Metrics(object):
+    """
+    registry of counters (name -> int) and histograms (name -> counts per LATENCY_BUCKETS, sum, max), thread safe;
+    disabled, timer() / count() / observe() return at once
+    """
+
+    def __init__(self, enabled=True, buckets=LATENCY_BUCKETS, prefix='energon'):
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self.prefix = prefix
+        self.counters = {}
+        self.histograms = {}  # name -> [counts per bucket (+Inf last), sum, max]
+        self.lock = threading.Lock()
+
+    def timer(self, name):
+        return Timer(self, name) if self.enabled else NULL_TIMER
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        if not self.enabled:
+            return
+        bucket = bisect_left(self.buckets, seconds)
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = [[0] * (len(self.buckets) + 1), 0.0, 0.0]
+            histogram[0][bucket] += 1
+            histogram[1] += seconds
+            if seconds > histogram[2]:
+                histogram[2] = seconds
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def drain(self):
+        """ the raw state since the last drain, for merge() into another registry (e.g. from a worker process) """
+        with self.lock:
+            state = {'counters': self.counters, 'histograms': self.histograms}
+            self.counters = {}
+            self.histograms = {}
+        return state
+
+    def merge(self, state):
+        """ add the drain() of another registry with the same buckets """
+        if not self.enabled or not state:
+            return
+        with self.lock:
+            for name, value in state['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for name, (counts, total, maximum) in state['histograms'].items():
+                histogram = self.histograms.get(name)
+                if histogram is None:
+                    histogram = self.histograms[name] = [[0] * (len(self.buckets) + 1), 0.0, 0.0]
+                histogram[0] = [a + b for a, b in zip(histogram[0], counts)]
+                histogram[1] += total
+                histogram[2] = max(histogram[2], maximum)
+
+    def quantile(self, counts, q, maximum):
+        """
+        the q quantile estimated from the bucket counts, interpolated within its bucket like Prometheus'
+        histogram_quantile, at most the largest observation; None when empty
+        """
+        total = sum(counts)
+        if not total:
+            return None
+        rank, seen, lower = q * total, 0, 0.0
+        for bound, count in zip(self.buckets + (maximum,), counts):
+            if count and seen + count >= rank:
+                return min(lower + (bound - lower) * (rank - seen) / count, maximum)
+            seen += count
+            lower = bound
+        return maximum
+
+    def snapshot(self):
+        """ {'counters': {name: n}, 'timers': {name: {'count', 'sum', 'mean', 'max', 'p50', 'p90', 'p99'}}} """
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {name: (list(counts), total, maximum)
+                          for name, (counts, total, maximum) in self.histograms.items()}
+        timers = {}
+        for name, (counts, total, maximum) in sorted(histograms.items()):
+            count = sum(counts)
+            timer = {'count': count, 'sum': total, 'mean': total / count if count else 0.0, 'max': maximum}
+            for q in QUANTILES:
+                timer['p%d' % round(q * 100)] = self.quantile(counts, q, maximum)
+            timers[name] = timer
+        return {'counters': dict(sorted(counters.items())), 'timers': timers}
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_text(self):
+        snapshot = self.snapshot()
+        lines = ['%-24s %10d' % (name, value) for name, value in snapshot['counters'].items()]
+        if snapshot['timers']:
+            lines.append('%-24s %10s %12s %12s %12s %12s %12s' % ('timer', 'count', 'mean', 'p50', 'p90', 'p99', 'max'))
+        for name, timer in snapshot['timers'].items():
+            lines.append('%-24s %10d %12s %12s %12s %12s %12s' % (
+                name, timer['count'], ms(timer['mean']), ms(timer['p50']), ms(timer['p90']), ms(timer['p99']),
+                ms(timer['max'])))
+        return '\n'.join(lines)
+
+    def to_prometheus(self):
+        """ text exposition format: counters as <prefix>_<name>_total, timers as <prefix>_<name>_seconds histograms """
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((name, (list(counts), total)) for name, (counts, total, _) in self.histograms.items())
+        lines = []
+        for name, value in counters:
+            metric = '%s_%s_total' % (self.prefix, metric_name(name))
+            lines.append('# TYPE %s counter' % metric)
+            lines.append('%s %d' % (metric, value))
+        for name, (counts, total) in histograms:
+            metric = '%s_%s_seconds' % (self.prefix, metric_name(name))
+            lines.append('# TYPE %s histogram' % metric)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                lines.append('%s_bucket{le="%s"} %d' % (metric, '+Inf' if bound == float('inf') else repr(bound),
+                                                        cumulative))
+            lines.append('%s_sum %r' % (metric, total))
+            lines.append('%s_count %d' % (metric, cumulative))
+        return '\n'.join(lines) + '\n'
+
+
+def metric_name(name):
+    """ 'load building' -> 'load_building' """
+    return ''.join(c if c.isalnum() else '_' for c in name)
+
+
+def ms(seconds):
+    return '-' if seconds is None else '%.3fms' % (seconds * 1000)
+
+
+def serve_metrics(metrics, host='127.0.0.1', port=9478):
+    """
+    GET /metrics (Prometheus exposition format), /metrics.json or /metrics.txt on a daemon thread;
+    returns the ThreadingHTTPServer, shutdown() stops it
+    """
+    formats = {'/metrics': ('text/plain; version=0.0.4', metrics.to_prometheus),
+               '/metrics.json': ('application/json', metrics.to_json),
+               '/metrics.txt': ('text/plain', metrics.to_text)}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in formats:
+                self.send_error(404)
+                return
+            content_type, render = formats[self.path]
+            body = render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass  # no line per scrape
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server